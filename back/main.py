@@ -1,7 +1,9 @@
 from back.scripts.utils.argument_parser import ArgumentParser
 from back.scripts.utils.config import project_config
 from back.scripts.utils.config_manager import ConfigManager
+from back.scripts.utils.http_client import configure_http_client
 from back.scripts.utils.logger_manager import LoggerManager
+from back.scripts.utils.metrics import configure_metrics
 from back.scripts.workflow.data_warehouse import DataWarehouseWorkflow
 from back.scripts.workflow.workflow_manager import WorkflowManager
 
@@ -16,6 +18,8 @@ if __name__ == "__main__":
     project_config.load(config)
 
     LoggerManager.configure_logger(config)
+    configure_metrics(config)
+    configure_http_client(config)
 
     workflow_manager = WorkflowManager(args, config)
     workflow_manager.run_workflow()
@@ -3,6 +3,7 @@ import logging
 import pandas as pd
 
 from back.scripts.communities.loaders.ofgl import OfglLoader
+from back.scripts.datasets.sirene import SireneWorkflow
 from back.scripts.datasets.utils import BaseDataset
 from back.scripts.loaders.base_loader import BaseLoader
 from back.scripts.utils.config import project_config
@@ -29,6 +30,10 @@ class CommunitiesSelector(BaseDataset):
     def get_config_key(cls) -> str:
         return "communities"
 
+    @classmethod
+    def get_dependencies(cls) -> list[type[BaseDataset]]:
+        return [OfglLoader, SireneWorkflow]
+
     @tracker(ulogger=LOGGER, log_start=True)
     def run(self):
         if self.output_filename.exists():
@@ -60,10 +65,15 @@ class CommunitiesSelector(BaseDataset):
 
     @tracker(ulogger=LOGGER, log_start=True)
     def add_sirene_infos(self, frame: pd.DataFrame) -> pd.DataFrame:
-        sirene = pd.read_parquet(
-            project_config["sirene"]["combined_filename"],
-            columns=["siren", "naf8", "tranche_effectif", "raison_sociale", "is_active"],
-        ).pipe(lambda df: df[df["naf8"].isin(["8411Z", "8710C", "3700Z", "8413Z"])])
+        sirene = (
+            SireneWorkflow.lookup(
+                project_config,
+                pd.concat([frame["siren"], frame["siren_epci"]]).dropna().unique(),
+                columns=["siren", "naf8", "tranche_effectif", "raison_sociale", "is_active"],
+            )
+            .to_pandas()
+            .pipe(lambda df: df[df["naf8"].isin(["8411Z", "8710C", "3700Z", "8413Z"])])
+        )
 
         return (
             frame.merge(sirene, on="siren", how="left")
@@ -110,6 +120,7 @@ class CommunitiesSelector(BaseDataset):
             geo_metrics_df = (
                 BaseLoader.loader_factory(
                     resource_url,
+                    file_format="csv",
                     dtype={"code_insee": str},
                     columns=["code_insee", "superficie_km2", "code_postal"],
                 )
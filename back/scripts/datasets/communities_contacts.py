@@ -1,24 +1,48 @@
-import json
-import os
+import logging
+import shutil
+import subprocess
 import tarfile
-import urllib.request
-from io import StringIO
+from collections.abc import Iterator
+from contextlib import contextmanager
 from pathlib import Path
 
+import ijson
 import pandas as pd
 import polars as pl
 from polars import col
 
 from back.scripts.datasets.datagouv_catalog import DataGouvCatalog
 from back.scripts.datasets.utils import BaseDataset
-from back.scripts.utils.dataframe_operation import IdentifierFormat, normalize_identifiant
+from back.scripts.utils.dataframe_operation import (
+    IdentifierFormat,
+    normalize_identifiant_lazy,
+)
+from back.scripts.utils.http_client import get_http_client
+
+LOGGER = logging.getLogger(__name__)
+
+# Fields of the services used to build the contacts, the others are dropped while parsing.
+SERVICE_SCHEMA = {
+    "nom": pl.String,
+    "pivot": pl.List(
+        pl.Struct({"type_service_local": pl.String, "code_insee_commune": pl.List(pl.String)})
+    ),
+    "siren": pl.String,
+    "siret": pl.String,
+    "sve": pl.List(pl.String),
+    "adresse_courriel": pl.List(pl.String),
+    "formulaire_contact": pl.List(pl.String),
+}
 
 
 class CommunitiesContact(BaseDataset):
     """
     Fetch from data.gouv a specific file that contains emails and contact forms for all french administrations,
     including communities.
-    The json file is contained within a tar.bz2 file so requires multiple steps to read.
+    The json file is contained within a tar.bz2 file. It is read directly from the archive,
+    without extracting it to disk, and parsed incrementally to only keep the fields of `SERVICE_SCHEMA`.
+    The archive can be decompressed by an external, parallel, program such as lbzip2
+    (`decompressor` in the config), the python bz2 module being used if it is not available.
     """
 
     DATASET_ID = "53699fe4a3a729239d206227"
@@ -27,57 +51,87 @@ class CommunitiesContact(BaseDataset):
     def get_config_key(cls) -> str:
         return "communities_contacts"
 
+    @classmethod
+    def get_dependencies(cls) -> list[type[BaseDataset]]:
+        return [DataGouvCatalog]
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.interm_filename = self.data_folder / "raw.tar.bz2"
-        self.extracted_dir = self.data_folder / "extracted"
+        self.decompressor = self.config.get("decompressor")
 
     def run(self):
         if self.output_filename.exists():
             return
         self._download_targz()
-        self._extract_targz()
-
-        filename = [
-            fn
-            for fn in os.listdir(self.extracted_dir)
-            if Path(fn).suffix == ".json" and not fn.startswith("._")
-        ][0]
-        with open(self.extracted_dir / filename, "r") as f:
-            content = json.load(f)["service"]
-            df = (
-                pd.read_json(StringIO(json.dumps(content)))
-                .pipe(normalize_identifiant, "siren", format=IdentifierFormat.SIREN)
-                .pipe(normalize_identifiant, "siret", format=IdentifierFormat.SIRET)
-            )
-            df = (
-                pl.from_pandas(df)
-                .select(
-                    "nom",
-                    "pivot",
-                    col("siren").fill_null(col("siret").str.slice(0, 9)).alias("siren"),
-                    "sve",
-                    "adresse_courriel",
-                    "formulaire_contact",
-                )
-                .pipe(self.parse_pivot)
-                .filter(col("type").is_not_null())
-                .pipe(self.normalize_contact)
-                .filter(col("contact").is_not_null())
+
+        df = (
+            self._read_services()
+            .lazy()
+            .pipe(normalize_identifiant_lazy, "siren", format=IdentifierFormat.SIREN)
+            .pipe(normalize_identifiant_lazy, "siret", format=IdentifierFormat.SIRET)
+            .select(
+                "nom",
+                "pivot",
+                col("siren").fill_null(col("siret").str.slice(0, 9)).alias("siren"),
+                "sve",
+                "adresse_courriel",
+                "formulaire_contact",
             )
+            .collect()
+            .pipe(self.parse_pivot)
+            .filter(col("type").is_not_null())
+            .pipe(self.normalize_contact)
+            .filter(col("contact").is_not_null())
+        )
         df.write_parquet(self.output_filename)
 
     def _download_targz(self):
         if self.interm_filename.exists():
             return
         url = self._db_url()
-        urllib.request.urlretrieve(url, self.interm_filename)
+        get_http_client().download(url, self.interm_filename)
 
-    def _extract_targz(self):
-        if self.extracted_dir.exists():
+    def _read_services(self) -> pl.DataFrame:
+        """
+        Parse the services of the json file of the archive, one at a time.
+        """
+        with self._open_archive() as tar:
+            for member in tar:
+                name = Path(member.name).name
+                if not member.isfile() or Path(name).suffix != ".json" or name.startswith("._"):
+                    continue
+                services = ijson.items(tar.extractfile(member), "service.item")
+                return pl.DataFrame(
+                    (
+                        {field: service.get(field) for field in SERVICE_SCHEMA}
+                        for service in services
+                    ),
+                    schema=SERVICE_SCHEMA,
+                )
+        raise FileNotFoundError(f"No json file found in {self.interm_filename}")
+
+    @contextmanager
+    def _open_archive(self) -> Iterator[tarfile.TarFile]:
+        """
+        Open the archive as a stream, decompressed by the configured program if it is available.
+        """
+        program = shutil.which(self.decompressor) if self.decompressor else None
+        if program is None:
+            if self.decompressor:
+                LOGGER.warning(f"{self.decompressor} is not available, using the bz2 module")
+            with tarfile.open(self.interm_filename, "r|bz2") as tar:
+                yield tar
             return
-        with tarfile.open(self.interm_filename, "r:bz2") as tar:
-            tar.extractall(path=self.extracted_dir)
+
+        with subprocess.Popen(
+            [program, "-d", "-c", str(self.interm_filename)], stdout=subprocess.PIPE
+        ) as process:
+            try:
+                with tarfile.open(fileobj=process.stdout, mode="r|") as tar:
+                    yield tar
+            finally:
+                process.kill()
 
     def _db_url(self):
         url = self.config["url"]
@@ -102,10 +156,13 @@ class CommunitiesContact(BaseDataset):
         return (
             df.explode("pivot")
             .with_columns(
-                pl.col("pivot").struct[1].replace_strict(matching, default=None).alias("type")
+                pl.col("pivot")
+                .struct.field("type_service_local")
+                .replace_strict(matching, default=None)
+                .alias("type")
             )
             .with_columns(
-                pl.col("pivot").struct[0].alias("code_insee"),
+                pl.col("pivot").struct.field("code_insee_commune").alias("code_insee"),
             )
             .with_columns(
                 pl.when(col("code_insee").list.len() > 0).then(
@@ -8,9 +8,10 @@ from polars import col
 
 from back.scripts.communities.communities_selector import CommunitiesSelector
 from back.scripts.datasets.utils import BaseDataset
-from back.scripts.loaders.base_loader import BaseLoader, retry_session
+from back.scripts.loaders.base_loader import BaseLoader
 from back.scripts.utils.dataframe_operation import expand_json_columns, normalize_column_names
 from back.scripts.utils.decorators import tracker
+from back.scripts.utils.http_client import get_http_client
 
 LOGGER = logging.getLogger(__name__)
 
@@ -27,6 +28,10 @@ class DataGouvCatalog(BaseDataset):
     def get_config_key(cls) -> str:
         return "datagouv_catalog"
 
+    @classmethod
+    def get_dependencies(cls) -> list[type[BaseDataset]]:
+        return [CommunitiesSelector]
+
     @tracker(ulogger=LOGGER, log_start=True)
     def run(self):
         if self.output_filename.exists():
@@ -100,8 +105,7 @@ class DataGouvCatalog(BaseDataset):
         It weights 7x less but does not appear on the catalog and seems to have a different url daily.
         See the page for investigation : https://www.data.gouv.fr/fr/datasets/catalogue-des-donnees-de-data-gouv-fr/#
         """
-        session = retry_session(retries=3)
-        response = session.get(
+        response = get_http_client().get(
             "https://www.data.gouv.fr/api/1/datasets/catalogue-des-donnees-de-data-gouv-fr/"
         )
 
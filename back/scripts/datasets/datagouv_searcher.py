@@ -23,6 +23,10 @@ class DataGouvSearcher(BaseDataset):
     def get_config_key(cls) -> str:
         return "datagouv_search"
 
+    @classmethod
+    def get_dependencies(cls) -> list[type[BaseDataset]]:
+        return [DataGouvCatalog]
+
     def run(self):
         if self.output_filename.exists():
             return
@@ -1,22 +1,43 @@
+import contextvars
+import functools
 import hashlib
 import json
 import logging
-import urllib.request
-from collections import defaultdict
+import multiprocessing
+import os
+import shutil
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 from urllib.error import HTTPError
 
 import pandas as pd
 import polars as pl
+import pyarrow.parquet as pq
+import requests
 from tqdm import tqdm
 
 from back.scripts.datasets.utils import BaseDataset
-from back.scripts.loaders import BaseLoader
+from back.scripts.loaders import BaseLoader, EncodedDataLoader
+from back.scripts.utils import metrics
+from back.scripts.utils.config import project_config
 from back.scripts.utils.decorators import tracker
+from back.scripts.utils.download_cache import CATALOG_FINGERPRINT_COLUMNS, DownloadCache
+from back.scripts.utils.http_client import get_http_client
 from back.scripts.utils.typing import PandasRow
+from back.scripts.workflow.workflow_scheduler import init_worker
 
 LOGGER = logging.getLogger(__name__)
 
+# Default concurrency of the download stage, can be overridden in the dataset config.
+DOWNLOAD_WORKERS = 4
+# Client errors worth retrying in a later run, the other ones are recorded as failures.
+TRANSIENT_HTTP_CODES = {408, 425, 429}
+
+# Aggregator used by the normalization worker processes, set by `_init_normalization_worker`.
+_WORKER_AGGREGATOR: "DatasetAggregator | None" = None
+
 
 def _sha256(s: str | None) -> str | None:
     """
@@ -54,15 +75,54 @@ class DatasetAggregator(BaseDataset):
 
     Intermediate files directory and final combined filename are defined in the config.yaml file,
     respectively as "data_folder" and "combined_filename".
+
+    Downloads are made by a pool of threads ("download_workers" in the config) sharing the HTTP
+    client of the process, which limits the simultaneous connections per host, while the normalization
+    is made in the main thread in the order of the input files.
+
+    With "normalization_workers" greater than 1 in the config, the normalization is instead made in
+    a pool of processes. Each file is then normalized by a copy of the aggregator, whose report
+    (see `_normalization_report`) is merged back in the order of the input files, so that the
+    outputs are the same as with a sequential run. Subclasses that record additional information
+    during the normalization must extend `_reset_normalization_report`, `_normalization_report`
+    and `_merge_normalization_report`.
+
+    With "refresh_downloads" set to True in the config, already downloaded files are refreshed
+    instead of being kept as is. The download is skipped when the data.gouv catalog checksum of
+    the file is unchanged, otherwise a conditional request is made using the ETag and
+    Last-Modified headers of the previous download (see `DownloadCache`).
+    Only the files that actually changed are normalized again.
+
+    Files whose download failed with a client error are recorded as failures in the
+    `DownloadCache`. As long as the data.gouv catalog checksum of the file is unchanged,
+    the next runs skip them and report their error again, unless the downloads are refreshed.
+
+    The normalized files used for the combined file are recorded in a manifest
+    (modification time, size, number of rows and schema of each file), so that the combined
+    file is only rebuilt when a normalized file has been added, replaced or removed.
+    With "partitioned_output" set to True in the config, the combined output is a directory
+    with one parquet file per source, all sharing the same schema. Only the partitions of
+    the files that changed are then rewritten, unless the common schema itself changes.
     """
 
+    # Whether SSL certificates are checked when downloading raw files
+    verify_ssl: bool = True
+
     def __init__(self, files: pd.DataFrame, main_config: dict):
         """
         Initialize a DatasetAggregator Instance which inherits attributes from BaseDataset.
         """
         super().__init__(main_config)
-        self.files_in_scope = files.pipe(self._ensure_url_hash)
+        self.files_in_scope = files.pipe(self._ensure_url_hash).pipe(
+            self._ensure_catalog_fingerprint
+        )
         self.errors = defaultdict(list)
+        self.download_workers = self.config.get("download_workers", DOWNLOAD_WORKERS)
+        self.normalization_workers = self.config.get("normalization_workers", 1)
+        self.refresh_downloads = self.config.get("refresh_downloads", False)
+        self.partitioned_output = self.config.get("partitioned_output", False)
+        self.manifest_filename = self.data_folder / "manifest.json"
+        self.download_cache = DownloadCache(self.data_folder)
 
     def _ensure_url_hash(self, frame: pd.DataFrame) -> pd.DataFrame:
         """
@@ -79,57 +139,224 @@ class DatasetAggregator(BaseDataset):
             return frame.assign(url_hash=hashes)
         return frame.fillna({"url_hash": hashes})
 
+    @staticmethod
+    def _ensure_catalog_fingerprint(frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        Rename the data.gouv catalog columns describing the version of a file,
+        as their original names can not be used as attributes of the rows.
+        """
+        frame = frame.rename(columns=CATALOG_FINGERPRINT_COLUMNS)
+        missing = {c: None for c in CATALOG_FINGERPRINT_COLUMNS.values() if c not in frame}
+        return frame.assign(**missing)
+
     @tracker(ulogger=LOGGER, log_start=True)
     def run(self) -> None:
-        if self.output_filename.exists():
-            return
+        """
+        Only the files without a normalized file (all of them when refreshing the downloads)
+        are processed, and the combined file is only rewritten if the normalized files changed.
+        """
         self._process_files()
         self._post_process()
         self._concatenate_files()
         with open(self.data_folder / "errors.json", "w") as f:
             json.dump(self.errors, f)
 
+    @tracker(ulogger=LOGGER)
     def _process_files(self) -> None:
-        for file_infos in tqdm(self._remaining_to_normalize()):
+        """
+        Download the remaining files in a pool of threads and normalize them
+        as soon as they are available, so that downloads overlap with the normalization.
+        """
+        files = []
+        for file_infos in self._remaining_to_normalize():
             if file_infos.url is None or pd.isna(file_infos.url):
                 LOGGER.warning(f"URL not specified for file {file_infos.title}")
                 continue
+            failure = self._known_failure(file_infos)
+            if failure is not None:
+                LOGGER.debug(f"Download of {file_infos.url} already failed, skipping")
+                self.errors[failure].append(file_infos.url)
+                continue
+            files.append(file_infos)
 
-            try:
-                self._process_file(file_infos)
-            except Exception as e:
-                LOGGER.warning(f"Failed to process file {file_infos.url}: {e}")
-                self.errors[str(e)].append(file_infos.url)
+        parallel = self.normalization_workers > 1 and len(files) > 1
+        with (
+            self._normalization_pool() if parallel else nullcontext() as normalization_pool,
+            ThreadPoolExecutor(
+                max_workers=max(1, self.download_workers), thread_name_prefix="download"
+            ) as download_pool,
+        ):
+            # Each download runs in a copy of the current context, so that its spans are
+            # children of the span of this method.
+            downloads = [
+                download_pool.submit(contextvars.copy_context().run, self._download_file, f)
+                for f in files
+            ]
+            pending = []
+            for file_infos, download in tqdm(
+                zip(files, downloads, strict=True), total=len(files)
+            ):
+                try:
+                    download_error = download.result()
+                except Exception as e:
+                    # Failures outside of the request itself (file system, cache, ...)
+                    LOGGER.warning(f"Failed to download file {file_infos.url}: {e}")
+                    download_error = str(e)
+                if not parallel:
+                    self._record_error(download_error, file_infos.url)
+                    self._safe_normalize_file(file_infos)
+                    continue
+                normalization = normalization_pool.submit(
+                    _normalize_in_worker,
+                    file_infos._fields,
+                    tuple(file_infos),
+                    metrics.current_span(),
+                )
+                pending.append((file_infos, download_error, normalization))
 
-    def _post_process(self) -> None:
-        pass
+            # Reports are merged in the order of the input files to get the same outputs
+            # as a sequential run.
+            for file_infos, download_error, normalization in pending:
+                self._record_error(download_error, file_infos.url)
+                try:
+                    self._merge_normalization_report(normalization.result())
+                except Exception as e:
+                    LOGGER.warning(f"Failed to process file {file_infos.url}: {e}")
+                    self.errors[str(e)].append(file_infos.url)
+
+    def _normalization_pool(self) -> ProcessPoolExecutor:
+        """
+        Pool of spawned processes : polars can not be used in a forked process
+        once it has been used by its parent.
+        """
+        return ProcessPoolExecutor(
+            max_workers=self.normalization_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_normalization_worker,
+            initargs=(self, project_config.dump()),
+        )
 
-    def _process_file(self, file: PandasRow) -> None:
+    def _known_failure(self, file_metadata: PandasRow) -> str | None:
+        if self.refresh_downloads:
+            return None
+        entry = self.download_cache.get(file_metadata.url_hash)
+        return DownloadCache.known_failure(entry, file_metadata)
+
+    def _record_error(self, error: str | None, url: str) -> None:
+        if error is not None:
+            self.errors[error].append(url)
+
+    def _safe_normalize_file(self, file_metadata: PandasRow) -> None:
+        try:
+            self._normalize_file(file_metadata)
+        except Exception as e:
+            LOGGER.warning(f"Failed to process file {file_metadata.url}: {e}")
+            self.errors[str(e)].append(file_metadata.url)
+
+    def _reset_normalization_report(self) -> None:
         """
-        Download and normalize a spécific file.
+        Clear the information recorded during the normalization of a file.
         """
-        self._download_file(file)
-        self._normalize_file(file)
+        self.errors = defaultdict(list)
 
-    def _download_file(self, file_metadata: PandasRow) -> None:
+    def _normalization_report(self) -> dict:
+        """
+        Information recorded during the normalization of a file by a worker process.
+        """
+        return {"errors": dict(self.errors)}
+
+    def _merge_normalization_report(self, report: dict) -> None:
+        """
+        Merge into the aggregator the report of a file normalized by a worker process.
+        """
+        for error, urls in report["errors"].items():
+            self.errors[error].extend(urls)
+
+    def _post_process(self) -> None:
+        pass
+
+    def _download_file(self, file_metadata: PandasRow) -> str | None:
         """
         Save locally the output of the URL.
+        As it is run in a download thread, the error is returned instead of being recorded.
+
+        Returns:
+            str | None: the error message if the download failed.
         """
         output_filename = self._dataset_filename(file_metadata, "raw")
+        cached = self.download_cache.get(file_metadata.url_hash)
         if output_filename.exists():
-            LOGGER.debug(f"File {output_filename} already exists, skipping")
-            return
+            if not self.refresh_downloads:
+                LOGGER.debug(f"File {output_filename} already exists, skipping")
+                return None
+            if DownloadCache.is_unchanged_in_catalog(cached, file_metadata):
+                LOGGER.debug(f"File {output_filename} unchanged in catalog, skipping")
+                return None
+        else:
+            # Validators of a previous download are meaningless without the file.
+            cached = {}
         output_filename.parent.mkdir(exist_ok=True, parents=True)
         try:
-            urllib.request.urlretrieve(file_metadata.url, output_filename)
-        except HTTPError as error:
+            # An interrupted download leaves a `.part` file, resumed by the next run.
+            validators = self._download_http(
+                file_metadata.url,
+                output_filename,
+                headers=DownloadCache.conditional_headers(cached),
+            )
+        except (HTTPError, requests.HTTPError) as error:
             LOGGER.warning(f"Failed to download file {file_metadata.url}: {error}")
-            msg = f"HTTP error {error.code}"
-            self.errors[msg].append(file_metadata.url)
+            code = error.code if isinstance(error, HTTPError) else error.response.status_code
+            if 400 <= code < 500 and code not in TRANSIENT_HTTP_CODES:
+                self.download_cache.set_failure(
+                    file_metadata.url_hash, file_metadata, f"HTTP error {code}"
+                )
+            return f"HTTP error {code}"
         except Exception as e:
             LOGGER.warning(f"Failed to download file {file_metadata.url}: {e}")
-            self.errors[str(e)].append(file_metadata.url)
+            return str(e)
+
+        fingerprint = DownloadCache.catalog_fingerprint(file_metadata)
+        if validators is None:
+            LOGGER.debug(f"File {file_metadata.url} not modified, skipping")
+            self.download_cache.set(file_metadata.url_hash, cached | fingerprint)
+            return None
+
+        self._invalidate_normalized_file(file_metadata)
+        self.download_cache.set(
+            file_metadata.url_hash, {"url": file_metadata.url} | validators | fingerprint
+        )
         LOGGER.debug(f"Downloaded file {file_metadata.url}")
+        return None
+
+    def _invalidate_normalized_file(self, file_metadata: PandasRow) -> None:
+        """
+        Remove the files derived from a raw file that has just been downloaded.
+        """
+        self._dataset_filename(file_metadata, "norm").unlink(missing_ok=True)
+
+    def _download_http(
+        self, url: str, output_filename: Path, headers: dict | None = None
+    ) -> dict | None:
+        """
+        Stream the content of a URL to a file with the HTTP client shared by the download threads,
+        which reuses the connections and bounds the number of simultaneous connections per host.
+        The file is only replaced once the download is complete.
+
+        Returns:
+            dict | None: the ETag and Last-Modified headers of the response (empty for a local URL),
+            or None if the server answered that the file was not modified.
+        """
+        response = get_http_client().download(
+            url, output_filename, headers=headers, verify=self.verify_ssl
+        )
+        if response is None:
+            return {}
+        if response.status_code == 304:
+            return None
+        return {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
 
     def _dataset_filename(self, file_metadata: PandasRow, step: str) -> Path:
         """
@@ -141,6 +368,7 @@ class DatasetAggregator(BaseDataset):
             / f"{step}.{file_metadata.format if step == 'raw' else 'parquet'}"
         )
 
+    @tracker(ulogger=LOGGER, level="debug")
     def _normalize_file(self, file_metadata: PandasRow) -> None:
         out_filename = self._dataset_filename(file_metadata, "norm")
         if out_filename.exists():
@@ -154,14 +382,26 @@ class DatasetAggregator(BaseDataset):
         df = self._read_parse_file(file_metadata, raw_filename)
         if isinstance(df, pd.DataFrame):
             df.to_parquet(out_filename, index=False)
+        elif isinstance(df, pl.LazyFrame):
+            df.sink_parquet(out_filename)
 
     def _read_parse_file(
         self, file_metadata: PandasRow, raw_filename: Path
-    ) -> pd.DataFrame | None:
+    ) -> pd.DataFrame | pl.LazyFrame | None:
+        """
+        Read a raw file into a normalized frame.
+        A LazyFrame is written in streaming to the normalized file.
+        """
         opts = {"dtype": str} if file_metadata.format == "csv" else {}
         loader = BaseLoader.loader_factory(raw_filename, **opts)
+        known_encoding = None
+        if isinstance(loader, EncodedDataLoader):
+            known_encoding = self.download_cache.get(file_metadata.url_hash).get("encoding")
+            loader.encoding = known_encoding
         try:
             df = loader.load()
+            if isinstance(loader, EncodedDataLoader) and loader.encoding != known_encoding:
+                self.download_cache.update(file_metadata.url_hash, encoding=loader.encoding)
             if not isinstance(df, pd.DataFrame):
                 LOGGER.error(f"Unable to load file into a DataFrame = {file_metadata.url}")
                 raise RuntimeError("Unable to load file into a DataFrame")
@@ -175,7 +415,10 @@ class DatasetAggregator(BaseDataset):
     def _remaining_to_normalize(self) -> list:
         """
         Select among the input files the ones for which we do not have yet the normalized file.
+        When refreshing the downloads, all the files must be checked.
         """
+        if self.refresh_downloads:
+            return list(self.files_in_scope.itertuples())
         current = pd.DataFrame(
             {
                 "url_hash": [
@@ -205,11 +448,137 @@ class DatasetAggregator(BaseDataset):
 
     def _concatenate_files(self) -> None:
         """
-        Concatenate all the normalized files which have succeeded into a single parquet file.
+        Concatenate the normalized files of the files in scope which have succeeded
+        into a single parquet file.
         This step is made in polars as the sum of all dataset by be heavy on memory.
         """
-        all_files = list(self.data_folder.glob("*/norm.parquet"))
-        LOGGER.info(f"Concatenating {len(all_files)} files for {str(self.output_filename)}")
-        dfs = [pl.scan_parquet(f) for f in all_files]
-        df = pl.concat(dfs, how="diagonal_relaxed")
-        df.sink_parquet(self.output_filename)
+        in_scope = set(self.files_in_scope["url_hash"].dropna())
+        all_files = {
+            f.parent.name: f
+            for f in sorted(self.data_folder.glob("*/norm.parquet"))
+            if f.parent.name in in_scope
+        }
+        previous = self._load_manifest()
+        manifest = {
+            "files": {
+                url_hash: self._manifest_entry(filename, previous["files"].get(url_hash))
+                for url_hash, filename in all_files.items()
+            },
+            "partitioned": self.partitioned_output,
+        }
+        unified_schema = pl.concat(
+            [pl.LazyFrame(schema=pl.read_parquet_schema(f)) for f in all_files.values()],
+            how="diagonal_relaxed",
+        ).collect_schema()
+        manifest["schema"] = _schema_fingerprint(unified_schema)
+
+        if self.output_filename.exists() and manifest == previous:
+            LOGGER.info(f"No change in normalized files for {str(self.output_filename)}")
+            return
+
+        if self.partitioned_output:
+            self._write_partitions(all_files, unified_schema, manifest, previous)
+        else:
+            LOGGER.info(f"Concatenating {len(all_files)} files for {str(self.output_filename)}")
+            if self.output_filename.is_dir():
+                shutil.rmtree(self.output_filename)
+            dfs = [pl.scan_parquet(f) for f in all_files.values()]
+            df = pl.concat(dfs, how="diagonal_relaxed")
+            df.sink_parquet(self.output_filename)
+
+        with open(self.manifest_filename, "w") as f:
+            json.dump(manifest, f, indent=1)
+
+    def _write_partitions(
+        self,
+        all_files: dict[str, Path],
+        unified_schema: pl.Schema,
+        manifest: dict,
+        previous: dict,
+    ) -> None:
+        """
+        Write one file per source in the output directory, casted to the common schema.
+        Only the sources that changed since the previous manifest are written.
+        """
+        full_rewrite = (
+            not self.output_filename.is_dir()
+            or not previous.get("partitioned")
+            or previous.get("schema") != manifest["schema"]
+        )
+        if not self.output_filename.is_dir():
+            self.output_filename.unlink(missing_ok=True)
+            self.output_filename.mkdir(parents=True)
+
+        to_write = [
+            url_hash
+            for url_hash, entry in manifest["files"].items()
+            if full_rewrite or previous["files"].get(url_hash) != entry
+        ]
+        to_remove = [
+            f for f in self.output_filename.glob("*.parquet") if f.stem not in all_files
+        ]
+        LOGGER.info(
+            f"Writing {len(to_write)} and removing {len(to_remove)} partitions "
+            f"of {str(self.output_filename)}"
+        )
+        empty = pl.LazyFrame(schema=unified_schema)
+        for url_hash in to_write:
+            partition = self.output_filename / f"{url_hash}.parquet"
+            part_filename = partition.with_name(partition.name + ".part")
+            pl.concat(
+                [empty, pl.scan_parquet(all_files[url_hash])], how="diagonal_relaxed"
+            ).sink_parquet(part_filename)
+            os.replace(part_filename, partition)
+        for f in to_remove:
+            f.unlink()
+
+    def _load_manifest(self) -> dict:
+        if not self.manifest_filename.exists():
+            return {"files": {}}
+        with open(self.manifest_filename) as f:
+            return json.load(f)
+
+    @staticmethod
+    def _manifest_entry(filename: Path, previous: dict | None) -> dict:
+        """
+        Description of a normalized file. Parquet metadata are only read if the file changed.
+        """
+        stat = filename.stat()
+        entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+        if previous and all(previous.get(k) == v for k, v in entry.items()):
+            return previous
+        return entry | {
+            "num_rows": pq.read_metadata(filename).num_rows,
+            "schema": _schema_fingerprint(pl.read_parquet_schema(filename)),
+        }
+
+
+def _init_normalization_worker(aggregator: DatasetAggregator, config: dict | None) -> None:
+    global _WORKER_AGGREGATOR
+    init_worker(config)
+    _WORKER_AGGREGATOR = aggregator
+
+
+def _normalize_in_worker(
+    fields: tuple[str, ...], values: tuple, span: tuple[str, str] | None = None
+) -> dict:
+    """
+    Normalize a file in a worker process and return the corresponding report.
+    Rows from `DataFrame.itertuples` can not be pickled, so they are sent as fields and values.
+    The metrics of the file are attached to the span of the main process.
+    """
+    metrics.attach_span(span)
+    file_metadata = _row_class(fields)(*values)
+    _WORKER_AGGREGATOR._reset_normalization_report()
+    _WORKER_AGGREGATOR._safe_normalize_file(file_metadata)
+    return _WORKER_AGGREGATOR._normalization_report()
+
+
+@functools.cache
+def _row_class(fields: tuple[str, ...]) -> type:
+    return namedtuple("Pandas", fields, rename=True)
+
+
+def _schema_fingerprint(schema: pl.Schema | dict) -> str:
+    content = json.dumps([(name, str(dtype)) for name, dtype in schema.items()])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
@@ -1,11 +1,20 @@
+import io
 import logging
-import urllib.request
+import mmap
+import multiprocessing
+import re
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from itertools import chain
+from itertools import chain, islice
+from pathlib import Path
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from bs4 import BeautifulSoup
 from bs4.element import Tag
+from lxml import etree
 from tqdm import tqdm
 
 from back.scripts.datasets.utils import BaseDataset
@@ -16,7 +25,10 @@ from back.scripts.utils.beautifulsoup_utils import (
     get_tag_int,
     get_tag_text,
 )
+from back.scripts.utils.config import project_config
 from back.scripts.utils.decorators import tracker
+from back.scripts.utils.http_client import get_http_client
+from back.scripts.workflow.workflow_scheduler import init_worker
 
 LOGGER = logging.getLogger(__name__)
 PARSED_SECTIONS = ["mandatElectifDto"]
@@ -32,6 +44,46 @@ GENERAL_TAGS = [
 UNPUBLISHED_VALUES = [
     "[Données non publiées]",
 ]
+# Opening tag of a declaration, but not of `declarationVersion`, `declarationModificative`, ...
+DECLARATION_START = re.compile(rb"<declaration[\s>]")
+DECLARATION_END = b"</declaration>"
+# Number of chunks per parsing worker, so that a slow chunk does not hold the others back.
+CHUNKS_PER_WORKER = 4
+# Schema of the output, so that the batches of declarations are written with the same types.
+# The types are those that pandas infers from the records, as with `xml_parser: soup`.
+DECLARATION_SCHEMA = pa.schema(
+    [
+        ("date_depot", pa.timestamp("ns")),
+        ("declaration_id", pa.string()),
+        ("complete", pa.bool_()),
+        ("nothing_to_declare", pa.bool_()),
+        ("type_declaration", pa.string()),
+        ("mandat", pa.string()),
+        ("civilite", pa.string()),
+        ("nom", pa.string()),
+        ("prenom", pa.string()),
+        ("date_naissance", pa.timestamp("ns")),
+        ("type_mandat", pa.string()),
+        ("qualite_mandat", pa.string()),
+        ("categorie_mandat", pa.string()),
+        ("mandat_organe_type", pa.string()),
+        ("mandat_organe_code", pa.string()),
+        ("debut_mandat", pa.timestamp("ns")),
+        ("fin_mandat", pa.timestamp("ns")),
+        ("regime_matrimonial", pa.string()),
+        ("entreprise", pa.string()),
+        ("entreprise_mere", pa.string()),
+        ("entreprise_ca", pa.string()),
+        ("nb_logements", pa.string()),
+        ("to_parse", pa.string()),
+        ("description", pa.string()),
+        ("commentaire", pa.string()),
+        ("remuneration_brut_net", pa.string()),
+        ("description_mandat", pa.string()),
+        ("montant", pa.float64()),
+        ("date_remuneration", pa.timestamp("ns")),
+    ]
+)
 
 
 def get_published_text(tag, exclude=UNPUBLISHED_VALUES) -> str | None:
@@ -50,6 +102,11 @@ class DeclaInteretWorkflow(BaseDataset):
     Only a couple of sections have been parsed so far, mostly to setup the logic.
     For each declaration, the non parsed sections are documented in a dedicated column : `to_parse`.
 
+    By default, the file is read one declaration at a time with lxml (`xml_parser: streaming`),
+    instead of building the tree of the whole file with BeautifulSoup (`xml_parser: soup`).
+    With `parsing_workers` greater than 1, the file is split into chunks of whole declarations
+    which are parsed in a pool of processes, the items being written in the order of the file.
+
     https://www.data.gouv.fr/fr/datasets/contenu-des-declarations-publiees-apres-le-1er-juillet-2017-au-format-xml/#/resources
     """
 
@@ -60,6 +117,9 @@ class DeclaInteretWorkflow(BaseDataset):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.input_filename = self.data_folder / "declarations.xml"
+        self.xml_parser = self.config.get("xml_parser", "streaming")
+        self.batch_size = self.config.get("batch_size", 1000)
+        self.parsing_workers = self.config.get("parsing_workers", 1)
 
     @tracker(ulogger=LOGGER, log_start=True)
     def run(self) -> None:
@@ -69,11 +129,19 @@ class DeclaInteretWorkflow(BaseDataset):
     def _fetch_xml(self):
         if self.input_filename.exists():
             return
-        urllib.request.urlretrieve(self.config["url"], self.input_filename)
+        get_http_client().download(self.config["url"], self.input_filename)
 
     def _format_to_parquet(self):
         if self.output_filename.exists():
             return
+        if self.parsing_workers > 1:
+            self._write_tables(self._parallel_tables())
+        elif self.xml_parser == "soup":
+            self._format_with_soup()
+        else:
+            self._write_declarations(tqdm(self._streaming_declarations(self.input_filename)))
+
+    def _format_with_soup(self):
         with self.input_filename.open(encoding="utf-8") as f:
             soup = BeautifulSoup(f.read(), features="xml")
 
@@ -83,6 +151,119 @@ class DeclaInteretWorkflow(BaseDataset):
         )
         df.to_parquet(self.output_filename)
 
+    @staticmethod
+    def _streaming_declarations(source: Path | io.BytesIO) -> Iterator[Tag]:
+        """
+        Read the declarations one at a time, each of them being parsed with BeautifulSoup
+        to reuse the parsing logic. The elements are cleared once parsed to bound the memory.
+        """
+        if isinstance(source, Path):
+            source = str(source)
+        elements = etree.iterparse(source, events=("end",), tag="declaration", huge_tree=True)
+        for _, element in elements:
+            xml = etree.tostring(element, encoding="unicode")
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+            yield BeautifulSoup(xml, features="xml").find("declaration")
+
+    def _write_declarations(self, declarations: Iterable[Tag]) -> None:
+        """
+        Write the items of the declarations to parquet, by batches of declarations.
+        """
+        self._write_tables(self._declaration_tables(declarations, self.batch_size))
+
+    def _write_tables(self, tables: Iterable[pa.Table]) -> None:
+        """
+        Write the tables to parquet. As pandas does, the columns without any value
+        are then typed as null, which requires to rewrite the file.
+        """
+        null_columns = set(DECLARATION_SCHEMA.names)
+        with pq.ParquetWriter(self.output_filename, DECLARATION_SCHEMA) as writer:
+            for table in tables:
+                writer.write_table(table)
+                null_columns -= {
+                    c for c in table.column_names if table[c].null_count < len(table)
+                }
+        if null_columns:
+            self._cast_to_null(null_columns)
+
+    def _cast_to_null(self, columns: set[str]) -> None:
+        schema = pa.schema(
+            [
+                pa.field(f.name, pa.null()) if f.name in columns else f
+                for f in DECLARATION_SCHEMA
+            ]
+        )
+        tmp_filename = self.output_filename.with_suffix(".tmp")
+        with pq.ParquetWriter(tmp_filename, schema) as writer:
+            for batch in pq.ParquetFile(self.output_filename).iter_batches(self.batch_size):
+                arrays = [
+                    pa.nulls(batch.num_rows) if name in columns else batch[name]
+                    for name in schema.names
+                ]
+                writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+        tmp_filename.replace(self.output_filename)
+
+    @staticmethod
+    def _declaration_tables(declarations: Iterable[Tag], batch_size: int) -> Iterator[pa.Table]:
+        """
+        Parse the declarations into tables of items, by batches of declarations.
+        """
+        declarations = iter(declarations)
+        while batch := list(islice(declarations, batch_size)):
+            records = list(chain(*[DeclaInteretWorkflow._parse_declaration(d) for d in batch]))
+            unknown = set(chain(*records)) - set(DECLARATION_SCHEMA.names)
+            if unknown:
+                raise ValueError(f"Columns missing from DECLARATION_SCHEMA: {sorted(unknown)}")
+            yield pa.Table.from_pylist(records, schema=DECLARATION_SCHEMA)
+
+    def _parallel_tables(self) -> Iterator[pa.Table]:
+        """
+        Parse the chunks of declarations in a pool of spawned processes.
+        `map` returns the tables in the order of the chunks, hence of the file.
+        """
+        chunks = self._declaration_chunks(
+            self.input_filename, self.parsing_workers * CHUNKS_PER_WORKER
+        )
+        with ProcessPoolExecutor(
+            max_workers=self.parsing_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(project_config.dump(),),
+        ) as pool:
+            yield from tqdm(
+                pool.map(
+                    _parse_chunk,
+                    [self.input_filename] * len(chunks),
+                    *zip(*chunks, strict=True),
+                    [self.batch_size] * len(chunks),
+                ),
+                total=len(chunks),
+            )
+
+    @staticmethod
+    def _declaration_chunks(filename: Path, n_chunks: int) -> list[tuple[int, int]]:
+        """
+        Split the file into at most `n_chunks` ranges of bytes of about the same size,
+        each of them made of whole declarations.
+        The ranges start at the opening tag of a declaration, the last one ends
+        at the closing tag of the last declaration.
+        """
+        with open(filename, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            first = DECLARATION_START.search(m)
+            if first is None:
+                return []
+            end = m.rfind(DECLARATION_END) + len(DECLARATION_END)
+            starts = [first.start()]
+            step = max(1, (end - first.start()) // max(1, n_chunks))
+            for position in range(first.start() + step, end, step):
+                start = DECLARATION_START.search(m, max(position, starts[-1] + 1), end)
+                if start is None:
+                    break
+                starts.append(start.start())
+        return list(zip(starts, [*starts[1:], end], strict=True))
+
     @staticmethod
     def _parse_declaration(declaration: BeautifulSoup) -> list[dict]:
         """
@@ -214,3 +395,20 @@ class DeclaInteretWorkflow(BaseDataset):
             }
             for item in montants.find_all("montant", recursive=False)
         ]
+
+
+def _parse_chunk(filename: Path, start: int, end: int, batch_size: int) -> pa.Table:
+    """
+    Parse the declarations between two byte offsets of the file, in a worker process.
+    The chunk is wrapped in a root element to be a valid XML document.
+    """
+    with open(filename, "rb") as f:
+        f.seek(start)
+        content = b"<declarations>" + f.read(end - start) + b"</declarations>"
+    declarations = DeclaInteretWorkflow._streaming_declarations(io.BytesIO(content))
+    return pa.concat_tables(
+        [
+            DECLARATION_SCHEMA.empty_table(),
+            *DeclaInteretWorkflow._declaration_tables(declarations, batch_size),
+        ]
+    )
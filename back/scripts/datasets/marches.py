@@ -3,17 +3,25 @@ import decimal
 import itertools
 import json
 import logging
+import shutil
 import tempfile
-from functools import reduce
+import time
+from collections import Counter
+from functools import cache, reduce
 from pathlib import Path
-from urllib.request import urlretrieve
 
 import ijson
 import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from back.scripts.datasets.datagouv_catalog import DataGouvCatalog
 from back.scripts.datasets.dataset_aggregator import DatasetAggregator
+from back.scripts.datasets.utils import BaseDataset
+from back.scripts.utils.dataframe_operation import clean_montant
 from back.scripts.utils.decorators import tracker
+from back.scripts.utils.http_client import get_http_client
 from back.scripts.utils.typing import PandasRow
 
 LOGGER = logging.getLogger(__name__)
@@ -29,6 +37,15 @@ COLUMNS_RENAMER = {
     "techniques": "technique",
     "acheteur.id": "acheteur_id",
 }
+# Arrow types of the interim columns, from the types of the official schema.
+# Any other type, as well as the nested values serialized to JSON, are stored as strings.
+SCHEMA_TYPES = {
+    "number": pa.float64(),
+    "integer": pa.int64(),
+    "boolean": pa.bool_(),
+}
+# The C backend of ijson is several times faster than the pure python one.
+DEFAULT_IJSON_BACKEND = "yajl2_c"
 
 
 class MarchesPublicsWorkflow(DatasetAggregator):
@@ -36,6 +53,10 @@ class MarchesPublicsWorkflow(DatasetAggregator):
     def get_config_key(cls) -> str:
         return "marches_publics"
 
+    @classmethod
+    def get_dependencies(cls) -> list[type[BaseDataset]]:
+        return [DataGouvCatalog]
+
     @classmethod
     def from_config(cls, main_config: dict):
         """
@@ -73,6 +94,14 @@ class MarchesPublicsWorkflow(DatasetAggregator):
     def __init__(self, files: pd.DataFrame, config: dict):
         super().__init__(files, config)
         self._load_schema(config[self.get_config_key()]["schema"])
+        self.interim_batch_size = config[self.get_config_key()].get(
+            "interim_batch_size", 50_000
+        )
+        self.interim_types = self._interim_types()
+        # Only the name is kept, the backend module can not be sent to the worker processes.
+        self.ijson_backend = ijson_backend(
+            self.config.get("ijson_backend", DEFAULT_IJSON_BACKEND)
+        ).backend
 
     def _load_schema(self, url):
         schema_filename = self.data_folder / "official_schema.parquet"
@@ -85,55 +114,158 @@ class MarchesPublicsWorkflow(DatasetAggregator):
         )
         self.official_schema.to_parquet(schema_filename)
 
+    def _interim_types(self) -> dict[str, pa.DataType]:
+        """
+        Arrow type of each column produced by `unnest_marche`, derived from the official schema.
+        Titulaires fields are prefixed by `titulaire_`, the other nested fields
+        are serialized to JSON in the column of their parent property.
+        """
+        types = {"countTitulaires": pa.int64()}
+        for prop, prop_type in self.official_schema[["property", "type"]].itertuples(
+            index=False
+        ):
+            parent, _, field = prop.partition(".")
+            if parent == "titulaires" and field:
+                column = f"titulaire_{field}"
+            elif prop == "acheteur.id" or not field:
+                column = prop
+            else:
+                types[parent] = pa.string()
+                continue
+            types[column] = (
+                SCHEMA_TYPES.get(prop_type, pa.string())
+                if isinstance(prop_type, str)
+                else pa.string()
+            )
+        return types
+
+    def _interim_folder(self, raw_filename: Path) -> Path:
+        return raw_filename.parent / "interim"
+
+    def _invalidate_normalized_file(self, file_metadata: PandasRow) -> None:
+        super()._invalidate_normalized_file(file_metadata)
+        interim_folder = self._interim_folder(self._dataset_filename(file_metadata, "raw"))
+        shutil.rmtree(interim_folder, ignore_errors=True)
+        self._array_prefix_filename(interim_folder).unlink(missing_ok=True)
+
     def _read_parse_file(
         self, file_metadata: PandasRow, raw_filename: Path
-    ) -> pd.DataFrame | None:
+    ) -> pl.LazyFrame | None:
         self._read_parse_interim(raw_filename)
         return self._read_parse_final(raw_filename)
 
-    def _read_parse_final(self, raw_filename: Path) -> pd.DataFrame | None:
-        interim_fn = raw_filename.parent / "interim.json"
-        if not interim_fn.exists():
+    def _read_parse_final(self, raw_filename: Path) -> pl.LazyFrame | None:
+        """
+        Lazily read the interim batches, so that the normalized file is written in streaming.
+        Each batch only holds the columns found in its declarations.
+        """
+        batches = sorted(self._interim_folder(raw_filename).glob("*.parquet"))
+        if not batches:
             return None
-        out = pd.read_json(interim_fn).rename(columns=COLUMNS_RENAMER)
-        object_columns = out.select_dtypes(include=["object"]).columns
-        corrected = {c: out[c].astype("string").where(out[c].notnull()) for c in object_columns}
-        return out.assign(**corrected)
+        return pl.concat(
+            [pl.scan_parquet(batch) for batch in batches], how="diagonal_relaxed"
+        ).rename(COLUMNS_RENAMER, strict=False)
 
     @tracker(ulogger=LOGGER, log_start=True)
     def _read_parse_interim(self, raw_filename: Path) -> None:
         """
-        Create an intermediate JSON file with cleaned conventions,
-        so that pandas can read it properly.
+        Create intermediate parquet files with cleaned conventions,
+        one per batch of `interim_batch_size` unnested declarations.
+        The batches are written in a temporary folder, renamed once the raw file is fully read.
         """
-        interim_fn = raw_filename.parent / "interim.json"
-        if interim_fn.exists():
+        interim_folder = self._interim_folder(raw_filename)
+        if interim_folder.exists():
             return
 
+        tmp_folder = interim_folder.with_name(interim_folder.name + ".tmp")
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        tmp_folder.mkdir(parents=True)
+        invalid_values = Counter()
+        backend = ijson_backend(self.ijson_backend)
+        n_rows = 0
+        start_time = time.perf_counter()
+
         with open(raw_filename, "rb") as raw:
-            array_location = self.check_json_structure(raw_filename) + ".item"
-
-            with open(interim_fn, "w") as interim:
-                # Ijson identifies each declaration individually
-                # within the marches field.
-                array_declas = ijson.items(
-                    raw,
-                    array_location,
-                    use_float=True,
-                )
-                interim.write("[\n")
+            array_location = self._array_prefix(raw_filename) + ".item"
+            # Ijson identifies each declaration individually
+            # within the marches field.
+            array_declas = backend.items(
+                raw,
+                array_location,
+                use_float=True,
+            )
+            records = (
+                x for declaration in array_declas for x in self.unnest_marche(declaration)
+            )
+            for i in itertools.count():
+                batch = tuple(itertools.islice(records, self.interim_batch_size))
+                if not batch:
+                    break
+                table = pa.Table.from_batches([self._to_record_batch(batch, invalid_values)])
+                pq.write_table(table, tmp_folder / f"part-{i:05d}.parquet")
+                n_rows += len(batch)
+
+        duration = max(time.perf_counter() - start_time, 1e-6)
+        size_mb = raw_filename.stat().st_size / 1024**2
+        LOGGER.info(
+            f"Parsed {raw_filename} with ijson backend {backend.backend} : "
+            f"{n_rows} rows, {size_mb:.1f} MB, "
+            f"{n_rows / duration:.0f} rows/s, {size_mb / duration:.1f} MB/s"
+        )
+
+        for column, count in invalid_values.items():
+            LOGGER.warning(
+                f"{count} values of {column} in {raw_filename} do not match the schema type"
+            )
+        tmp_folder.rename(interim_folder)
 
-                # Iterate over the JSON array items
-                for i, declaration in enumerate(array_declas):
-                    if i:
-                        interim.write(",\n")
-                    unnested = [json.dumps(x) for x in self.unnest_marche(declaration)]
-                    interim.write(",\n".join(unnested))
+    def _to_record_batch(
+        self, records: tuple[dict, ...], invalid_values: Counter
+    ) -> pa.RecordBatch:
+        """
+        Convert unnested declarations into an Arrow record batch typed after the official schema.
+        Values which cannot be converted to the schema type are set to null and counted.
+        """
+        columns = list(dict.fromkeys(k for record in records for k in record))
+        arrays = []
+        for column in columns:
+            dtype = self.interim_types.get(column, pa.string())
+            values = []
+            for record in records:
+                value = record.get(column)
+                converted = _convert_value(value, dtype)
+                if converted is None and value is not None:
+                    invalid_values[column] += 1
+                values.append(converted)
+            arrays.append(pa.array(values, type=dtype))
+        return pa.RecordBatch.from_arrays(arrays, names=columns)
 
-                interim.write("]\n")
+    @staticmethod
+    def _array_prefix_filename(interim_folder: Path) -> Path:
+        return interim_folder.with_name("array_prefix.json")
+
+    def _array_prefix(self, raw_filename: Path) -> str:
+        """
+        Location of the array of declarations in the raw file.
+        It is cached next to the raw file, with the size and modification time of the raw file
+        so that a new version of the file is parsed again.
+        """
+        cache_filename = self._array_prefix_filename(self._interim_folder(raw_filename))
+        stat = raw_filename.stat()
+        fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if cache_filename.exists():
+            with open(cache_filename) as f:
+                cached = json.load(f)
+            if cached.get("raw") == fingerprint:
+                return cached["prefix"]
+
+        prefix = self.check_json_structure(raw_filename, self.ijson_backend)
+        with open(cache_filename, "w") as f:
+            json.dump({"prefix": prefix, "raw": fingerprint}, f)
+        return prefix
 
     @staticmethod
-    def check_json_structure(file_path: Path) -> str:
+    def check_json_structure(file_path: Path, backend: str = DEFAULT_IJSON_BACKEND) -> str:
         """
         Check if the JSON file has the structure ['marches'] or ['marches']['marche']
         without loading the entire file.
@@ -145,7 +277,7 @@ class MarchesPublicsWorkflow(DatasetAggregator):
 
         with open(file_path, "rb") as f:
             try:
-                prefix_events = ijson.parse(f)
+                prefix_events = ijson_backend(backend).parse(f)
                 for prefix, event, _value in prefix_events:
                     if event == "start_array":
                         return prefix
@@ -192,6 +324,45 @@ class MarchesPublicsWorkflow(DatasetAggregator):
         return [{f"titulaire_{k}": v for k, v in t.items()} | unnested for t in titulaires if t]
 
 
+@cache
+def ijson_backend(name: str):
+    """
+    Load an ijson backend, falling back to the default one if it is not available.
+    """
+    try:
+        backend = ijson.get_backend(name)
+    except ImportError:
+        LOGGER.warning(f"ijson backend {name} is not available, using {ijson.backend}")
+        backend = ijson
+    LOGGER.info(f"Using ijson backend {backend.backend}")
+    return backend
+
+
+def _convert_value(value, dtype: pa.DataType):
+    """
+    Convert a JSON value to the given Arrow type, None if it is not possible.
+    Numbers written as text are cleaned as in `normalize_montant`.
+    """
+    if value is None:
+        return None
+    if pa.types.is_string(dtype):
+        return value if isinstance(value, str) else json.dumps(value)
+    if pa.types.is_boolean(dtype):
+        return value if isinstance(value, bool) else None
+    if isinstance(value, bool) or isinstance(value, (list, dict)):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        # Amounts written as text, e.g. "12 000" or "1 500,50"
+        number = clean_montant(value) if isinstance(value, str) else None
+    if number is None or not pa.types.is_integer(dtype):
+        return number
+    if not number.is_integer() or abs(number) >= 2**63:
+        return None
+    return int(number)
+
+
 class MarchesPublicsSchemaLoader:
     """
     Load a specific type of json into a DataFrame.
@@ -204,7 +375,7 @@ class MarchesPublicsSchemaLoader:
     def load(url: str, type_marche: str) -> pd.DataFrame:
         with tempfile.TemporaryDirectory() as tmpdirname:
             json_filename = Path(tmpdirname) / "schema.json"
-            urlretrieve(url, json_filename)
+            get_http_client().download(url, json_filename)
 
             with open(json_filename) as f:
                 schema = json.load(f)
@@ -1,13 +1,16 @@
+import json
 import logging
-import time
-import urllib.request
+from collections.abc import Iterable
 from pathlib import Path
 
+import numpy as np
 import polars as pl
+import pyarrow.parquet as pq
 from polars import col
 
 from back.scripts.datasets.utils import BaseDataset
 from back.scripts.utils.decorators import tracker
+from back.scripts.utils.http_client import get_http_client
 
 LOGGER = logging.getLogger(__name__)
 
@@ -28,10 +31,6 @@ EFFECTIF_CODE_TO_EMPLOYEES = {
     "52": 5000,
 }
 
-# Rate limiting configuration
-RATE_LIMIT_DELAY = 1.5  # seconds between requests
-MAX_RETRIES = 3  # number of retries for failed downloads
-
 
 class SireneWorkflow(BaseDataset):
     """
@@ -40,6 +39,8 @@ class SireneWorkflow(BaseDataset):
 
     Given the size of the file, only a subset of the columns is kept,
     enriched with labels corresponding to the activity code.
+    The output is sorted by siren, so that `SireneWorkflow.lookup` only reads
+    the row groups which may contain the requested sirens.
 
     https://www.data.gouv.fr/fr/datasets/base-sirene-des-entreprises-et-de-leurs-etablissements-siren-siret/
     """
@@ -52,8 +53,7 @@ class SireneWorkflow(BaseDataset):
         super().__init__(*args, **kwargs)
 
         self.input_filename = self.data_folder / "sirene_raw.parquet"
-        # Track the last download time to enforce rate limiting
-        self._last_download_time = 0
+        self.row_group_size = self.config.get("row_group_size", 100_000)
 
     @tracker(ulogger=LOGGER, log_start=True)
     def run(self) -> None:
@@ -66,84 +66,144 @@ class SireneWorkflow(BaseDataset):
     def _fetch_zip(self):
         if self.input_filename.exists():
             return
-        self._download_if_not_exists(self.config["url"], self.input_filename)
+        self._download_if_not_exists(
+            self.config["url"],
+            self.input_filename,
+            segments=self.config.get("download_segments", 1),
+        )
 
-    def _download_if_not_exists(self, url: str, file_path: Path | None = None) -> None:
+    def _download_if_not_exists(
+        self, url: str, file_path: Path | None = None, segments: int = 1
+    ) -> None:
         """
-        Download a file from a URL with rate limiting to avoid server throttling.
+        Download a file from a URL.
+        Retries and the delay between requests to a same host are handled by the HTTP client,
+        which also resumes an interrupted download instead of starting it again.
 
         Args:
             url: The URL to download from
             file_path: Optional path to save the file to. If not provided, will use the filename from the URL.
+            segments: Number of parallel range requests used for a large file
         """
         if file_path is None:
-            file_name = url.split("/")[-1]
-            file_path = self.data_folder / file_name
+            file_path = self._xls_filename(url)
 
         if file_path.exists():
             LOGGER.info(f"File already exists: {file_path}")
             return
 
         LOGGER.info(f"Downloading {url} to {file_path}")
+        get_http_client().download(url, file_path, segments=segments)
+        LOGGER.info(f"Successfully downloaded {url}")
 
-        # Enforce rate limiting
-        self._enforce_rate_limit()
-
-        # Try to download with retries
-        for attempt in range(MAX_RETRIES):
-            try:
-                # Create a custom opener with proper headers
-                opener = urllib.request.build_opener()
-                opener.addheaders = [
-                    (
-                        "User-Agent",
-                        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-                    ),
-                    ("Accept", "*/*"),
-                ]
-                urllib.request.install_opener(opener)
-
-                # Download the file
-                urllib.request.urlretrieve(url, file_path)
+    def _fetch_xls_files(self) -> None:
+        xls_links = self.config.get("xls_urls_naf", [])
+        for file_url in xls_links:
+            self._download_if_not_exists(file_url)
 
-                # Update last download time
-                self._last_download_time = time.time()
+        xls_url_cat_ju = self.config.get("xls_urls_cat_ju")
+        self._download_if_not_exists(xls_url_cat_ju)
 
-                LOGGER.info(f"Successfully downloaded {url}")
-                return
+    def _xls_filename(self, url: str) -> Path:
+        return self.data_folder / url.split("/")[-1]
 
-            except Exception as e:
-                LOGGER.warning(f"Download attempt {attempt + 1}/{MAX_RETRIES} failed: {e}")
-                if attempt < MAX_RETRIES - 1:
-                    # Wait longer between retries
-                    sleep_time = RATE_LIMIT_DELAY * (attempt + 1)
-                    LOGGER.info(f"Retrying in {sleep_time} seconds...")
-                    time.sleep(sleep_time)
-                else:
-                    LOGGER.error(f"Failed to download {url} after {MAX_RETRIES} attempts")
-                    raise
+    def _labels_sources(self, urls: list[str]) -> list[dict]:
+        """
+        Identification of the XLS files a labels cache is built from :
+        their URL, and the size and modification time of the downloaded file.
+        """
+        sources = []
+        for url in urls:
+            filename = self._xls_filename(url)
+            stat = filename.stat() if filename.exists() else None
+            sources.append(
+                {
+                    "url": url,
+                    "size": stat and stat.st_size,
+                    "mtime_ns": stat and stat.st_mtime_ns,
+                }
+            )
+        return sources
 
-    def _enforce_rate_limit(self):
-        """Enforce a minimum delay between downloads to avoid rate limiting."""
-        current_time = time.time()
-        elapsed = current_time - self._last_download_time
+    @staticmethod
+    def _sources_filename(cache_filename: Path) -> Path:
+        return cache_filename.with_name(cache_filename.name + ".sources.json")
 
-        if elapsed < RATE_LIMIT_DELAY:
-            sleep_time = RATE_LIMIT_DELAY - elapsed
-            LOGGER.info(f"Rate limiting: waiting {sleep_time:.2f} seconds")
-            time.sleep(sleep_time)
+    def _is_cache_valid(self, cache_filename: Path, urls: list[str]) -> bool:
+        """
+        Whether a labels cache was built from the XLS files currently configured and downloaded.
+        """
+        sources_filename = self._sources_filename(cache_filename)
+        if not cache_filename.exists() or not sources_filename.exists():
+            return False
+        with open(sources_filename) as f:
+            return json.load(f) == self._labels_sources(urls)
 
-        self._last_download_time = time.time()
+    def _save_cache_sources(self, cache_filename: Path, urls: list[str]) -> None:
+        with open(self._sources_filename(cache_filename), "w") as f:
+            json.dump(self._labels_sources(urls), f)
 
-    def _fetch_xls_files(self) -> None:
-        xls_links = self.config.get("xls_urls_naf", [])
-        for file_url in xls_links:
-            self._download_if_not_exists(file_url)
+    def _naf_labels(self) -> pl.LazyFrame:
+        """
+        Labels of the 5 levels of the NAF codes, read once from the XLS files
+        and cached in a small parquet file, rebuilt when the XLS files change.
+        """
+        cache_filename = self.data_folder / "naf_labels.parquet"
+        urls = self.config.get("xls_urls_naf", [])
+        if not self._is_cache_valid(cache_filename, urls):
+            pl.concat(
+                [
+                    pl.read_excel(
+                        self._xls_filename(url),
+                        read_options={"header_row": 2},
+                    )
+                    .select(
+                        pl.lit(level, dtype=pl.Int8).alias("level"),
+                        pl.col("Code").cast(pl.Utf8).str.replace(".", "", literal=True),
+                        pl.col("Libellé").cast(pl.Utf8),
+                    )
+                    .filter(pl.col("Code").is_not_null())
+                    for level, url in enumerate(urls, start=1)
+                ]
+            ).write_parquet(cache_filename)
+            self._save_cache_sources(cache_filename, urls)
+        return pl.scan_parquet(cache_filename)
 
-        xls_url_cat_ju = self.config.get("xls_urls_cat_ju")
-        self._download_if_not_exists(xls_url_cat_ju)
+    def _categories_juridiques(self) -> list[pl.LazyFrame]:
+        """
+        Labels of the 3 levels of the juridical categories, read once from the XLS file
+        and cached in a small parquet file, rebuilt when the XLS file changes.
+        """
+        cache_filename = self.data_folder / "categories_juridiques.parquet"
+        urls = [self.config.get("xls_urls_cat_ju")]
+        if not self._is_cache_valid(cache_filename, urls):
+            juridical_data_path = self._xls_filename(urls[0])
+            pl.concat(
+                [
+                    pl.read_excel(
+                        juridical_data_path,
+                        sheet_name=f"Niveau {sheet}",
+                        read_options={"header_row": 3},
+                    )
+                    .select(
+                        pl.lit(level, dtype=pl.Int8).alias("level"),
+                        pl.col("Code").cast(pl.Utf8),
+                        pl.col("Libellé").cast(pl.Utf8),
+                    )
+                    .filter(pl.col("Code").is_not_null())
+                    for level, sheet in enumerate(["I", "II", "III"], start=1)
+                ]
+            ).write_parquet(cache_filename)
+            self._save_cache_sources(cache_filename, urls)
+        categories_ju = pl.scan_parquet(cache_filename)
+        return [
+            categories_ju.filter(pl.col("level") == level).drop("level")
+            for level in range(1, 4)
+        ]
 
-    def join_naf_level(self, base_df: pl.DataFrame, level: int) -> pl.DataFrame:
+    def join_naf_level(
+        self, base_df: pl.LazyFrame, level: int, naf_labels: pl.LazyFrame
+    ) -> pl.LazyFrame:
         """
         Effectue la jointure avec le fichier correspondant au niveau (n1, n2, n3, n4, n5) sur base_df.
 
@@ -153,16 +213,10 @@ class SireneWorkflow(BaseDataset):
         - Niveaux 2 à 4 : correspondent respectivement aux 2 à 4 premiers chiffres du code
         """
         column_name = f"naf8_prefix_{level}"
-        naf_file_path = self.data_folder / f"naf2008_liste_n{level}.xls"
-
-        naf_polars = pl.read_excel(naf_file_path, read_options={"header_row": 2})
-
-        naf_polars = naf_polars[["Code", "Libellé"]].rename(
-            {"Libellé": f"Libellé_naf_n{level}", "Code": column_name}
-        )
-
-        naf_polars = naf_polars.with_columns(
-            pl.col(column_name).cast(pl.Utf8).str.replace(".", "", literal=True)
+        naf_polars = (
+            naf_labels.filter(pl.col("level") == level)
+            .select("Code", "Libellé")
+            .rename({"Libellé": f"Libellé_naf_n{level}", "Code": column_name})
         )
 
         if level == 1:
@@ -178,11 +232,11 @@ class SireneWorkflow(BaseDataset):
 
     def join_juridical_level(
         self,
-        base_df: pl.DataFrame,
+        base_df: pl.LazyFrame,
         level: int,
-        categories_ju_data: list[pl.DataFrame],
+        categories_ju_data: list[pl.LazyFrame],
         code_ju_col: str = "code_ju",
-    ) -> pl.DataFrame:
+    ) -> pl.LazyFrame:
         """
         Effectue la jointure avec les données juridiques correspondant au niveau (niv1, niv2, niv3) sur base_df.
         """
@@ -197,62 +251,122 @@ class SireneWorkflow(BaseDataset):
             pl.when(pl.col(code_ju_col).is_not_null()).then(slice_func).alias(column_name)
         )
 
-        juridical_polars = categories_ju_data[level - 1]["Code", "Libellé"].rename(
-            {
-                "Libellé": f"categorie_juridique_n{level}_name",
-                "Code": f"code_ju_part_{level}",
-            }
+        juridical_polars = (
+            categories_ju_data[level - 1]
+            .select("Code", "Libellé")
+            .rename(
+                {
+                    "Libellé": f"categorie_juridique_n{level}_name",
+                    "Code": f"code_ju_part_{level}",
+                }
+            )
         )
-        juridical_polars = juridical_polars.with_columns(pl.col(column_name).cast(pl.Utf8))
 
         return base_df.join(juridical_polars, on=column_name, how="left").drop(column_name)
 
     def _format_to_parquet(self):
+        """
+        The transformation is kept lazy and streamed to the output file,
+        the reference tables being small enough to be joined in memory.
+        """
         if self.output_filename.exists():
             return
 
-        base_df = (
-            pl.scan_parquet(self.input_filename)
-            .select(
-                col("trancheEffectifsUniteLegale").cast(pl.String),
-                col("siren").cast(pl.String).str.zfill(9),
-                (col("etatAdministratifUniteLegale") == "A").alias("is_active"),
-                pl.coalesce(
-                    col("nomUsageUniteLegale"),
-                    col("denominationUniteLegale"),
-                    col("nomUniteLegale"),
-                ).alias("raison_sociale"),
-                col("prenomUsuelUniteLegale").alias("raison_sociale_prenom"),
-                col("activitePrincipaleUniteLegale")
-                .str.replace_all(".", "", literal=True)
-                .alias("naf8"),
-                col("categorieJuridiqueUniteLegale").alias("code_ju"),
-                col("trancheEffectifsUniteLegale")
-                .replace_strict(EFFECTIF_CODE_TO_EMPLOYEES, default=None)
-                .cast(pl.Int32)
-                .alias("tranche_effectif"),
-                col("nomenclatureActivitePrincipaleUniteLegale").alias("nomenclature_naf"),
-            )
-            .collect()
+        base_df = pl.scan_parquet(self.input_filename).select(
+            col("trancheEffectifsUniteLegale").cast(pl.String),
+            col("siren").cast(pl.String).str.zfill(9),
+            (col("etatAdministratifUniteLegale") == "A").alias("is_active"),
+            pl.coalesce(
+                col("nomUsageUniteLegale"),
+                col("denominationUniteLegale"),
+                col("nomUniteLegale"),
+            ).alias("raison_sociale"),
+            col("prenomUsuelUniteLegale").alias("raison_sociale_prenom"),
+            col("activitePrincipaleUniteLegale")
+            .str.replace_all(".", "", literal=True)
+            .alias("naf8"),
+            col("categorieJuridiqueUniteLegale").alias("code_ju"),
+            col("trancheEffectifsUniteLegale")
+            .replace_strict(EFFECTIF_CODE_TO_EMPLOYEES, default=None)
+            .cast(pl.Int32)
+            .alias("tranche_effectif"),
+            col("nomenclatureActivitePrincipaleUniteLegale").alias("nomenclature_naf"),
         )
 
+        naf_labels = self._naf_labels().collect().lazy()
         for level in range(1, 6):
-            base_df = self.join_naf_level(base_df, level)
-
-        juridical_data_path = self.data_folder / "cj_septembre_2022.xls"
-        sheet_levels = ["I", "II", "III"]
-        categories_ju_data = [
-            pl.read_excel(
-                juridical_data_path,
-                sheet_name=f"Niveau {level}",
-                read_options={"header_row": 3},
-            )
-            for level in sheet_levels
-        ]
+            base_df = self.join_naf_level(base_df, level, naf_labels)
 
+        categories_ju_data = [c.collect().lazy() for c in self._categories_juridiques()]
         for level in range(1, 4):
             base_df = self.join_juridical_level(
                 base_df, level, categories_ju_data=categories_ju_data
             )
 
-        base_df.write_parquet(self.output_filename)
+        base_df.sort("siren").sink_parquet(
+            self.output_filename, row_group_size=self.row_group_size
+        )
+
+    @classmethod
+    def lookup(
+        cls, main_config: dict, sirens: Iterable[str], columns: list[str] | None = None
+    ) -> pl.DataFrame:
+        """
+        Rows of the Sirene output for the given sirens.
+        """
+        return SireneLookup(cls.get_output_path(main_config)).lookup(sirens, columns)
+
+
+class SireneLookup:
+    """
+    Answer batches of siren queries on the Sirene parquet file.
+
+    The minimum and maximum sirens of each row group are read from the parquet statistics,
+    and only the row groups whose range contains at least one of the queries are read.
+    With a file sorted by siren, the ranges do not overlap and few row groups are read.
+    """
+
+    def __init__(self, filename: Path):
+        self.parquet = pq.ParquetFile(filename)
+        self.row_group_ranges = [
+            self._siren_range(self.parquet.metadata.row_group(i))
+            for i in range(self.parquet.num_row_groups)
+        ]
+
+    def _siren_range(self, row_group) -> tuple[str, str] | None:
+        for i in range(row_group.num_columns):
+            column = row_group.column(i)
+            if column.path_in_schema == "siren":
+                stats = column.statistics
+                if stats is not None and stats.has_min_max:
+                    return stats.min, stats.max
+        return None
+
+    def candidate_row_groups(self, queries: np.ndarray) -> list[int]:
+        """
+        Row groups which may contain one of the sorted queries.
+        Row groups without statistics are always read.
+        """
+        candidates = []
+        for i, siren_range in enumerate(self.row_group_ranges):
+            if siren_range is None:
+                candidates.append(i)
+                continue
+            low, high = siren_range
+            start = np.searchsorted(queries, low, side="left")
+            end = np.searchsorted(queries, high, side="right")
+            if end > start:
+                candidates.append(i)
+        return candidates
+
+    def lookup(self, sirens: Iterable[str], columns: list[str] | None = None) -> pl.DataFrame:
+        if columns is not None and "siren" not in columns:
+            columns = ["siren", *columns]
+        queries = np.unique(np.array([s for s in sirens if isinstance(s, str)], dtype=object))
+        row_groups = self.candidate_row_groups(queries) if len(queries) else []
+        LOGGER.debug(
+            f"Sirene lookup of {len(queries)} sirens : "
+            f"{len(row_groups)}/{self.parquet.num_row_groups} row groups read"
+        )
+        table = self.parquet.read_row_groups(row_groups, columns=columns)
+        return pl.from_arrow(table).filter(col("siren").is_in(queries.tolist()))
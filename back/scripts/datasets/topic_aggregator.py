@@ -6,6 +6,7 @@ from collections import Counter
 from pathlib import Path
 
 import pandas as pd
+import urllib3
 from inflection import underscore as to_snake_case
 
 from back.scripts.datasets.constants import (
@@ -17,16 +18,16 @@ from back.scripts.datasets.dataset_aggregator import DatasetAggregator
 from back.scripts.loaders.json_loader import JSONLoader
 from back.scripts.utils.config import get_project_base_path, project_config
 from back.scripts.utils.dataframe_operation import (
+    IdentifierFormat,
     merge_duplicate_columns,
     normalize_column_names,
-    normalize_date,
-    normalize_identifiant,
-    normalize_montant,
+    normalize_columns,
     safe_rename,
 )
 from back.scripts.utils.typing import PandasRow
 
 ssl._create_default_https_context = ssl._create_unverified_context
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 LOGGER = logging.getLogger(__name__)
 
@@ -43,6 +44,9 @@ class TopicAggregator(DatasetAggregator):
     Files that are not properly read or formatted are logged into the errors.json file with the corresponding error.
     """
 
+    # Many publishers have misconfigured certificates
+    verify_ssl = False
+
     def __init__(
         self,
         files_in_scope: pd.DataFrame,
@@ -80,6 +84,22 @@ class TopicAggregator(DatasetAggregator):
     def get_output_path(cls, main_config: dict, topic: str = "subventions") -> Path:
         return Path(main_config[cls.get_config_key()]["combined_filename"] % {"topic": topic})
 
+    def _reset_normalization_report(self) -> None:
+        super()._reset_normalization_report()
+        self.extra_columns = Counter()
+        self.missing_data = []
+
+    def _normalization_report(self) -> dict:
+        return super()._normalization_report() | {
+            "extra_columns": self.extra_columns,
+            "missing_data": self.missing_data,
+        }
+
+    def _merge_normalization_report(self, report: dict) -> None:
+        super()._merge_normalization_report(report)
+        self.extra_columns.update(report["extra_columns"])
+        self.missing_data.extend(report["missing_data"])
+
     def _post_process(self) -> None:
         pd.DataFrame.from_dict(self.extra_columns, orient="index").to_csv(
             self.data_folder / "extra_columns.csv"
@@ -139,7 +159,8 @@ class TopicAggregator(DatasetAggregator):
         if not extra_columns:
             return
 
-        self.extra_columns.update(extra_columns)
+        # Sorted to keep the order of extra_columns.csv independent from set ordering
+        self.extra_columns.update(sorted(extra_columns))
         LOGGER.warning(f"File {file_metadata.url} has extra columns: {extra_columns}")
         raise RuntimeError("File has extra columns")
 
@@ -157,11 +178,14 @@ class TopicAggregator(DatasetAggregator):
             .pipe(self._flag_columns_by_keyword)
         )
         self._flag_duplicate_columns(df, file_metadata)
-        df = (
-            df.pipe(normalize_identifiant, "idBeneficiaire")
-            .pipe(normalize_identifiant, "idAttribuant")
-            .pipe(normalize_montant, "montant")
-            .pipe(normalize_date, "dateConvention")
+        df = normalize_columns(
+            df,
+            identifiants={
+                "idBeneficiaire": IdentifierFormat.SIRET,
+                "idAttribuant": IdentifierFormat.SIRET,
+            },
+            montants=["montant"],
+            dates=["dateConvention"],
         )
         self._flag_inversion_siret(df, file_metadata)
         self._flag_extra_columns(df, file_metadata)
@@ -18,6 +18,14 @@ class BaseDataset:
         """
         raise NotImplementedError("Method must be overridden")
 
+    @classmethod
+    def get_dependencies(cls) -> list[type["BaseDataset"]]:
+        """
+        Datasets whose output file is read by this dataset.
+        Used by the workflow scheduler to order and parallelize the workflows.
+        """
+        return []
+
     @classmethod
     def get_config(cls, main_config: dict | Config) -> dict:
         return main_config[cls.get_config_key()]
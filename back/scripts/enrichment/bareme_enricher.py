@@ -9,9 +9,12 @@ from back.scripts.enrichment.base_enricher import BaseEnricher
 from back.scripts.enrichment.financial_account_enricher import FinancialEnricher
 from back.scripts.enrichment.marches_enricher import MarchesPublicsEnricher
 from back.scripts.enrichment.subventions_enricher import SubventionsEnricher
+from back.scripts.enrichment.utils.run_report import RunReport
 
 
 class BaremeEnricher(BaseEnricher):
+    lazy = True
+
     @classmethod
     def get_dataset_name(cls) -> str:
         return "bareme"
@@ -26,22 +29,30 @@ class BaremeEnricher(BaseEnricher):
         ]
 
     @classmethod
-    def _clean_and_enrich(cls, inputs: typing.List[pl.DataFrame]) -> pl.DataFrame:
+    def _clean_and_enrich(
+        cls, inputs: typing.List[pl.DataFrame | pl.LazyFrame]
+    ) -> pl.DataFrame | pl.LazyFrame:
         communities, subventions, financial, marches_publics = inputs
+        is_lazy = isinstance(communities, pl.LazyFrame)
+        communities, subventions, financial, marches_publics = (
+            frame.lazy() for frame in (communities, subventions, financial, marches_publics)
+        )
         bareme = cls.build_bareme_table(communities)
         bareme = cls.bareme_subventions(subventions, financial, bareme)
         bareme_mp = cls.bareme_marchespublics(marches_publics, communities)
         bareme = bareme.join(bareme_mp, on=["siren", "annee"], how="left")
-        return bareme
+        return bareme if is_lazy else bareme.collect()
 
     @classmethod
+    @RunReport.step
     def build_bareme_table(cls, communities: pl.DataFrame) -> pl.DataFrame:
         current_year = datetime.now().year
-        annees = pl.DataFrame({"annee": list(range(2016, current_year))})
+        annees = pl.LazyFrame({"annee": list(range(2016, current_year))})
         bareme_table = communities.select("siren").join(annees, how="cross")
         return bareme_table
 
     @classmethod
+    @RunReport.step
     def bareme_subventions(
         cls, subventions: pl.DataFrame, financial: pl.DataFrame, bareme_table: pl.DataFrame
     ) -> pl.DataFrame:
@@ -84,8 +95,7 @@ class BaremeEnricher(BaseEnricher):
         bareme_table = bareme_table.with_columns(
             [
                 pl.col("taux_subventions")
-                .map_elements(cls.get_score_from_tp)
-                .cast(pl.Utf8)
+                .map_elements(cls.get_score_from_tp, return_dtype=pl.Utf8)
                 .alias("subventions_score")
             ]
         )
@@ -111,6 +121,7 @@ class BaremeEnricher(BaseEnricher):
             return "E"
 
     @classmethod
+    @RunReport.step
     def bareme_marchespublics(
         cls, marches_publics: pl.DataFrame, communities: pl.DataFrame
     ) -> pl.DataFrame:
@@ -124,7 +135,7 @@ class BaremeEnricher(BaseEnricher):
         )
 
         current_year = datetime.now().year
-        years_df = pl.DataFrame({"annee": list(range(2018, current_year + 1))})
+        years_df = pl.LazyFrame({"annee": list(range(2018, current_year + 1))})
         coll_df = communities.select(["siren"])
         coll_years_df = coll_df.join(years_df, how="cross")
 
@@ -3,6 +3,7 @@ from pathlib import Path
 
 import polars as pl
 
+from back.scripts.enrichment.utils.run_report import RunReport
 from back.scripts.utils.config import get_project_base_path
 from back.scripts.utils.decorators import tracker
 
@@ -10,7 +11,15 @@ LOGGER = logging.getLogger(__name__)
 
 
 class BaseEnricher:
-    """Designed to be subclassed, subclasses must override get_dataset_name and get_input_paths and _clean_and_enrich."""
+    """
+    Designed to be subclassed, subclasses must override get_dataset_name and get_input_paths and _clean_and_enrich.
+
+    Subclasses setting `lazy` to True receive LazyFrames in _clean_and_enrich
+    and their output is written in streaming to limit the memory used.
+    Steps which still need eager data can collect their inputs or return a DataFrame.
+    """
+
+    lazy = False
 
     def __init__(self):
         raise Exception("Utility class.")
@@ -24,7 +33,9 @@ class BaseEnricher:
         raise NotImplementedError("Method must be overriden")
 
     @classmethod
-    def _clean_and_enrich(cls, inputs: list[pl.DataFrame]) -> pl.DataFrame:
+    def _clean_and_enrich(
+        cls, inputs: list[pl.DataFrame | pl.LazyFrame]
+    ) -> pl.DataFrame | pl.LazyFrame:
         raise NotImplementedError("Method must be overriden")
 
     @classmethod
@@ -35,11 +46,40 @@ class BaseEnricher:
             / f"{cls.get_dataset_name()}.parquet"
         )
 
+    @classmethod
+    def get_report_path(cls, main_config: dict) -> Path:
+        return cls.get_output_path(main_config).with_suffix(".report.json")
+
     @classmethod
     @tracker(ulogger=LOGGER, log_start=True)
     def enrich(cls, main_config: dict) -> None:
         if cls.get_output_path(main_config).exists():
             return
-        inputs = map(pl.read_parquet, cls.get_input_paths(main_config))
-        output = cls._clean_and_enrich(inputs)
-        output.write_parquet(cls.get_output_path(main_config))
+        output_path = cls.get_output_path(main_config)
+        input_paths = cls.get_input_paths(main_config)
+        read = pl.scan_parquet if cls.lazy else pl.read_parquet
+        with RunReport.record(
+            cls.get_dataset_name(),
+            input_paths,
+            profile_steps=main_config["warehouse"].get("profile_steps", False),
+        ) as report:
+            output = cls._clean_and_enrich(map(read, input_paths))
+            if isinstance(output, pl.LazyFrame) and main_config["warehouse"].get(
+                "explain_plans", False
+            ):
+                report["plan"] = output.explain()
+            cls._write_output(output, output_path)
+        report["output_rows"] = RunReport.count_rows(output_path)
+        RunReport.write(report, cls.get_report_path(main_config))
+
+    @classmethod
+    def _write_output(cls, output: pl.DataFrame | pl.LazyFrame, path: Path) -> None:
+        if isinstance(output, pl.DataFrame):
+            output.write_parquet(path)
+            return
+        try:
+            output.sink_parquet(path)
+        except pl.exceptions.InvalidOperationError as e:
+            # Some operations are not supported by the streaming engine.
+            LOGGER.warning(f"Could not stream {cls.get_dataset_name()}, collecting it : {e}")
+            output.collect().write_parquet(path)
@@ -9,6 +9,8 @@ from back.scripts.enrichment.base_enricher import BaseEnricher
 
 
 class CommunitiesEnricher(BaseEnricher):
+    lazy = True
+
     @classmethod
     def get_dataset_name(cls) -> str:
         return "communities"
@@ -6,9 +6,12 @@ from polars import col
 from back.scripts.communities.communities_selector import CommunitiesSelector
 from back.scripts.datasets.elected_officials import ElectedOfficialsWorkflow
 from back.scripts.enrichment.base_enricher import BaseEnricher
+from back.scripts.enrichment.utils.run_report import RunReport
 
 
 class ElectedOfficialsEnricher(BaseEnricher):
+    lazy = True
+
     @classmethod
     def get_dataset_name(cls) -> str:
         return "elected_officials"
@@ -30,6 +33,7 @@ class ElectedOfficialsEnricher(BaseEnricher):
         )
 
     @classmethod
+    @RunReport.step
     def _add_code_insee(cls, df: pl.DataFrame) -> pl.DataFrame:
         return df.with_columns(
             col("mandat")
@@ -54,6 +58,7 @@ class ElectedOfficialsEnricher(BaseEnricher):
         )
 
     @classmethod
+    @RunReport.step
     def _add_siren(cls, df: pl.DataFrame, coll: pl.DataFrame) -> pl.DataFrame:
         return df.join(
             coll.select(["siren", "code_insee", "type"]),
@@ -5,9 +5,12 @@ import polars as pl
 from back.scripts.communities.communities_selector import CommunitiesSelector
 from back.scripts.datasets.communities_financial_accounts import FinancialAccounts
 from back.scripts.enrichment.base_enricher import BaseEnricher
+from back.scripts.enrichment.utils.run_report import RunReport
 
 
 class FinancialEnricher(BaseEnricher):
+    lazy = True
+
     @classmethod
     def get_dataset_name(cls) -> str:
         return "financial_accounts"
@@ -72,9 +75,11 @@ class FinancialEnricher(BaseEnricher):
         return financial_filtred
 
     @classmethod
+    @RunReport.step
     def _add_financial_type(cls, financial: pl.DataFrame) -> pl.DataFrame:
         financial_filtred = financial.filter(pl.col("annee") > 2016)
-        if "siren" in financial_filtred.columns:
+        columns = financial_filtred.collect_schema().names()
+        if "siren" in columns:
             financial_filtred = financial_filtred.rename({"siren": "siren_group"})
         else:
             financial_filtred = financial_filtred.with_columns(
@@ -83,7 +88,7 @@ class FinancialEnricher(BaseEnricher):
 
         required_cols = ["region", "dept", "insee_commune"]
         for col in required_cols:
-            if col not in financial_filtred.columns:
+            if col not in columns:
                 financial_filtred = financial_filtred.with_columns(
                     pl.lit(None, dtype=pl.Utf8).alias(col)
                 )
@@ -109,6 +114,7 @@ class FinancialEnricher(BaseEnricher):
         return financial_filtred
 
     @classmethod
+    @RunReport.step
     def enrich_siren(
         cls,
         financial_df: pl.DataFrame,
@@ -137,6 +143,7 @@ class FinancialEnricher(BaseEnricher):
         )
 
     @classmethod
+    @RunReport.step
     def clean_region_and_dep_columns(cls, df: pl.DataFrame) -> pl.DataFrame:
         df = df.with_columns(
             [
@@ -1,7 +1,8 @@
 import json
+import logging
+import re
 from pathlib import Path
 
-import pandas as pd
 import polars as pl
 from inflection import underscore as to_snake_case
 from unidecode import unidecode
@@ -10,15 +11,31 @@ from back.scripts.datasets.cpv_labels import CPVLabelsWorkflow
 from back.scripts.datasets.marches import MarchesPublicsWorkflow
 from back.scripts.enrichment.base_enricher import BaseEnricher
 from back.scripts.enrichment.utils.cpv_utils import CPVUtils
+from back.scripts.enrichment.utils.json_utils import JsonUtils
 from back.scripts.utils.dataframe_operation import (
     IdentifierFormat,
-    normalize_date,
-    normalize_identifiant,
-    normalize_montant,
+    normalize_date_expr,
+    normalize_identifiant_lazy,
+    normalize_montant_expr,
 )
 
+LOGGER = logging.getLogger(__name__)
+
+# Fields used to sort the modifications of a MP, by order of preference.
+MODIFICATION_DATE_FIELDS = [
+    "datePublicationDonneesModification",
+    "dateNotificationModification",
+    "dateSignatureModification",
+    "updated_at",
+]
+# Value standing for the explicit nulls of the modifications once decoded,
+# as the decoding does not distinguish them from missing fields.
+NULL_MODIFICATION = "\x00"
+
 
 class MarchesPublicsEnricher(BaseEnricher):
+    lazy = True
+
     @classmethod
     def get_dataset_name(cls) -> str:
         return "marches_publics"
@@ -31,32 +48,34 @@ class MarchesPublicsEnricher(BaseEnricher):
         ]
 
     @classmethod
-    def _clean_and_enrich(cls, inputs: list[pl.DataFrame]) -> pl.DataFrame:
+    def _clean_and_enrich(
+        cls, inputs: list[pl.LazyFrame | pl.DataFrame]
+    ) -> pl.LazyFrame | pl.DataFrame:
         # Data analysts, please add your code here!
         marches, cpv_labels, *_ = inputs
+        is_lazy = isinstance(marches, pl.LazyFrame)
+        marches, cpv_labels = marches.lazy(), cpv_labels.lazy()
+        modification_keys = cls.modification_keys(marches)
 
-        marches_pd = (
-            marches.to_pandas()
-            .pipe(cls.set_unique_mp_id)
+        marches = (
+            marches.pipe(cls.set_unique_mp_id)
             .pipe(cls.set_unique_mp_titulaire_id)
-            .drop(columns=["id", "uid", "uuid"])
+            .drop(["id", "uid", "uuid"])
             .pipe(cls.keep_last_modifications)
-            .apply(cls.appliquer_modifications, axis=1)
+            .pipe(cls.appliquer_modifications, modification_keys)
             .pipe(cls.correction_types_colonnes_str, ["objet"])
-            .drop(columns=["modifications"])
-            .pipe(normalize_montant, "montant")
-            .pipe(normalize_date, "datePublicationDonnees")
-            .pipe(normalize_date, "dateNotification")
-            .pipe(normalize_identifiant, "acheteur_id", IdentifierFormat.SIREN)
+            .drop(["modifications"])
+            .pipe(cls.normalize_columns)
             .pipe(cls._add_metadata)
-            .assign(montant=lambda df: df["montant"] / df["countTitulaires"].fillna(1))
-        )
-
-        return (
-            pl.from_pandas(marches_pd)
+            .with_columns(pl.col("montant") / pl.col("countTitulaires").fill_null(1))
             .pipe(cls.drop_source_duplicates)
             .pipe(cls.drop_sous_traitance_duplicates)
-            .pipe(cls.generate_new_id)
+        )
+        # Les types sont lus après dédoublonnage, pour ne pas créer de colonnes vides
+        lieu_execution_types = cls.lieu_execution_types(marches)
+
+        output = (
+            marches.pipe(cls.generate_new_id)
             .pipe(cls.forme_prix_enrich)
             .pipe(cls.type_identifiant_titulaire_enrich)
             .pipe(
@@ -68,11 +87,12 @@ class MarchesPublicsEnricher(BaseEnricher):
             .pipe(cls.generic_json_column_enrich, "technique", "technique")
             .pipe(cls.generic_json_column_enrich, "typesPrix", "typePrix")
             .pipe(cls.type_prix_enrich)
-            .pipe(cls.lieu_execution_enrich)
+            .pipe(cls.lieu_execution_enrich, lieu_execution_types)
             .pipe(CPVUtils.add_cpv_labels, cpv_labels=cpv_labels)
             .rename(to_snake_case)
             .pipe(cls.drop_rows_with_null_dates_or_amounts)
         )
+        return output if is_lazy else output.collect()
 
     @staticmethod
     def forme_prix_enrich(marches: pl.DataFrame) -> pl.DataFrame:
@@ -86,48 +106,36 @@ class MarchesPublicsEnricher(BaseEnricher):
         ).drop("formePrix")
 
     @staticmethod
-    def safe_typePrix_json_load(x):
-        try:
-            parsed = json.loads(x)
-            if isinstance(parsed, list) and parsed:
-                return parsed[0]
-            elif isinstance(parsed, dict):
-                type_prix = parsed.get("typePrix")
-                if isinstance(type_prix, list) and type_prix:
-                    return type_prix[0]
-                if isinstance(type_prix, str):
-                    return type_prix
-            return None
-        except (json.JSONDecodeError, TypeError):
-            return
+    def _concat_id(columns: list[str]) -> pl.Expr:
+        """
+        Concatène les colonnes en un identifiant texte.
+        Les valeurs manquantes sont conservées vides pour ne pas confondre deux champs.
+        """
+        return pl.concat_str(
+            [pl.col(c).cast(pl.String).fill_null("") for c in columns], separator="-"
+        )
 
-    @staticmethod
-    def set_unique_mp_id(marches: pd.DataFrame) -> pd.DataFrame:
+    @classmethod
+    def set_unique_mp_id(cls, marches: pl.LazyFrame) -> pl.LazyFrame:
         """
         Les différents champs id, uid et uuid ne permettent pas d'avoir un id unique par MP car ce sont des champs saisis.
 
         Le but de cette fonction est de créer un id unique par MP, pour ensuite créer un id plus propre par MP.
         """
-        marches["id_mp"] = (
-            marches[["id", "uid", "uuid", "dateNotification", "codeCPV"]]
-            .astype(str)
-            .apply(lambda row: "-".join([val for val in row if val != "nan"]), axis=1)
+        return marches.with_columns(
+            cls._concat_id(["id", "uid", "uuid", "dateNotification", "codeCPV"]).alias("id_mp")
         )
-        return marches
 
-    @staticmethod
-    def set_unique_mp_titulaire_id(marches: pd.DataFrame) -> pd.DataFrame:
+    @classmethod
+    def set_unique_mp_titulaire_id(cls, marches: pl.LazyFrame) -> pl.LazyFrame:
         """
         Les différents champs id, uid et uuid ne permettent pas d'avoir un id unique par MP car ce sont des champs saisis.
 
         Le but de cette fonction est de créer un id unique par MP et titulaire, pour ensuite dédoublonner par ce nouvel id.
         """
-        marches["id_mp_titulaire"] = (
-            marches[["id_mp", "titulaire_id"]]
-            .astype(str)
-            .apply(lambda row: "-".join([val for val in row if val != "nan"]), axis=1)
+        return marches.with_columns(
+            cls._concat_id(["id_mp", "titulaire_id"]).alias("id_mp_titulaire")
         )
-        return marches
 
     @staticmethod
     def type_prix_enrich(marches: pl.DataFrame) -> pl.DataFrame:
@@ -221,56 +229,45 @@ class MarchesPublicsEnricher(BaseEnricher):
         return {}
 
     @staticmethod
-    def lieu_execution_enrich(marches: pl.DataFrame) -> pl.DataFrame:
+    def lieu_execution_types(marches: pl.LazyFrame) -> list[str]:
         """
-        1 - Parse lieuExecution en 3 champs code, type code et nom
-        2 - Extrait le tout en code commune, code postal, code departement etc
+        Liste des types de code de lieuExecution, chacun donnant une colonne lieu_execution_*.
+        Ils sont lus avant d'ajouter ces colonnes, pour garder le reste du traitement lazy.
         """
+        types = (
+            marches.lazy()
+            .select("lieuExecution")
+            .pipe(MarchesPublicsEnricher._parse_lieu_execution)
+            .select(pl.col("lieu_execution_type_code").drop_nulls().unique())
+            .collect()
+        )
+        return sorted(types["lieu_execution_type_code"].to_list())
 
-        # TODO : Il y a beaucoup de nettoyage à faire dans les différents champs
-
+    @staticmethod
+    def _parse_lieu_execution(marches: pl.LazyFrame) -> pl.LazyFrame:
+        """
+        Parse lieuExecution en 3 champs code, type code et nom
+        """
         # Cas spécifiques où lieu_execution_type_code est soit bourgogne, soit franche-comte
         mapping = {
             "bourgogne": "code departement",
             "franche-comte": "code departement",
         }
 
-        df = (
+        return (
             marches.with_columns(
-                pl.col("lieuExecution")
-                .map_elements(
-                    MarchesPublicsEnricher.safe_json_load,
-                    return_dtype=pl.Object,
-                )
-                .alias("lieu_execution_parsed")
+                MarchesPublicsEnricher._lieu_execution_field("code").alias(
+                    "lieu_execution_code"
+                ),
+                MarchesPublicsEnricher._lieu_execution_field("typeCode").alias(
+                    "lieu_execution_type_code"
+                ),
+                MarchesPublicsEnricher._lieu_execution_field("nom").alias("lieu_execution_nom"),
             )
             .with_columns(
-                pl.col("lieu_execution_parsed")
-                .map_elements(
-                    lambda d: str(d.get("code")) if d.get("code") is not None else None,
-                    return_dtype=pl.Utf8,
+                MarchesPublicsEnricher.unidecode_expr(pl.col("lieu_execution_type_code")).alias(
+                    "lieu_execution_type_code"
                 )
-                .str.to_lowercase()
-                .alias("lieu_execution_code"),
-                pl.col("lieu_execution_parsed")
-                .map_elements(
-                    lambda d: str(d.get("typeCode")) if d.get("typeCode") is not None else None,
-                    return_dtype=pl.Utf8,
-                )
-                .str.to_lowercase()
-                .alias("lieu_execution_type_code"),
-                pl.col("lieu_execution_parsed")
-                .map_elements(
-                    lambda d: str(d.get("nom")) if d.get("nom") is not None else None,
-                    return_dtype=pl.Utf8,
-                )
-                .str.to_lowercase()
-                .alias("lieu_execution_nom"),
-            )
-            .with_columns(
-                pl.col("lieu_execution_type_code")
-                .map_elements(lambda x: unidecode(x), return_dtype=pl.Utf8)
-                .alias("lieu_execution_type_code")
             )
             .with_columns(
                 pl.when(pl.col("lieu_execution_type_code").is_not_null()).then(
@@ -279,10 +276,50 @@ class MarchesPublicsEnricher(BaseEnricher):
                     .alias("lieu_execution_type_code")
                 )
             )
-            .drop("lieu_execution_parsed")
         )
 
-        types = df["lieu_execution_type_code"].drop_nulls().unique().to_list()
+    @staticmethod
+    def _lieu_execution_field(key: str) -> pl.Expr:
+        """
+        Champ de lieuExecution, en minuscules.
+        Les valeurs imbriquées ou les nombres à exposant, dont la représentation texte diffère
+        entre polars et Python, passent par le parsing Python.
+        """
+        raw = pl.col("lieuExecution")
+        value = raw.str.json_path_match(f"$.{key}")
+        is_native = ~(JsonUtils.is_nested(value) | value.str.contains(r"^-?\d+(?:\.\d+)?[eE]"))
+
+        def fallback(x):
+            value = MarchesPublicsEnricher.safe_json_load(x).get(key)
+            return str(value) if value is not None else None
+
+        return JsonUtils.with_fallback(raw, value, is_native, fallback).str.to_lowercase()
+
+    @staticmethod
+    def unidecode_expr(column: pl.Expr) -> pl.Expr:
+        """
+        Supprime les accents des lettres latines en natif, unidecode est utilisé pour les autres caractères.
+        """
+        ascii = column.str.normalize("NFKD").str.replace_all(r"\p{M}", "")
+        is_native = column.str.contains(r"^[\x00-\x7F\u00C0-\u017F]*$") & ~ascii.str.contains(
+            r"[^\x00-\x7F]"
+        )
+        return JsonUtils.with_fallback(column, ascii, is_native, unidecode)
+
+    @staticmethod
+    def lieu_execution_enrich(
+        marches: pl.LazyFrame, types: list[str] | None = None
+    ) -> pl.LazyFrame:
+        """
+        1 - Parse lieuExecution en 3 champs code, type code et nom
+        2 - Extrait le tout en code commune, code postal, code departement etc
+        """
+
+        # TODO : Il y a beaucoup de nettoyage à faire dans les différents champs
+
+        df = marches.pipe(MarchesPublicsEnricher._parse_lieu_execution)
+        if types is None:
+            types = MarchesPublicsEnricher.lieu_execution_types(marches)
 
         return (
             df.with_columns(
@@ -313,20 +350,35 @@ class MarchesPublicsEnricher(BaseEnricher):
             .drop(["lieu_execution_type_code", "lieu_execution_code", "lieuExecution"])
         )
 
+    @staticmethod
+    def normalize_columns(marches: pl.LazyFrame) -> pl.LazyFrame:
+        schema = marches.collect_schema()
+        return marches.with_columns(
+            normalize_montant_expr("montant", schema["montant"]),
+            normalize_date_expr("datePublicationDonnees", schema["datePublicationDonnees"]),
+            normalize_date_expr("dateNotification", schema["dateNotification"]),
+        ).pipe(normalize_identifiant_lazy, "acheteur_id", IdentifierFormat.SIREN)
+
     @classmethod
-    def _add_metadata(cls, df: pd.DataFrame) -> pd.DataFrame:
-        return df.assign(
-            anneeNotification=df["dateNotification"].dt.year.astype("Int64"),
-            anneePublicationDonnees=df["datePublicationDonnees"].dt.year.astype("Int64"),
-            obligation_publication=pd.cut(
-                df["montant"],
-                bins=[0, 40000, float("inf")],
-                labels=["Optionnel", "Obligatoire"],
-                right=False,
-            ),
+    def _add_metadata(cls, df: pl.LazyFrame) -> pl.LazyFrame:
+        one_day = 24 * 3600 * 10**9
+        return df.with_columns(
+            anneeNotification=pl.col("dateNotification").dt.year().cast(pl.Int64),
+            anneePublicationDonnees=pl.col("datePublicationDonnees").dt.year().cast(pl.Int64),
+            # Mêmes intervalles que pd.cut : [0, 40000[ et [40000, inf[
+            obligation_publication=pl.when(
+                pl.col("montant").is_between(0, 40000, closed="left")
+            )
+            .then(pl.lit("Optionnel"))
+            .when(pl.col("montant").is_between(40000, float("inf"), closed="left"))
+            .then(pl.lit("Obligatoire"))
+            .cast(pl.Categorical),
             delaiPublicationJours=(
-                df["datePublicationDonnees"] - df["dateNotification"]
-            ).dt.days,
+                (
+                    pl.col("datePublicationDonnees") - pl.col("dateNotification")
+                ).dt.total_nanoseconds()
+                // one_day
+            ).cast(pl.Float64),
         )
 
     @classmethod
@@ -355,21 +407,54 @@ class MarchesPublicsEnricher(BaseEnricher):
 
     @classmethod
     def generic_json_column_enrich(
-        cls, marches: pl.DataFrame, col_name: str, dict_key: str
-    ) -> pl.DataFrame:
-        return marches.with_columns(
-            pl.col(col_name)
-            .map_elements(
-                lambda x: MarchesPublicsEnricher.safe_json_load_of_dict_or_list_or_str(
-                    x, dict_key
-                ),
-                return_dtype=pl.Utf8,
+        cls, marches: pl.LazyFrame, col_name: str, dict_key: str
+    ) -> pl.LazyFrame:
+        """
+        Version native de safe_json_load_of_dict_or_list_or_str, qui reste utilisée
+        pour les lignes mal formées ou de structure inattendue.
+        """
+        raw = pl.col(col_name)
+        value = raw.str.json_path_match(f"$.{dict_key}")
+        is_object = raw.str.strip_chars_start().str.starts_with("{")
+        is_list = JsonUtils.is_array_of_strings(raw)
+        is_value_list = JsonUtils.is_array_of_strings(value)
+        is_value_str = ~JsonUtils.is_nested(value) & ~JsonUtils.is_literal(value)
+        is_native = JsonUtils.is_valid(raw) & (
+            is_list
+            | ~JsonUtils.is_nested(raw)
+            | (is_object & (value.is_null() | is_value_list | is_value_str))
+        )
+
+        def concat_list(values: pl.Expr) -> pl.Expr:
+            return pl.when(values.list.len() > 0).then(
+                values.list.unique().list.sort().list.join(" et ")
+            )
+
+        native = (
+            pl.when(is_list)
+            .then(concat_list(JsonUtils.decode(raw, pl.List(pl.String), is_native & is_list)))
+            .when(is_object & is_value_list)
+            .then(
+                concat_list(
+                    JsonUtils.decode(
+                        value, pl.List(pl.String), is_native & is_object & is_value_list
+                    )
+                )
             )
-            .alias(col_name)
+            .when(is_object)
+            .then(value)
+        )
+        return marches.with_columns(
+            JsonUtils.with_fallback(
+                raw,
+                native,
+                is_native,
+                lambda x: cls.safe_json_load_of_dict_or_list_or_str(x, dict_key),
+            ).alias(col_name)
         )
 
     @staticmethod
-    def drop_source_duplicates(marches: pl.DataFrame) -> pl.DataFrame:
+    def drop_source_duplicates(marches: pl.LazyFrame) -> pl.LazyFrame:
         """
         Certains MP identiques viennent de sources différentes
         On enlève un des doublons
@@ -377,10 +462,11 @@ class MarchesPublicsEnricher(BaseEnricher):
 
         # Dataset of sources by frequency to build priority when deduplicating
         source_priority = (
-            marches["source"]
-            .value_counts(sort=True)
+            marches.group_by("source")
+            .len()
+            .sort("len", descending=True)
             .with_row_index(name="priority")
-            .drop("count")
+            .drop("len")
         )
 
         return (
@@ -410,76 +496,138 @@ class MarchesPublicsEnricher(BaseEnricher):
         )
 
     @staticmethod
-    def tri_modification(mod):
-        # Tri personnalisé sans convertir les id entiers en chaînes
-        return (
-            mod.get("datePublicationDonneesModification")
-            or mod.get("dateNotificationModification")
-            or mod.get("dateSignatureModification")
-            or mod.get("updated_at")
-            or (mod.get("id") if isinstance(mod.get("id"), str) else "")
+    def modification_keys(marches: pl.LazyFrame) -> list[str]:
+        """
+        Liste des clés présentes dans les modifications des MP.
+        Elles sont lues directement dans le fichier source pour garder le reste du traitement lazy.
+        """
+        keys = (
+            marches.lazy()
+            .select(
+                pl.col("modifications")
+                .str.extract_all(r'"[^"\\]+"\s*:')
+                .list.eval(pl.element().str.extract(r'"([^"\\]+)"', 1))
+                .explode()
+                .drop_nulls()
+                .unique()
+            )
+            .collect()
         )
+        return sorted(keys["modifications"].to_list())
 
     @staticmethod
-    def appliquer_modifications(row):
-        try:
-            modifications_raw = row["modifications"]
-            modifications_list = json.loads(modifications_raw)
-        except (json.JSONDecodeError, TypeError):
-            return row  # on ignore si la valeur est vide ou mal formée
-
-        # Si ce n'est pas une liste (ex: un dict direct ou None), on ignore
-        if not isinstance(modifications_list, list):
-            # modifications_invalides += 1  # 61 lignes invalides !!!  donc potentiellement non traitées mais je ne sais pas vraiment ce qui bloque
-            return row
-
-        # Extraire proprement les dicts de modification (cas [{"modification": {...}}, ...])
-        #  En l'adaptant, potentiellement réutilisable pour l'extraction des listes de dicts des titulaires
-        modifs = [
-            mod["modification"] if isinstance(mod, dict) and "modification" in mod else mod
-            for mod in modifications_list
+    def appliquer_modifications(
+        marches: pl.LazyFrame, keys: list[str] | None = None
+    ) -> pl.LazyFrame:
+        """
+        Applique aux colonnes du MP ses modifications successives, triées par date.
+        Chaque clé d'une modification, éventuellement suffixée par "Modification",
+        qui correspond à une colonne du MP la met à jour. Pour chaque colonne,
+        c'est la dernière modification contenant la clé qui est retenue, même si elle est nulle.
+
+        Les modifications sont décodées en liste de structs (cas [{"modification": {...}}, ...]
+        ou [{...}, ...]), les valeurs vides ou mal formées sont ignorées.
+        Les id des modifications sont ignorés : les id du MP sont regénérés par generate_new_id.
+        Les clés des modifications peuvent être données (voir `modification_keys`),
+        pour ne traiter que les colonnes modifiées.
+        """
+        if keys is None:
+            keys = MarchesPublicsEnricher.modification_keys(marches)
+        schema = marches.collect_schema()
+        columns = [
+            c
+            for c in schema
+            if c != "modifications" and (c in keys or c + "Modification" in keys)
         ]
+        column_fields = [key for column in columns for key in (column, column + "Modification")]
+        fields = {key: pl.String for key in [*column_fields, *MODIFICATION_DATE_FIELDS]}
+        dtype = pl.List(pl.Struct(fields | {"modification": pl.Struct(fields)}))
+
+        raw = pl.col("modifications")
+        is_list = JsonUtils.is_valid(raw) & raw.str.strip_chars_start().str.starts_with("[")
+        fields_pattern = "|".join(re.escape(f) for f in fields)
+        # Les valeurs imbriquées (listes ou dicts) sont décodées en texte par le parsing Python
+        has_nested_field = raw.str.contains(rf'"(?:{fields_pattern})"\s*:\s*[\[{{]')
+        raw = JsonUtils.with_fallback(
+            raw,
+            raw,
+            ~has_nested_field,
+            lambda x: MarchesPublicsEnricher._encode_nested_values(x, list(fields)),
+        ).str.replace_all(
+            rf'("(?:{fields_pattern})"\s*:\s*)null', rf'${{1}}"\u{ord(NULL_MODIFICATION):04x}"'
+        )
+        decoded = JsonUtils.decode(raw, dtype, is_list)
+
+        def field(key: str) -> pl.Expr:
+            # Extraire proprement les dicts de modification
+            modification = pl.element().struct.field("modification")
+            return (
+                pl.when(modification.is_not_null())
+                .then(modification.struct.field(key))
+                .otherwise(pl.element().struct.field(key))
+            )
 
-        modifs_sorted = sorted(modifs, key=MarchesPublicsEnricher.tri_modification)
-
-        for modif in modifs_sorted:
-            for key, value in modif.items():
-                # Gestion spéciale de 'id'
-                if key == "id":
-                    if isinstance(value, int):
-                        continue  # On ignore les id techniques
-                    elif isinstance(value, str):
-                        row["id"] = value  # Appliquer le vrai identifiant
-                        continue
-
-                # Normalisation du nom de la clé
-                base_key = (
-                    key.replace("Modification", "") if key.endswith("Modification") else key
+        sort_key = pl.coalesce(
+            [
+                pl.when(~field(key).is_in(["", NULL_MODIFICATION])).then(field(key))
+                for key in MODIFICATION_DATE_FIELDS
+            ]
+        ).fill_null("")
+        modifications = decoded.list.eval(pl.element().sort_by(sort_key, maintain_order=True))
+
+        def modified(column: str) -> pl.Expr:
+            value = pl.coalesce(field(column + "Modification"), field(column))
+            last_value = modifications.list.eval(value.drop_nulls().last()).list.first()
+            dtype = pl.Float64 if schema[column].is_numeric() else schema[column]
+            # Les valeurs qui ne peuvent être converties sont ignorées
+            return (
+                pl.when(last_value == NULL_MODIFICATION)
+                .then(None)
+                .otherwise(
+                    pl.coalesce(
+                        last_value.cast(dtype, strict=False), pl.col(column).cast(dtype)
+                    )
                 )
+            )
 
-                if base_key in row:
-                    try:
-                        if isinstance(row[base_key], (float, int)):
-                            row[base_key] = float(value)
-                        else:
-                            row[base_key] = value
-                    except (ValueError, TypeError):
-                        row[base_key] = value
+        return marches.with_columns([modified(column).alias(column) for column in columns])
 
-        return row
+    @staticmethod
+    def _encode_nested_values(modifications: str, keys: list[str]) -> str | None:
+        """
+        Encode en texte JSON les listes et dicts des clés attendues des modifications.
+        """
+        try:
+            parsed = json.loads(modifications)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(parsed, list):
+            return None
+
+        def encode(modification):
+            if not isinstance(modification, dict):
+                return modification
+            return {
+                key: json.dumps(value, ensure_ascii=False)
+                if key in keys and isinstance(value, (list, dict))
+                else encode(value)
+                if key == "modification"
+                else value
+                for key, value in modification.items()
+            }
+
+        return json.dumps([encode(m) for m in parsed])
 
     @staticmethod
     def correction_types_colonnes_str(
-        marches: pd.DataFrame, colonnes_a_convertir_en_str: list
-    ) -> pd.DataFrame:
-        # Corrige les types des colonnes avant la conversion en polars
-        marches[colonnes_a_convertir_en_str] = (
-            marches[colonnes_a_convertir_en_str].astype(str).replace("nan", "")
+        marches: pl.LazyFrame, colonnes_a_convertir_en_str: list
+    ) -> pl.LazyFrame:
+        return marches.with_columns(
+            pl.col(colonnes_a_convertir_en_str).cast(pl.String).fill_null("")
         )
-        return marches
 
     @staticmethod
-    def keep_last_modifications(marches: pd.DataFrame) -> pd.DataFrame:
+    def keep_last_modifications(marches: pl.LazyFrame) -> pl.LazyFrame:
         """
         A chaque modification d'un MP, une nouvelle ligne avec les infos initiales du MP est ajoutée au dataset et le champs "modifications" est incrémenté avec les nouvelles modifications.
         Cela produit autant de doublons que d'étapes de modifications du MP dans le dataset
@@ -488,20 +636,22 @@ class MarchesPublicsEnricher(BaseEnricher):
         """
 
         return (
-            marches.assign(modifications_length=marches["modifications"].fillna("").str.len())
-            .sort_values(["id_mp_titulaire", "modifications_length"], ascending=False)
-            .drop_duplicates("id_mp_titulaire")
-            .drop(columns="modifications_length")
+            marches.with_columns(
+                modifications_length=pl.col("modifications").fill_null("").str.len_chars()
+            )
+            .sort(["id_mp_titulaire", "modifications_length"], descending=True)
+            .unique("id_mp_titulaire", keep="first", maintain_order=True)
+            .drop("modifications_length")
         )
 
     @staticmethod
-    def generate_new_id(marches: pl.DataFrame) -> pl.DataFrame:
+    def generate_new_id(marches: pl.LazyFrame) -> pl.LazyFrame:
         # Génère un nouvel id unique, entier, pour chaque MP
 
         id_mapping = (
             marches.select("id_mp")
             .unique()
-            .with_row_count(name="id")  # génère l'entier par valeur unique
+            .with_row_index(name="id")  # génère l'entier par valeur unique
         )
 
         return marches.join(id_mapping, on="id_mp", how="left").drop(
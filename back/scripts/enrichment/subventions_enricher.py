@@ -40,8 +40,21 @@ class SubventionsEnricher:
     @classmethod
     @tracker(ulogger=LOGGER, log_start=True)
     def enrich(cls, main_config: dict) -> None:
-        inputs = map(pl.scan_parquet, cls.get_input_paths(main_config))
-        output = cls._clean_and_enrich(inputs)
+        subventions_path, _ = cls.get_input_paths(main_config)
+        subventions = pl.scan_parquet(subventions_path)
+        # Only the Sirene rows of the attribuants and beneficiaires are read.
+        sirens = (
+            pl.concat(
+                [
+                    subventions.select(col(c).str.slice(0, 9).alias("siren"))
+                    for c in ["id_attribuant", "id_beneficiaire"]
+                ]
+            )
+            .unique()
+            .collect()
+        )
+        sirene = SireneWorkflow.lookup(main_config, sirens["siren"])
+        output = cls._clean_and_enrich([subventions, sirene.lazy()])
         output.sink_parquet(cls.get_output_path(main_config))
 
     @classmethod
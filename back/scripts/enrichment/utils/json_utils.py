@@ -0,0 +1,71 @@
+from typing import Any, Callable
+
+import polars as pl
+
+
+class JsonUtils:
+    """
+    Decode JSON string columns with native polars expressions.
+
+    The native decoding only applies to the rows whose structure is known in advance.
+    The other rows (malformed JSON, unexpected nested values, ...) are handled by
+    a Python fallback, so that the result does not depend on the decoding path.
+    """
+
+    # A JSON string, with its escaped characters
+    _STRING_PATTERN = r'"(?:[^"\\]|\\.)*"'
+    # A JSON array containing only strings, e.g. ["a", "b"]
+    _ARRAY_OF_STRINGS_PATTERN = (
+        rf"^\s*\[\s*(?:{_STRING_PATTERN}\s*(?:,\s*{_STRING_PATTERN}\s*)*)?\]\s*$"
+    )
+    # A value extracted from a JSON document which is an array or an object
+    _NESTED_PATTERN = r"^\s*[\[{]"
+    # A value extracted from a JSON document which may not have been a string
+    _LITERAL_PATTERN = r"^(?:-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null)$"
+
+    @classmethod
+    def is_valid(cls, column: pl.Expr) -> pl.Expr:
+        return column.str.json_path_match("$").is_not_null()
+
+    @classmethod
+    def is_array_of_strings(cls, column: pl.Expr) -> pl.Expr:
+        return column.str.contains(cls._ARRAY_OF_STRINGS_PATTERN)
+
+    @classmethod
+    def is_nested(cls, column: pl.Expr) -> pl.Expr:
+        return column.str.contains(cls._NESTED_PATTERN)
+
+    @classmethod
+    def is_literal(cls, column: pl.Expr) -> pl.Expr:
+        return column.str.contains(cls._LITERAL_PATTERN)
+
+    @classmethod
+    def decode(cls, column: pl.Expr, dtype: pl.DataType, mask: pl.Expr) -> pl.Expr:
+        """
+        Decode the rows selected by the mask, the other rows are null.
+        The mask is applied before decoding so that non matching rows never reach the decoder.
+        """
+        return pl.when(mask).then(column).str.json_decode(dtype)
+
+    @classmethod
+    def with_fallback(
+        cls,
+        column: pl.Expr,
+        native: pl.Expr,
+        is_native: pl.Expr,
+        fallback: Callable[[Any], Any],
+        return_dtype: pl.DataType = pl.String,
+    ) -> pl.Expr:
+        """
+        Use the native expression where is_native is true,
+        and call the fallback function on the other non null values of the column.
+        """
+        return (
+            pl.when(is_native)
+            .then(native)
+            .otherwise(
+                pl.when(is_native.not_())
+                .then(column)
+                .map_elements(fallback, return_dtype=return_dtype, skip_nulls=True)
+            )
+        )
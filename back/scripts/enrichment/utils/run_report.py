@@ -0,0 +1,111 @@
+import functools
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable
+
+import polars as pl
+import pyarrow.parquet as pq
+
+from back.scripts.utils.metrics import peak_rss_mb
+
+_CURRENT_REPORT: ContextVar[dict | None] = ContextVar("enrichment_report", default=None)
+
+
+class RunReport:
+    """
+    Instrumentation of the enrichers, written as a JSON report next to their output.
+
+    The report holds the number of rows of the inputs and of the output, the duration
+    of the enrichment and of each step decorated with `RunReport.step`,
+    the growth of the peak memory of the process during the enrichment
+    and optionally the optimized query plan of the output.
+
+    The steps of a lazy pipeline only build the query plan : their duration is the planning
+    time, the execution is measured by the whole enrichment. With `profile_steps`,
+    the output of each lazy step is instead collected with `LazyFrame.profile`,
+    which gives its duration, its number of rows and the timings of each node of its plan.
+    The next steps then start from the collected output.
+    """
+
+    @classmethod
+    @contextmanager
+    def record(cls, name: str, input_paths: list[Path], profile_steps: bool = False):
+        report = {
+            "enricher": name,
+            "inputs": {str(path): cls.count_rows(path) for path in input_paths},
+            "profile_steps": profile_steps,
+            "steps": [],
+        }
+        token = _CURRENT_REPORT.set(report)
+        start_time = time.perf_counter()
+        start_peak_rss = peak_rss_mb()
+        try:
+            yield report
+        finally:
+            _CURRENT_REPORT.reset(token)
+            report["duration"] = round(time.perf_counter() - start_time, 3)
+            # The peak is the one of the process, shared by all the enrichers of a run.
+            if start_peak_rss is not None:
+                report["peak_rss_delta_mb"] = round(peak_rss_mb() - start_peak_rss, 1)
+
+    @classmethod
+    def step(cls, func: Callable[..., Any]) -> Callable[..., Any]:
+        """
+        Decorator recording the duration of a step of an enricher, and its number of rows
+        when it returns a DataFrame or when the lazy steps are profiled.
+        Nothing is recorded outside of `RunReport.record`.
+        """
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) -> Any:
+            report = _CURRENT_REPORT.get()
+            if report is None:
+                return func(*args, **kwargs)
+            start_time = time.perf_counter()
+            value = func(*args, **kwargs)
+            step = {"name": func.__qualname__, "lazy": isinstance(value, pl.LazyFrame)}
+            if step["lazy"] and report["profile_steps"]:
+                collected = cls._profile(value, step)
+                value = collected.lazy()
+                step["rows"] = collected.height
+            elif isinstance(value, pl.DataFrame):
+                step["rows"] = value.height
+            step["duration"] = round(time.perf_counter() - start_time, 3)
+            report["steps"].append(step)
+            return value
+
+        return wrapper
+
+    @staticmethod
+    def _profile(frame: pl.LazyFrame, step: dict) -> pl.DataFrame:
+        """
+        Collect a lazy step, adding to the step the timings of the nodes of its plan
+        (in microseconds) where the version of polars still provides `LazyFrame.profile`.
+        """
+        if not hasattr(frame, "profile"):
+            return frame.collect()
+        try:
+            collected, timings = frame.profile()
+        except pl.exceptions.ComputeError:
+            # Raised when no node is timed, e.g. for a plan reduced to a scan.
+            return frame.collect()
+        step["nodes"] = timings.to_dicts()
+        return collected
+
+    @staticmethod
+    def count_rows(path: Path) -> int | None:
+        """
+        Number of rows of a parquet file, read from its metadata.
+        """
+        try:
+            return pq.ParquetFile(path).metadata.num_rows
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def write(report: dict, path: Path) -> None:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
@@ -1,39 +1,30 @@
+import codecs
+import functools
 import logging
 import os
 import re
+import zipfile
+from io import BytesIO
 from pathlib import Path
-from typing import Pattern, Self
+from typing import BinaryIO, Pattern, Self
 from urllib.parse import urlparse
 
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-
+from back.scripts.loaders.encoding import detect_encoding
 from back.scripts.loaders.utils import LOADER_CLASSES
+from back.scripts.utils.http_client import get_http_client
 
 LOGGER = logging.getLogger(__name__)
 
-
-def retry_session(
-    retries: int | None,
-    session: requests.Session | None = None,
-    backoff_factor: float = 0.3,
-):
-    """
-    Configure resquests for multiple retries.
-    https://stackoverflow.com/questions/49121365/implementing-retry-for-requests-in-python
-    """
-    session = session or requests.Session()
-    retry = Retry(
-        total=retries,
-        read=retries,
-        connect=retries,
-        backoff_factor=backoff_factor,
-    )
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
+# Leading bytes identifying a binary format, and the corresponding extension.
+MAGIC_NUMBERS = [
+    (b"PAR1", "parquet"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "xls"),
+    (b"PK\x03\x04", "zip"),
+]
+# First character of a text format, and the corresponding extension.
+TEXT_PREFIXES = {"{": "json", "[": "json", "<": "xml"}
+SNIFF_SIZE = 1024
+MEDIA_TYPE_CACHE_SIZE = 1024
 
 
 class BaseLoader:
@@ -48,23 +39,13 @@ class BaseLoader:
     # http://www.iana.org/assignments/media-types/media-types.xhtml
     file_media_type_regex: Pattern[str] | str | None = None
 
-    def __init__(
-        self,
-        file_url: str | Path,
-        num_retries: int | None = 3,
-        delay_between_retries: float = 5.0,
-        **kwargs,
-    ):
+    def __init__(self, file_url: str | Path, **kwargs):
         """
         Args:
             file_url : URL of the file to load
-            num_retries: Number of retries in case of failure
-            delay_between_retries: Delay between retries in seconds
             kwargs: Keyword arguments used when loading the file
         """
         self.file_url = str(file_url)
-        self.num_retries = num_retries
-        self.delay_between_retries = delay_between_retries
         self.kwargs = kwargs
 
     def load(self, force: bool = True):
@@ -81,8 +62,7 @@ class BaseLoader:
             return self._load_from_file()
 
     def _load_from_url(self):
-        s = retry_session(self.num_retries, backoff_factor=self.delay_between_retries)
-        response = s.get(self.file_url)
+        response = get_http_client().get(self.file_url)
         if response.status_code == 200:
             return self.process_data(response.content)
 
@@ -94,14 +74,20 @@ class BaseLoader:
             local_path = parsed_url.path
             if local_path.startswith("./"):
                 local_path = os.path.abspath(local_path)
-            with open(local_path, "rb") as file:
-                return self.process_data(file.read())
+            return self.process_file(local_path)
         except FileNotFoundError as e:
             LOGGER.error(f"File not found: {e}")
         except Exception as e:
             LOGGER.error(f"Failed to load data from {self.file_url}: {e}")
         return None
 
+    def process_file(self, local_path: str):
+        """
+        Load a local file. By default, its whole content is given to `process_data`.
+        """
+        with open(local_path, "rb") as file:
+            return self.process_data(file.read())
+
     def process_data(self, data):
         raise NotImplementedError("This method should be implemented by subclasses.")
 
@@ -113,10 +99,18 @@ class BaseLoader:
         return self.kwargs
 
     @classmethod
-    def loader_factory(cls, file_url: str | Path, **loader_kwargs) -> Self:
-        # Factory method to create the appropriate loader based on the file URL
+    def loader_factory(
+        cls, file_url: str | Path, *, file_format: str | None = None, **loader_kwargs
+    ) -> Self:
+        """
+        Create the appropriate loader for the file.
+        Args:
+            file_url: URL or path of the file
+            file_format: Format of the file when known, e.g. from the datasets catalog
+            loader_kwargs: Keyword arguments given to the loader
+        """
         file_url = str(file_url)
-        loader_class = cls.search_loader_class(file_url)
+        loader_class = cls.search_loader_class(file_url, file_format=file_format)
         if loader_class:
             return loader_class(file_url, **loader_kwargs)
         raise RuntimeError(f"File {file_url} is not supported by any loader")
@@ -138,7 +132,7 @@ class BaseLoader:
     def get_file_media_type(cls, file_url: str) -> str:
         if cls.get_file_is_url(file_url):
             # Get the content type of the file from the headers
-            response = requests.head(file_url)
+            response = get_http_client().head(file_url)
             if response.status_code == 200:
                 return response.headers.get("content-type", "")
             else:
@@ -146,19 +140,86 @@ class BaseLoader:
         return ""
 
     @classmethod
-    def search_loader_class(cls, file_url: str) -> type | None:
+    def get_cached_file_media_type(cls, file_url: str) -> str:
         """
-        Searches for a loader class based on the file extension and content type.
+        Media type of the file, the HEAD request being sent once per URL.
         """
-        file_extension = cls.get_file_extension(file_url)
-        file_media_type = cls.get_file_media_type(file_url)
+        if cls.get_file_is_url(file_url):
+            return _probe_media_type(file_url)
+        return ""
 
-        for loader_class in set(LOADER_CLASSES.values()):
-            if loader_class.can_load_file(
-                file_extension=file_extension, file_media_type=file_media_type
-            ):
-                return loader_class
+    @classmethod
+    def sniff_file_format(cls, file_url: str) -> str | None:
+        """
+        Guess the format of a local file from its first bytes.
+        Only formats with a recognizable signature are detected (not CSV).
+
+        Returns:
+            The extension of the format, None if it is not recognized.
+        """
+        local_path = urlparse(file_url).path
+        try:
+            with open(local_path, "rb") as f:
+                head = f.read(SNIFF_SIZE)
+        except OSError:
+            return None
+
+        for magic_number, file_format in MAGIC_NUMBERS:
+            if head.startswith(magic_number):
+                if file_format == "zip":
+                    return cls._sniff_zip_format(local_path)
+                return file_format
 
+        text = head.removeprefix(codecs.BOM_UTF8).lstrip()[:1]
+        return TEXT_PREFIXES.get(text.decode("ascii", errors="ignore"))
+
+    @staticmethod
+    def _sniff_zip_format(local_path: str) -> str:
+        """
+        Office documents are zip archives, recognized from the files they contain.
+        """
+        try:
+            with zipfile.ZipFile(local_path) as archive:
+                names = archive.namelist()
+                if "[Content_Types].xml" in names and any(n.startswith("xl/") for n in names):
+                    return "xlsx"
+                if "mimetype" in names:
+                    mimetype = archive.read("mimetype").decode("ascii", errors="ignore")
+                    if mimetype.endswith("opendocument.spreadsheet"):
+                        return "ods"
+        except zipfile.BadZipFile:
+            pass
+        return "zip"
+
+    @classmethod
+    def search_loader_class(cls, file_url: str, file_format: str | None = None) -> type | None:
+        """
+        Searches for a loader class, from the cheapest to the most expensive clue:
+        - the file extension;
+        - the known format of the file, as an extension or a media type;
+        - the first bytes of a local file;
+        - the content type of a remote file, from a (cached) HEAD request.
+        """
+        loader_classes = list(dict.fromkeys(LOADER_CLASSES.values()))
+        file_extension = cls.get_file_extension(file_url).lower()
+        if file_extension in LOADER_CLASSES:
+            return LOADER_CLASSES[file_extension]
+
+        if isinstance(file_format, str) and file_format:
+            if file_format.lower() in LOADER_CLASSES:
+                return LOADER_CLASSES[file_format.lower()]
+            for loader_class in loader_classes:
+                if loader_class.can_load_file_media_type(file_format):
+                    return loader_class
+
+        if not cls.get_file_is_url(file_url):
+            sniffed_format = cls.sniff_file_format(file_url)
+            return LOADER_CLASSES.get(sniffed_format) if sniffed_format else None
+
+        file_media_type = cls.get_cached_file_media_type(file_url)
+        for loader_class in loader_classes:
+            if loader_class.can_load_file_media_type(file_media_type):
+                return loader_class
         return None
 
     @classmethod
@@ -167,16 +228,16 @@ class BaseLoader:
     ) -> bool:
         """
         Check if the given file URL, extension or content type can be loaded by the current loader class.
+        The content type of a URL is only requested when its extension is not enough.
         """
-        if file_url:
-            if not file_extension:
-                file_extension = cls.get_file_extension(file_url)
-            if not file_media_type:
-                file_media_type = cls.get_file_media_type(file_url)
+        if file_url and not file_extension:
+            file_extension = cls.get_file_extension(file_url)
+        if cls.can_load_file_extension(file_extension):
+            return True
 
-        return cls.can_load_file_extension(file_extension) or cls.can_load_file_media_type(
-            file_media_type
-        )
+        if file_url and not file_media_type:
+            file_media_type = cls.get_cached_file_media_type(file_url)
+        return cls.can_load_file_media_type(file_media_type)
 
     @classmethod
     def can_load_file_extension(cls, file_extension: str) -> bool:
@@ -202,12 +263,35 @@ class BaseLoader:
 
 
 class EncodedDataLoader(BaseLoader):
+    """
+    Base class for the loaders of text files, whose encoding is unknown.
+
+    The encoding is detected on samples of the content (see `detect_encoding`),
+    so that the content is usually decoded once. If it fails, the other accepted encodings are tried.
+    The encoding which succeeded is available in `encoding`. It can also be set
+    before loading, when known from a previous load of the same file.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.encoding: str | None = None
+
     def get_accepted_encodings(self) -> list[str]:
         # Try different encodings for the data, sorted by priority
         return ["utf-8-sig", "windows-1252", "latin1", "utf-16"]
 
+    def get_candidate_encodings(self, stream: BinaryIO) -> list[str]:
+        """
+        Accepted encodings, starting with the known or detected encoding of the content.
+        """
+        accepted = self.get_accepted_encodings()
+        first = self.encoding or detect_encoding(stream, accepted)
+        if first is None:
+            return accepted
+        return [first, *[e for e in accepted if e != first]]
+
     def process_data(self, data):
-        for encoding in self.get_accepted_encodings():
+        for encoding in self.get_candidate_encodings(BytesIO(data)):
             try:
                 decoded_content = data.decode(encoding)
             except UnicodeDecodeError:
@@ -218,6 +302,7 @@ class EncodedDataLoader(BaseLoader):
                 LOGGER.info(f"Successfully decoded using {encoding} encoding")
                 decoded_data = self.process_from_decoded(decoded_content)
                 if decoded_data is not None:
+                    self.encoding = encoding
                     return decoded_data
 
         LOGGER.error(f"Unable to process content from: {self.file_url}")
@@ -225,3 +310,8 @@ class EncodedDataLoader(BaseLoader):
 
     def process_from_decoded(self, decoded_content: str):
         raise NotImplementedError("This method should be implemented by subclasses.")
+
+
+@functools.lru_cache(maxsize=MEDIA_TYPE_CACHE_SIZE)
+def _probe_media_type(file_url: str) -> str:
+    return BaseLoader.get_file_media_type(file_url)
@@ -1,7 +1,10 @@
+import codecs
 import csv
+import io
 import logging
 import re
-from io import StringIO
+from collections.abc import Callable
+from typing import BinaryIO, TextIO
 
 import pandas as pd
 
@@ -19,8 +22,13 @@ class CSVLoader(EncodedDataLoader):
     file_media_type_regex = re.compile(r"csv", flags=re.IGNORECASE)
     """
     Initialize the CSV loader for either URL or local file.
+
+    The encoding is detected on samples of the file and the dialect on its first `sample_size` bytes.
+    The file is then decoded while being read by pandas, without holding its decoded content.
     """
 
+    sample_size = 1 << 20
+
     def get_loader_kwargs(self):
         kwargs = super().get_loader_kwargs()
         kwargs |= {
@@ -35,22 +43,71 @@ class CSVLoader(EncodedDataLoader):
 
         return kwargs
 
-    def process_from_decoded(self, decoded_content) -> pd.DataFrame | None:
+    def process_file(self, local_path: str) -> pd.DataFrame | None:
+        return self.process_stream(lambda: open(local_path, "rb"))
+
+    def process_data(self, data: bytes) -> pd.DataFrame | None:
+        return self.process_stream(lambda: io.BytesIO(data))
+
+    def process_stream(self, open_binary: Callable[[], BinaryIO]) -> pd.DataFrame | None:
+        """
+        Read the CSV from a binary stream, opened once to detect the encoding and to read
+        the sample of its beginning, and once more per tried encoding.
+        An encoding which fails further in the file is replaced by the next candidate.
+        """
+        with open_binary() as f:
+            encodings = self.get_candidate_encodings(f)
+            prefix = f.read(self.sample_size)
+        is_complete = len(prefix) < self.sample_size
+
+        for encoding in encodings:
+            try:
+                decoder = codecs.getincrementaldecoder(encoding)()
+                sample = decoder.decode(prefix, final=is_complete)
+            except UnicodeDecodeError:
+                LOGGER.debug(f"Failed to decode using {encoding} encoding")
+                continue
+
+            LOGGER.info(
+                f"Successfully decoded the beginning of the file using {encoding} encoding"
+            )
+            # Universal newlines replace the windows newlines, as WINDOWS_NEWLINE
+            with io.TextIOWrapper(open_binary(), encoding=encoding, newline=None) as content:
+                try:
+                    df = self._read_csv(content, sample)
+                except UnicodeDecodeError:
+                    LOGGER.debug(f"Failed to decode using {encoding} encoding")
+                    continue
+            if df is not None:
+                self.encoding = encoding
+                return df
+
+        LOGGER.error(f"Unable to process content from: {self.file_url}")
+        return None
+
+    def process_from_decoded(self, decoded_content: str) -> pd.DataFrame | None:
+        content = WINDOWS_NEWLINE.sub("\n", STARTING_NEWLINE.sub("", decoded_content))
+        return self._read_csv(io.StringIO(content), content)
+
+    def _read_csv(self, content: TextIO, sample: str) -> pd.DataFrame | None:
+        """
+        Read the CSV, with the delimiter and the header detected on a sample of its beginning.
+        Leading empty lines are skipped by pandas.
+        """
         loader_kwargs = self.get_loader_kwargs()
 
         # If the delimiter is not specified, try to detect it
-        decoded_content = STARTING_NEWLINE.sub("", decoded_content)
-        decoded_content = WINDOWS_NEWLINE.sub("\n", decoded_content)
+        sample = WINDOWS_NEWLINE.sub("\n", STARTING_NEWLINE.sub("", sample))
         sniffer = csv.Sniffer()
-        sample = decoded_content[: min(4096, len(decoded_content))]
+        sniffed = sample[: min(4096, len(sample))]
 
         try:
-            dialect = sniffer.sniff(sample)
-            loader_kwargs["header"] = 0 if sniffer.has_header(sample) else None
+            dialect = sniffer.sniff(sniffed)
+            loader_kwargs["header"] = 0 if sniffer.has_header(sniffed) else None
         except csv.Error as e:
             LOGGER.warning(f"CSV Sniffer error: {e}")
             # Try to find the most common delimiter
-            counts = {sep: decoded_content.count(sep) for sep in (",", ";", "\t")}
+            counts = {sep: sample.count(sep) for sep in (",", ";", "\t")}
             delimiter = max(counts, key=counts.get)
         else:
             delimiter = dialect.delimiter
@@ -59,7 +116,9 @@ class CSVLoader(EncodedDataLoader):
         LOGGER.debug(f"Detected delimiter: '{delimiter}'")
 
         try:
-            df = pd.read_csv(StringIO(decoded_content), **loader_kwargs)
+            df = pd.read_csv(content, **loader_kwargs)
+        except UnicodeDecodeError:
+            raise
         except Exception as e:
             LOGGER.warning(f"Error while reading CSV: {e}")
             return
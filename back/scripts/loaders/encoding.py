@@ -0,0 +1,97 @@
+import codecs
+import logging
+from typing import BinaryIO
+
+LOGGER = logging.getLogger(__name__)
+
+# Byte order marks, and the encoding of the files starting with them.
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+# Share of NUL bytes above which a file is considered as utf-16 without BOM.
+UTF16_NUL_RATIO = 0.1
+WINDOW_SIZE = 1 << 16
+N_WINDOWS = 4
+
+
+def detect_encoding(
+    stream: BinaryIO,
+    encodings: list[str],
+    window_size: int = WINDOW_SIZE,
+    n_windows: int = N_WINDOWS,
+) -> str | None:
+    """
+    Guess the encoding of a seekable binary stream among the accepted encodings,
+    from a few windows of its content instead of decoding it entirely :
+    - a byte order mark identifies utf-8 or utf-16;
+    - a high share of NUL bytes at the beginning of the stream indicates utf-16;
+    - otherwise, the first encoding decoding windows spread over the whole stream is chosen.
+
+    The guess is not a guarantee : the stream can still fail to decode outside of the windows.
+
+    Returns:
+        The detected encoding, None if no accepted encoding decodes the windows.
+    """
+    size = stream.seek(0, 2)
+    windows = [
+        _read_window(stream, offset, window_size)
+        for offset in _offsets(size, window_size, n_windows)
+    ]
+    stream.seek(0)
+    if not windows:
+        return encodings[0] if encodings else None
+
+    head = windows[0][1]
+    for bom, encoding in BOMS:
+        if head.startswith(bom) and encoding in encodings:
+            LOGGER.debug(f"Detected {encoding} from its byte order mark")
+            return encoding
+
+    if "utf-16" in encodings and head.count(0) > UTF16_NUL_RATIO * len(head):
+        LOGGER.debug("Detected utf-16 from the share of NUL bytes")
+        return "utf-16"
+
+    for encoding in encodings:
+        if all(_decodes(window, encoding, offset, size) for offset, window in windows):
+            return encoding
+    return None
+
+
+def _offsets(size: int, window_size: int, n_windows: int) -> list[int]:
+    """
+    Offsets of windows evenly spread over the stream, the first one at its beginning
+    and the last one at its end.
+    """
+    if size <= window_size * n_windows:
+        return list(range(0, size, window_size))
+    last = size - window_size
+    return sorted({round(i * last / (n_windows - 1)) for i in range(n_windows)})
+
+
+def _read_window(stream: BinaryIO, offset: int, window_size: int) -> tuple[int, bytes]:
+    stream.seek(offset)
+    return offset, stream.read(window_size)
+
+
+def _decodes(window: bytes, encoding: str, offset: int, size: int) -> bool:
+    """
+    Check that a window of the stream can be decoded.
+    Characters split at the edges of the window are ignored.
+    """
+    final = offset + len(window) >= size
+    if offset > 0:
+        if codecs.lookup(encoding).name.startswith("utf-8"):
+            # Skip the continuation bytes of a character starting before the window
+            window = window[
+                next((i for i, b in enumerate(window[:4]) if b & 0xC0 != 0x80), 0) :
+            ]
+            encoding = "utf-8"
+        elif codecs.lookup(encoding).name.startswith("utf-16"):
+            window = window[offset % 2 :]
+    try:
+        codecs.getincrementaldecoder(encoding)().decode(window, final=final)
+    except UnicodeDecodeError:
+        return False
+    return True
@@ -1,12 +1,12 @@
 import logging
 import tempfile
-import urllib.request
 from pathlib import Path
 
 import pandas as pd
 
 from back.scripts.loaders.base_loader import BaseLoader
 from back.scripts.loaders.utils import register_loader
+from back.scripts.utils.http_client import get_http_client
 
 LOGGER = logging.getLogger(__name__)
 
@@ -18,7 +18,7 @@ class ParquetLoader(BaseLoader):
     def _load_from_url(self) -> pd.DataFrame:
         with tempfile.TemporaryDirectory() as tempdir:
             filename = Path(tempdir) / "test.parquet"
-            urllib.request.urlretrieve(self.file_url, filename)
+            get_http_client().download(self.file_url, filename)
             return pd.read_parquet(filename, **self.get_loader_kwargs())
 
     def _load_from_file(self) -> pd.DataFrame:
@@ -1,7 +1,6 @@
 import logging
 import re
 import tempfile
-import urllib.request
 import zipfile
 from pathlib import Path
 from typing import Type
@@ -9,6 +8,7 @@ from urllib.parse import urlparse
 
 from back.scripts.loaders import BaseLoader
 from back.scripts.loaders.utils import LOADER_CLASSES, register_loader
+from back.scripts.utils.http_client import get_http_client
 
 LOGGER = logging.getLogger(__name__)
 
@@ -38,7 +38,7 @@ class ZipLoader(BaseLoader):
     def _load_from_url(self):
         with tempfile.TemporaryDirectory() as tempdir:
             filename = Path(tempdir) / "null.zip"
-            urllib.request.urlretrieve(self.file_url, filename)
+            get_http_client().download(self.file_url, filename)
             if self.archived_file_loader_class is None:
                 self.archived_file_loader_class = self._loader_class_resolver_from_url()
             self.file_url = str(filename)
@@ -16,6 +16,14 @@ class ArgumentParser:
             default="./back/config.yaml",
             help="Chemin vers le fichier de configuration, format yaml",
         )
+        parser.add_argument(
+            "-w",
+            "--max-workers",
+            type=int,
+            required=False,
+            default=1,
+            help="Nombre de workflows indépendants exécutés en parallèle",
+        )
 
         args = parser.parse_args()
         return args
@@ -33,7 +33,7 @@ class Config:
         return self.__getitem__(name)
 
     def __getitem__(self, name):
-        if hasattr(self, "_conf"):
+        if "_conf" in self.__dict__:
             return self._conf[name]
         raise AttributeError("self._conf not found. Did you forget to .load the instance ?")
 
@@ -51,6 +51,12 @@ class Config:
         self._conf = conf
         self._locked = True
 
+    def dump(self) -> dict | None:
+        """
+        Return the loaded configuration, None if it has not been loaded yet.
+        """
+        return self.__dict__.get("_conf")
+
 
 # At this stage, the instance is created without configuration because the conf file has not yet been loaded
 project_config = Config(None)
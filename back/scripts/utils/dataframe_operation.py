@@ -4,6 +4,7 @@ from enum import Enum
 
 import numpy as np
 import pandas as pd
+import polars as pl
 from unidecode import unidecode
 
 from back.scripts.datasets.constants import FORMAT_PRIORITIES
@@ -23,6 +24,44 @@ class IdentifierFormat(Enum):
     SIRET = "siret"
 
 
+# Date formats tried, in order, to parse a column of dates.
+# The ambiguous day/month formats are ordered according to the detected convention.
+# The columns following none of them are parsed with pandas, see `normalize_columns`.
+ISO_DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%dT%H:%M",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S%.f",
+    "%Y-%m-%dT%H:%M:%S%.f",
+    "%Y-%m-%d %H:%M:%S%#z",
+    "%Y-%m-%dT%H:%M:%S%#z",
+    "%Y-%m-%d %H:%M:%S%.f%#z",
+    "%Y-%m-%dT%H:%M:%S%.f%#z",
+    "%Y/%m/%d",
+    "%Y/%m/%d %H:%M",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y-%m",
+]
+DAYFIRST_DATE_FORMATS = [
+    "%d/%m/%Y",
+    "%d/%m/%Y %H:%M",
+    "%d/%m/%Y %H:%M:%S",
+    "%d-%m-%Y",
+    "%d.%m.%Y",
+    "%d/%m/%y",
+]
+MONTHFIRST_DATE_FORMATS = [
+    "%m/%d/%Y",
+    "%m/%d/%Y %H:%M",
+    "%m/%d/%Y %H:%M:%S",
+    "%m-%d-%Y",
+    "%m.%d.%Y",
+    "%m/%d/%y",
+]
+
+
 def merge_duplicate_columns(df: pd.DataFrame, separator: str = " / ") -> pd.DataFrame:
     """
     Identify columns with the same name and merge their content into a single column.
@@ -110,6 +149,53 @@ def normalize_montant(frame: pd.DataFrame, id_col: str) -> pd.DataFrame:
     return frame.assign(**{id_col: montant})
 
 
+def clean_montant(value: str) -> float | None:
+    """
+    Convert an amount written as text to a float, with the same rules as `normalize_montant`.
+    """
+    montant = re.sub(r"[\u20ac\xa0 ]", "", value).replace("euros", "").strip()
+    divisor = 1
+    if re.match(r".*[.,]\d{1}$", montant):
+        divisor = 10
+    elif re.match(r".*[.,]\d{2}$", montant):
+        divisor = 100
+    try:
+        return float(re.sub(r"[,.]", "", montant)) / divisor
+    except ValueError:
+        return None
+
+
+def normalize_montant_expr(column: str, dtype: pl.DataType) -> pl.Expr:
+    """
+    Polars equivalent of `normalize_montant`, for a column of the given type.
+    """
+    montant = pl.col(column)
+    if dtype.is_float():
+        return montant.abs()
+    if dtype.is_integer():
+        return montant.cast(pl.Float64).abs()
+
+    montant = (
+        pl.when(montant.cast(pl.String) != "")
+        .then(montant.cast(pl.String))
+        .str.replace_all(r"[\u20ac\xa0 ]", "")
+        .str.replace_all("euros", "", literal=True)
+        .str.strip_chars()
+    )
+    with_double_digits = montant.str.contains(r"[.,]\d{2}$")
+    with_single_digits = montant.str.contains(r"[.,]\d$")
+    value = montant.str.replace_all(r"[,.]", "").cast(pl.Float64)
+    return (
+        pl.when(with_single_digits)
+        .then(value / 10)
+        .when(with_double_digits)
+        .then(value / 100)
+        .otherwise(value)
+        .abs()
+        .alias(column)
+    )
+
+
 def normalize_commune_code(frame: pd.DataFrame, id_col: str) -> pd.DataFrame:
     if id_col not in frame.columns:
         return frame
@@ -169,6 +255,65 @@ def normalize_identifiant(
     raise RuntimeError("idBeneficiaire median length is neither siren not siret.")
 
 
+def normalize_identifiant_expr(
+    column: str, median_length: float | None, format: IdentifierFormat = IdentifierFormat.SIRET
+) -> pl.Expr:
+    """
+    Polars equivalent of `normalize_identifiant`, given the median length of the
+    cleaned identifiers (see `identifiant_median_length`).
+
+    Raises:
+        RuntimeError: If the median length of identifiers is neither 9 (SIREN) nor 14 (SIRET)
+    """
+    if not isinstance(format, IdentifierFormat):
+        raise RuntimeError(
+            f"Format must be an IdentifierFormat enum value. Got: {type(format)}"
+        )
+
+    identifiant = _clean_identifiant_expr(column)
+    filling = 14 if format == IdentifierFormat.SIRET else 9
+    if median_length == 9:
+        # identifier is actually siren
+        return identifiant.str.zfill(9).str.pad_end(filling, "0").alias(column)
+    elif median_length == 14:
+        # identifier is actually siret
+        return identifiant.str.zfill(14).str.slice(0, filling).alias(column)
+    raise RuntimeError(f"{column} median length is neither siren not siret.")
+
+
+def identifiant_median_length(frame: pl.LazyFrame, column: str) -> float | None:
+    """
+    Median length of the cleaned identifiers of a column.
+    The frame is collected to compute it, so it should be called on a frame as small as possible.
+    """
+    return (
+        frame.select(_clean_identifiant_expr(column).str.len_chars().median()).collect().item()
+    )
+
+
+def normalize_identifiant_lazy(
+    frame: pl.LazyFrame, column: str, format: IdentifierFormat = IdentifierFormat.SIRET
+) -> pl.LazyFrame:
+    """
+    Polars equivalent of `normalize_identifiant`, see `normalize_identifiant_expr`.
+    """
+    if column not in frame.collect_schema():
+        return frame
+    median_length = identifiant_median_length(frame, column)
+    return frame.with_columns(normalize_identifiant_expr(column, median_length, format))
+
+
+def _clean_identifiant_expr(column: str) -> pl.Expr:
+    raw = pl.col(column).cast(pl.String)
+    return (
+        pl.when(raw != "")
+        .then(raw)
+        .str.strip_chars()
+        .str.replace_all(".0", "", literal=True)
+        .str.replace_all(r"[\xa0 ]", "")
+    )
+
+
 def normalize_date(frame: pd.DataFrame, id_col: str) -> pd.DataFrame:
     if id_col not in frame.columns:
         return frame
@@ -201,6 +346,194 @@ def normalize_date(frame: pd.DataFrame, id_col: str) -> pd.DataFrame:
     return frame.assign(**{id_col: dt})
 
 
+def normalize_date_expr(
+    column: str, dtype: pl.DataType, date_format: str | None = None
+) -> pl.Expr:
+    """
+    Polars equivalent of `normalize_date`, for a column of the given type.
+
+    As with pandas, the format of the dates is the one of the first non empty value,
+    and the values which do not follow that format are set to null.
+    When known beforehand (see `detect_date_format`), the format of text dates can be given
+    so that the column is parsed once instead of once per candidate format.
+    """
+    dt = pl.col(column)
+    if isinstance(dtype, pl.Datetime):
+        dt = dt.dt.cast_time_unit("us")
+        if dtype.time_zone is None:
+            dt = dt.dt.replace_time_zone("UTC")
+        else:
+            dt = dt.dt.convert_time_zone("UTC")
+    elif dtype == pl.Date:
+        dt = dt.cast(pl.Datetime("us", "UTC"))
+    elif dtype == pl.Null:
+        dt = dt.cast(pl.Datetime("us", "UTC"))
+    elif date_format is not None:
+        dt = _to_datetime_expr(pl.col(column).cast(pl.String), date_format)
+    else:
+        dt = _parse_dates_expr(pl.col(column).cast(pl.String))
+
+    return pl.when(dt.dt.year() >= 2000).then(dt).cast(pl.Datetime("ns", "UTC")).alias(column)
+
+
+def detect_date_format(frame: pl.LazyFrame, column: str) -> str | None:
+    """
+    Format of the text dates of a column, as chosen by `normalize_date_expr`.
+    None if the column only contains years or if no format matches its first value.
+    The frame is collected to compute it.
+    """
+    dts = pl.col(column).cast(pl.String)
+    year_only, dayfirst, first_value = (
+        frame.select(
+            dts.cast(pl.Float64, strict=False).is_not_null().any().alias("year_only"),
+            _dayfirst_expr(dts).fill_null(False).alias("dayfirst"),
+            dts.filter(dts != "").first().alias("first_value"),
+        )
+        .collect()
+        .row(0)
+    )
+    if year_only or first_value is None:
+        return None
+    for date_format in _date_formats(dayfirst):
+        parsed = pl.select(_to_datetime_expr(pl.lit(first_value), date_format)).item()
+        if parsed is not None:
+            return date_format
+    return None
+
+
+def _has_unknown_date_format(frame: pl.LazyFrame, column: str) -> bool:
+    """
+    Whether a column of text dates without any format of `_date_formats`
+    (see `detect_date_format`) has values that polars cannot parse, unlike pandas:
+    other formats of dates, or numbers which are not years.
+    """
+    dts = pl.col(column).cast(pl.String)
+    numbers = dts.cast(pl.Float64, strict=False)
+    has_numbers, max_number, has_values = (
+        frame.select(
+            numbers.is_not_null().any().alias("has_numbers"),
+            numbers.abs().max().alias("max_number"),
+            (dts != "").any().alias("has_values"),
+        )
+        .collect()
+        .row(0)
+    )
+    if has_numbers:
+        return max_number >= 10000
+    return bool(has_values)
+
+
+def _date_formats(dayfirst: bool) -> list[str]:
+    if dayfirst:
+        return ISO_DATE_FORMATS + DAYFIRST_DATE_FORMATS + MONTHFIRST_DATE_FORMATS
+    return ISO_DATE_FORMATS + MONTHFIRST_DATE_FORMATS + DAYFIRST_DATE_FORMATS
+
+
+def _dayfirst_expr(dts: pl.Expr) -> pl.Expr:
+    formats = dts.drop_nulls().str.replace_all(r"\d", "d")
+    return formats.mode().first().str.starts_with("d" * 4).not_()
+
+
+def _to_datetime_expr(dts: pl.Expr, date_format: str) -> pl.Expr:
+    return dts.str.to_datetime(date_format, strict=False, time_unit="us", time_zone="UTC")
+
+
+def _parse_dates_expr(dts: pl.Expr) -> pl.Expr:
+    # A single year in the column means it only contains years
+    year_only = dts.cast(pl.Float64, strict=False)
+    years = (year_only.fill_null(0).cast(pl.Int64).cast(pl.String) + "-01-01").str.to_date(
+        "%Y-%m-%d", strict=False
+    )
+    first_value = dts.filter(dts != "").first()
+
+    def parse(candidates: list[str]) -> pl.Expr:
+        # Use the first format that matches the first value
+        parsed = [_to_datetime_expr(dts, fmt) for fmt in candidates]
+        matching = [
+            first_value.str.to_datetime(fmt, strict=False, time_unit="us").is_not_null()
+            for fmt in candidates
+        ]
+        out = pl.lit(None, dtype=pl.Datetime("us", "UTC"))
+        for is_matching, values in reversed(list(zip(matching, parsed, strict=True))):
+            out = pl.when(is_matching).then(values).otherwise(out)
+        return out
+
+    return (
+        pl.when(year_only.is_not_null().any())
+        .then(years.cast(pl.Datetime("us")).dt.replace_time_zone("UTC"))
+        .when(_dayfirst_expr(dts).fill_null(False))
+        .then(parse(_date_formats(dayfirst=True)))
+        .otherwise(parse(_date_formats(dayfirst=False)))
+    )
+
+
+def normalize_columns(
+    frame: pd.DataFrame,
+    identifiants: dict[str, IdentifierFormat] | None = None,
+    montants: list[str] | None = None,
+    dates: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Apply `normalize_identifiant`, `normalize_montant` and `normalize_date` to the columns
+    of a pandas DataFrame, in a single pass of their polars equivalents.
+    The dates which follow none of the known formats are parsed with `normalize_date`.
+    Columns missing from the frame are ignored.
+    """
+    identifiants = {k: v for k, v in (identifiants or {}).items() if k in frame.columns}
+    montants = [c for c in montants or [] if c in frame.columns]
+    dates = [c for c in dates or [] if c in frame.columns]
+    columns = [*identifiants, *montants, *dates]
+    if not columns:
+        return frame
+
+    polars_frame = pl.DataFrame([_to_polars_series(frame[c]) for c in columns])
+    schema = polars_frame.schema
+    date_formats = {
+        c: detect_date_format(polars_frame.lazy().select(c), c)
+        for c in dates
+        if schema[c] == pl.String
+    }
+    pandas_dates = [
+        c
+        for c, date_format in date_formats.items()
+        if date_format is None and _has_unknown_date_format(polars_frame.lazy().select(c), c)
+    ]
+    normalized = polars_frame.lazy().select(
+        *[
+            normalize_identifiant_expr(
+                c, identifiant_median_length(polars_frame.lazy().select(c), c), format
+            )
+            for c, format in identifiants.items()
+        ],
+        *[normalize_montant_expr(c, schema[c]) for c in montants],
+        *[
+            normalize_date_expr(c, schema[c], date_formats.get(c))
+            for c in dates
+            if c not in pandas_dates
+        ],
+    )
+    normalized = normalized.collect().to_pandas().set_axis(frame.index)
+    # As with pandas, the missing identifiers are NaN rather than None
+    normalized[list(identifiants)] = normalized[list(identifiants)].fillna(np.nan)
+    for c in pandas_dates:
+        normalized[c] = normalize_date(frame[[c]], c)[c]
+    return frame.assign(**{c: normalized[c] for c in columns})
+
+
+def _to_polars_series(values: pd.Series) -> pl.Series:
+    """
+    Convert a pandas column to polars. As in the pandas normalizers,
+    values of a non typed column are converted to text, unless they already all are.
+    """
+    if not (
+        pd.api.types.is_numeric_dtype(values)
+        or pd.api.types.is_datetime64_any_dtype(values)
+        or pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty")
+    ):
+        values = values.astype(str).where(values.notnull(), None)
+    return pl.from_pandas(values.reset_index(drop=True))
+
+
 def is_dayfirst(dts: pd.Series) -> bool:
     formats = dts.dropna().str.replace(r"\d", "d", regex=True)
     top_format = formats.value_counts().sort_values(ascending=False)
@@ -5,8 +5,8 @@ from pathlib import Path
 
 import pandas as pd
 
-from back.scripts.loaders.base_loader import retry_session
 from back.scripts.loaders.utils import LOADER_CLASSES
+from back.scripts.utils.http_client import get_http_client
 
 LOGGER = logging.getLogger(__name__)
 
@@ -145,8 +145,7 @@ class DataGouvAPI:
         """
         Fetch the content of a given page and eventually the link to the next page.
         """
-        session = retry_session(retries=5)
-        response = session.get(url, params=params)
+        response = get_http_client().get(url, params=params)
         try:
             response.raise_for_status()
         except Exception as e:
@@ -3,6 +3,11 @@ import logging
 import time
 from typing import Any, Callable
 
+import pandas as pd
+import polars as pl
+
+from back.scripts.utils import metrics
+
 
 def tracker(
     _func: Callable[..., Any] | None = None,
@@ -11,10 +16,15 @@ def tracker(
     outputs: bool = False,
     log_start: bool = False,
     level: str = "info",
+    rows: bool = False,
 ):
     """
     Create a Python factory decorator that returns a decorator to log the execution of a function.
 
+    The wall time, the CPU time and the increase of the peak memory of the process are logged,
+    and sent as a span to the sinks of `back.scripts.utils.metrics`.
+    The spans of nested tracked functions are linked to the span of their caller.
+
     Args:
         _func (Callable[...,Any] | None): if given, returns the decorated function. Else returns the decorator.
         ulogger: Logger to use. Uses logging.getLogger() by default.
@@ -22,6 +32,7 @@ def tracker(
         outputs (bool): if True, logs the values returned by the function.
         log_start (bool): if True, logs a "start" message before running the function.
         level (str): Logging level to use.
+        rows (bool): if True, logs the number of rows of the returned DataFrame.
 
     Returns:
         Callable[...,Any]: returns a decorator or a decorated function if '_func' argument is given.
@@ -54,10 +65,29 @@ def tracker(
 
             if log_start:
                 _log(ulogger, level, "start", extra)
-            start_time = time.time()
-            value = func(*args, **kwargs)
-            end_time = time.time()
-            extra["duration_"] = round((end_time - start_time), 3)
+            span, token = metrics.start_span()
+            span |= {"name": func.__qualname__, "start": time.time(), "status": "ok"}
+            start_time = time.perf_counter()
+            start_cpu_time = time.process_time()
+            start_peak_rss = metrics.peak_rss_mb()
+            try:
+                value = func(*args, **kwargs)
+                if rows and isinstance(value, pl.DataFrame | pd.DataFrame):
+                    span["rows"] = extra["rows_"] = len(value)
+            except Exception:
+                span["status"] = "error"
+                raise
+            finally:
+                metrics.end_span(token)
+                span["duration"] = round(time.perf_counter() - start_time, 3)
+                span["cpu_time"] = round(time.process_time() - start_cpu_time, 3)
+                if start_peak_rss is not None:
+                    span["peak_rss_delta_mb"] = round(metrics.peak_rss_mb() - start_peak_rss, 1)
+                metrics.emit(span)
+
+            extra["duration_"] = span["duration"]
+            extra["cpu_time_"] = span["cpu_time"]
+            extra["peak_rss_delta_mb_"] = span.get("peak_rss_delta_mb")
             if outputs:
                 extra["return_"] = value
             _log(ulogger, level=level, msg="tracker", extra=extra)
@@ -0,0 +1,115 @@
+import json
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+
+LOGGER = logging.getLogger(__name__)
+
+# Columns of the data.gouv catalog describing the current version of a resource.
+CATALOG_FINGERPRINT_COLUMNS = {
+    "extras_analysis:checksum": "catalog_checksum",
+    "extras_analysis:last-modified-at": "catalog_last_modified",
+}
+
+
+class DownloadCache:
+    """
+    Persistent information about the downloaded version of each file, keyed by `url_hash`.
+
+    For each file, a `download.json` file is stored next to the raw file with :
+    - the ETag and Last-Modified headers returned by the server, used for conditional requests;
+    - the checksum and last modification date of the resource in the data.gouv catalog,
+      used to skip the request entirely when the resource has not changed;
+    - the encoding of the file detected by the loaders, so that it is not detected again;
+    - the error of the last download of the file if the server refused it for good,
+      with the catalog fingerprint of the file at that time (see `known_failure`).
+    The entry is replaced when a new version of the file is downloaded.
+    """
+
+    FILENAME = "download.json"
+
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+
+    def _filename(self, url_hash: str) -> Path:
+        return self.folder / url_hash / self.FILENAME
+
+    def get(self, url_hash: str) -> dict:
+        filename = self._filename(url_hash)
+        if not filename.exists():
+            return {}
+        try:
+            with open(filename) as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            LOGGER.warning(f"Corrupted download cache {filename}, ignoring it")
+            return {}
+
+    def set(self, url_hash: str, entry: dict) -> None:
+        filename = self._filename(url_hash)
+        filename.parent.mkdir(exist_ok=True, parents=True)
+        entry = entry | {"checked_at": datetime.now(timezone.utc).isoformat()}
+        with open(filename, "w") as f:
+            json.dump(entry, f)
+
+    def update(self, url_hash: str, **fields) -> None:
+        """
+        Add information about the downloaded file to its entry, without marking it as checked.
+        """
+        entry = self.get(url_hash) | fields
+        filename = self._filename(url_hash)
+        filename.parent.mkdir(exist_ok=True, parents=True)
+        with open(filename, "w") as f:
+            json.dump(entry, f)
+
+    def set_failure(self, url_hash: str, file_metadata, error: str) -> None:
+        """
+        Record that the download of the file failed for good.
+        """
+        failure = {"error": error} | self.catalog_fingerprint(file_metadata)
+        self.update(url_hash, failure=failure)
+
+    @classmethod
+    def known_failure(cls, entry: dict, file_metadata) -> str | None:
+        """
+        Error of the failed download of the file, if the catalog still describes
+        the same version of it. As for `is_unchanged_in_catalog`, a checksum is required.
+        """
+        failure = entry.get("failure")
+        if not failure or not cls.is_unchanged_in_catalog(failure, file_metadata):
+            return None
+        return failure["error"]
+
+    @staticmethod
+    def conditional_headers(entry: dict) -> dict:
+        """
+        Headers of a conditional GET request built from a cache entry.
+        """
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    @staticmethod
+    def catalog_fingerprint(file_metadata) -> dict:
+        """
+        Catalog checksum and last modification date of a file, if known.
+        """
+        fingerprint = {}
+        for column in CATALOG_FINGERPRINT_COLUMNS.values():
+            value = getattr(file_metadata, column, None)
+            fingerprint[column] = None if value is None or pd.isna(value) else str(value)
+        return fingerprint
+
+    @classmethod
+    def is_unchanged_in_catalog(cls, entry: dict, file_metadata) -> bool:
+        """
+        True if the catalog describes the same version of the file as the one downloaded.
+        Only the checksum is reliable enough to skip the download.
+        """
+        checksum = cls.catalog_fingerprint(file_metadata)["catalog_checksum"]
+        return checksum is not None and entry.get("catalog_checksum") == checksum
@@ -8,8 +8,8 @@ import pandas as pd
 from requests import Response
 
 from back.scripts.loaders import BaseLoader
-from back.scripts.loaders.base_loader import retry_session
 from back.scripts.utils.dataframe_operation import IdentifierFormat, normalize_identifiant
+from back.scripts.utils.http_client import get_http_client
 
 LOGGER = logging.getLogger(__name__)
 
@@ -59,8 +59,7 @@ class GeoLocator:
 
         filepath.parent.mkdir(exist_ok=True, parents=True)
         url = self.get_geo_type_url(geo_type)
-        session = retry_session(retries=3)
-        response = session.get(url)
+        response = get_http_client().get(url)
 
         try:
             response.raise_for_status()
@@ -0,0 +1,398 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LOGGER = logging.getLogger(__name__)
+
+RETRIES = 3
+BACKOFF_FACTOR = 0.3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+TIMEOUT = 60
+# Number of hosts whose connections are kept open.
+POOL_HOSTS = 32
+MAX_CONNECTIONS_PER_HOST = 4
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Number of times an interrupted download is resumed before giving up.
+RESUME_ATTEMPTS = 3
+# Smallest part of a file fetched by a segment of a segmented download.
+MIN_SEGMENT_SIZE = 64 * 1024 * 1024
+# Errors raised while reading a response whose connection dropped.
+INTERRUPTION_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+# Client shared by the whole process, and its options, see `get_http_client`.
+_CLIENT: "HttpClient | None" = None
+_CLIENT_OPTIONS: dict = {}
+_CLIENT_LOCK = threading.Lock()
+
+
+class HttpClient:
+    """
+    HTTP client shared by all the network accesses of a process.
+
+    A single session keeps the connections alive between requests, so that the TCP and TLS
+    handshakes are made once per host instead of once per request. It also applies a common
+    policy to all the requests :
+    - retries with exponential backoff on connection errors and transient statuses,
+      the Retry-After header of the server being respected;
+    - at most `max_connections_per_host` simultaneous connections to a same host,
+      the other threads waiting for a connection to be released;
+    - an optional minimal delay between two requests to a same host (`min_request_interval`).
+    """
+
+    def __init__(
+        self,
+        retries: int = RETRIES,
+        backoff_factor: float = BACKOFF_FACTOR,
+        timeout: float = TIMEOUT,
+        max_connections_per_host: int = MAX_CONNECTIONS_PER_HOST,
+        min_request_interval: dict[str, float] | None = None,
+        user_agent: str | None = None,
+        resume_attempts: int = RESUME_ATTEMPTS,
+    ):
+        """
+        Args:
+            retries: Number of retries of a failed request
+            backoff_factor: Factor of the exponential delay between retries
+            timeout: Default timeout of the requests in seconds
+            max_connections_per_host: Number of simultaneous connections to a same host
+            min_request_interval: Minimal delay in seconds between two requests, by host
+            user_agent: User-Agent header sent with the requests
+            resume_attempts: Number of times an interrupted download is resumed
+        """
+        self.pid = os.getpid()
+        self.timeout = timeout
+        self.resume_attempts = resume_attempts
+        self.min_request_interval = min_request_interval or {}
+        self._next_request_times: dict[str, float] = {}
+        self._rate_limit_lock = threading.Lock()
+
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            read=retries,
+            connect=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=POOL_HOSTS,
+            pool_maxsize=max_connections_per_host,
+            pool_block=True,
+            max_retries=retry,
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if user_agent:
+            self.session.headers["User-Agent"] = user_agent
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        self._wait_for_host(url)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        return self.request("HEAD", url, **kwargs)
+
+    def download(
+        self,
+        url: str,
+        filename: Path | str,
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+        segments: int = 1,
+        expected_size: int | None = None,
+        checksum: str | None = None,
+        checksum_algorithm: str = "sha256",
+        **kwargs,
+    ) -> requests.Response | None:
+        """
+        Stream the content of a URL to a file by chunks, without holding it in memory.
+
+        The content is written to a temporary `.part` file, atomically renamed to `filename`
+        once complete and verified, so that an existing `filename` is always a whole file.
+        An interrupted download is resumed from the end of the `.part` file with an HTTP Range
+        request, during the call or in a later one, as long as the server identifies
+        the version of the file (ETag or Last-Modified). Large files can be fetched
+        in several `segments` in parallel, when the server accepts ranges.
+        URLs which are not http(s), such as local files, are simply copied.
+
+        Args:
+            segments: Number of parallel range requests for large files
+            expected_size: Size of the file in bytes, by default the size announced by the server
+            checksum: Expected hexadecimal digest of the file
+            checksum_algorithm: Algorithm of the checksum, among the ones of hashlib
+        Returns:
+            The (consumed) response, None for a non http(s) URL.
+            A 304 Not Modified response is returned without writing the file.
+        Raises:
+            requests.HTTPError: if the server answered with an error status.
+            RuntimeError: if the downloaded file does not have the expected size or checksum.
+        """
+        filename = Path(filename)
+        part_filename = filename.with_name(filename.name + ".part")
+        if urlparse(url).scheme.startswith("http"):
+            response, size = self._download_part(
+                url, part_filename, chunk_size, segments, **kwargs
+            )
+            if response.status_code == 304:
+                return response
+        else:
+            urllib.request.urlretrieve(url, part_filename)
+            response, size = None, None
+
+        self._verify_part(part_filename, expected_size or size, checksum, checksum_algorithm)
+        os.replace(part_filename, filename)
+        _state_filename(part_filename).unlink(missing_ok=True)
+        return response
+
+    def _download_part(
+        self, url: str, part_filename: Path, chunk_size: int, segments: int, **kwargs
+    ) -> tuple[requests.Response, int | None]:
+        """
+        Download the content of the URL into the `.part` file, resuming it when interrupted.
+
+        Returns:
+            The response and the size of the file announced by the server, if any.
+        """
+        kwargs["headers"] = {"Accept-Encoding": "identity"} | (kwargs.get("headers") or {})
+        attempt = 0
+        while True:
+            try:
+                if segments > 1:
+                    return self._download_segments(
+                        url, part_filename, chunk_size, segments, **kwargs
+                    )
+                return self._download_stream(url, part_filename, chunk_size, **kwargs)
+            except INTERRUPTION_ERRORS as e:
+                attempt += 1
+                if attempt > self.resume_attempts:
+                    raise
+                LOGGER.warning(f"Download of {url} interrupted ({e}), resuming")
+
+    def _download_stream(
+        self, url: str, part_filename: Path, chunk_size: int, headers: dict, **kwargs
+    ) -> tuple[requests.Response, int | None]:
+        """
+        Download the content in a single request, from the end of the `.part` file if possible.
+        The server sends the whole file instead if it changed since the `.part` file was started.
+        """
+        state = _read_state(part_filename)
+        offset = part_filename.stat().st_size if part_filename.exists() else 0
+        request_headers = headers
+        if offset and state.get("validator") and "segments" not in state:
+            request_headers = headers | {
+                "Range": f"bytes={offset}-",
+                "If-Range": state["validator"],
+            }
+        else:
+            offset = 0
+
+        with self.get(url, stream=True, headers=request_headers, **kwargs) as response:
+            if response.status_code == 304:
+                return response, None
+            if offset and response.status_code == 416:
+                # The `.part` file is already complete, or longer than the current file.
+                size = _content_range_size(response)
+                if size == offset:
+                    return response, size
+                part_filename.unlink()
+                return self._download_stream(url, part_filename, chunk_size, headers, **kwargs)
+            response.raise_for_status()
+
+            if response.status_code == 206:
+                size = _content_range_size(response)
+            else:
+                offset = 0
+                size = int(response.headers.get("Content-Length") or 0) or None
+                _write_state(part_filename, {"validator": _validator(response)})
+            with open(part_filename, "ab" if offset else "wb") as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+            return response, size
+
+    def _download_segments(
+        self,
+        url: str,
+        part_filename: Path,
+        chunk_size: int,
+        segments: int,
+        headers: dict,
+        **kwargs,
+    ) -> tuple[requests.Response, int | None]:
+        """
+        Download the content in parallel range requests, each one writing its part of the file.
+        The completed segments are recorded next to the `.part` file, so that only
+        the others are fetched again when the download is resumed.
+        Small files, and servers which do not accept ranges, are downloaded in a single request.
+        """
+        probe = self.head(url, headers=headers, allow_redirects=True, **kwargs)
+        if probe.status_code == 304:
+            return probe, None
+        probe.raise_for_status()
+        size = int(probe.headers.get("Content-Length") or 0)
+        validator = _validator(probe)
+        if (
+            probe.headers.get("Accept-Ranges") != "bytes"
+            or not validator
+            or size < segments * MIN_SEGMENT_SIZE
+        ):
+            return self._download_stream(url, part_filename, chunk_size, headers, **kwargs)
+
+        state = _read_state(part_filename)
+        if (
+            state.get("validator") != validator
+            or state.get("size") != size
+            or state.get("segments") != segments
+            or not part_filename.exists()
+        ):
+            state = {"validator": validator, "size": size, "segments": segments, "done": []}
+            with open(part_filename, "wb") as f:
+                f.truncate(size)
+            _write_state(part_filename, state)
+
+        bounds = [
+            (i * size // segments, (i + 1) * size // segments - 1) for i in range(segments)
+        ]
+        state_lock = threading.Lock()
+
+        def fetch_segment(index: int) -> None:
+            start, end = bounds[index]
+            range_headers = headers | {"Range": f"bytes={start}-{end}", "If-Range": validator}
+            with self.get(url, stream=True, headers=range_headers, **kwargs) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RuntimeError(f"{url} changed during its download")
+                with open(part_filename, "r+b") as f:
+                    f.seek(start)
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+            with state_lock:
+                state["done"].append(index)
+                _write_state(part_filename, state)
+
+        remaining = [i for i in range(segments) if i not in state["done"]]
+        with ThreadPoolExecutor(max_workers=segments) as pool:
+            list(pool.map(fetch_segment, remaining))
+        return probe, size
+
+    @staticmethod
+    def _verify_part(
+        part_filename: Path,
+        expected_size: int | None,
+        checksum: str | None,
+        checksum_algorithm: str,
+    ) -> None:
+        """
+        Check the size and checksum of a downloaded file, which is removed if they do not match.
+        """
+        error = None
+        size = part_filename.stat().st_size
+        if expected_size is not None and size != expected_size:
+            error = f"{size} bytes downloaded instead of {expected_size}"
+        elif checksum:
+            digest = hashlib.new(checksum_algorithm)
+            with open(part_filename, "rb") as f:
+                while chunk := f.read(DOWNLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+            if digest.hexdigest() != checksum.lower():
+                error = f"{checksum_algorithm} checksum mismatch"
+        if error:
+            part_filename.unlink()
+            _state_filename(part_filename).unlink(missing_ok=True)
+            raise RuntimeError(f"Invalid download of {part_filename.name}: {error}")
+
+    def _wait_for_host(self, url: str) -> None:
+        """
+        Delay the request until the minimal interval since the previous request to the host is over.
+        Each request reserves its slot, so that concurrent requests are spaced out.
+        """
+        host = urlparse(url).netloc
+        interval = self.min_request_interval.get(host)
+        if not interval:
+            return
+        with self._rate_limit_lock:
+            now = time.monotonic()
+            start = max(now, self._next_request_times.get(host, now))
+            self._next_request_times[host] = start + interval
+        if start > now:
+            LOGGER.debug(f"Rate limiting: waiting {start - now:.2f} seconds for {host}")
+            time.sleep(start - now)
+
+
+def _validator(response: requests.Response) -> str | None:
+    """
+    Identifier of the version of a file usable in an If-Range header (weak ETags are not).
+    """
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def _content_range_size(response: requests.Response) -> int | None:
+    """
+    Size of the whole file from the Content-Range header, e.g. "bytes 100-199/1000".
+    """
+    size = response.headers.get("Content-Range", "").rpartition("/")[2]
+    return int(size) if size.isdigit() else None
+
+
+def _state_filename(part_filename: Path) -> Path:
+    return part_filename.with_name(part_filename.name + ".json")
+
+
+def _read_state(part_filename: Path) -> dict:
+    """
+    Information about a partial download, needed to resume it.
+    """
+    try:
+        with open(_state_filename(part_filename)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _write_state(part_filename: Path, state: dict) -> None:
+    with open(_state_filename(part_filename), "w") as f:
+        json.dump(state, f)
+
+
+def configure_http_client(config: dict) -> None:
+    """
+    Set the options of the client of the process from the "http" section of the configuration.
+    """
+    global _CLIENT, _CLIENT_OPTIONS
+    with _CLIENT_LOCK:
+        _CLIENT_OPTIONS = dict(config.get("http") or {})
+        _CLIENT = None
+
+
+def get_http_client() -> HttpClient:
+    """
+    Client shared by the process, created on first use.
+    A forked process creates its own client instead of sharing the connections of its parent.
+    """
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None or _CLIENT.pid != os.getpid():
+            _CLIENT = HttpClient(**_CLIENT_OPTIONS)
+        return _CLIENT
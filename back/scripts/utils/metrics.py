@@ -0,0 +1,153 @@
+import json
+import os
+import sys
+import threading
+import uuid
+from collections import defaultdict
+from contextvars import ContextVar
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# (trace_id, span_id) of the span being executed.
+_CURRENT_SPAN: ContextVar[tuple[str, str] | None] = ContextVar("tracker_span", default=None)
+_SINKS: list = []
+
+
+class JsonLinesSink:
+    """
+    Append each span as a JSON line, in the spirit of the OpenTelemetry spans :
+    the spans of a run share a trace_id and are linked to their parent by parent_id.
+    """
+
+    def __init__(self, filename: Path):
+        self.filename = Path(filename)
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def emit(self, span: dict) -> None:
+        line = json.dumps(span, default=str) + "\n"
+        with self._lock, open(self.filename, "a") as f:
+            f.write(line)
+
+
+class PrometheusTextfileSink:
+    """
+    Aggregate the spans by function into a file for the textfile collector of node_exporter.
+    The file is rewritten atomically after each span.
+    """
+
+    METRICS = {
+        "calls_total": "Number of calls of the tracked function.",
+        "errors_total": "Number of calls of the tracked function which raised an error.",
+        "duration_seconds_total": "Wall time spent in the tracked function.",
+        "cpu_seconds_total": "CPU time of the process spent in the tracked function.",
+        "rows_total": "Rows of the dataframes returned by the tracked function.",
+    }
+
+    def __init__(self, filename: Path, prefix: str = "eclaireur_tracker"):
+        self.filename = Path(filename)
+        self.filename.parent.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.values = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def emit(self, span: dict) -> None:
+        with self._lock:
+            values = self.values[span["name"]]
+            values["calls_total"] += 1
+            values["errors_total"] += span["status"] == "error"
+            values["duration_seconds_total"] += span["duration"]
+            values["cpu_seconds_total"] += span["cpu_time"]
+            values["rows_total"] += span.get("rows") or 0
+            self._write()
+
+    def _write(self) -> None:
+        lines = []
+        for metric, description in self.METRICS.items():
+            name = f"{self.prefix}_{metric}"
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            lines += [
+                f'{name}{{function="{function}"}} {values[metric]}'
+                for function, values in sorted(self.values.items())
+            ]
+        tmp_filename = self.filename.with_name(self.filename.name + f".{os.getpid()}.tmp")
+        tmp_filename.write_text("\n".join(lines) + "\n")
+        tmp_filename.replace(self.filename)
+
+
+def configure_metrics(config: dict, worker: bool = False) -> None:
+    """
+    Create the sinks of the tracker spans from the "metrics" section of the configuration.
+
+    The worker processes only append their spans to the JSON lines file :
+    the Prometheus file is aggregated and written by the main process only.
+    """
+    _SINKS.clear()
+    metrics_config = config.get("metrics") or {}
+    if metrics_config.get("jsonl_filename"):
+        add_sink(JsonLinesSink(metrics_config["jsonl_filename"]))
+    if metrics_config.get("prometheus_filename") and not worker:
+        add_sink(PrometheusTextfileSink(metrics_config["prometheus_filename"]))
+
+
+def add_sink(sink) -> None:
+    """
+    Register an object with an `emit(span: dict)` method to receive the tracker spans.
+    """
+    _SINKS.append(sink)
+
+
+def clear_sinks() -> None:
+    _SINKS.clear()
+
+
+def emit(span: dict) -> None:
+    for sink in _SINKS:
+        sink.emit(span)
+
+
+def start_span() -> tuple[dict, object]:
+    """
+    Identifiers of a new span, child of the current one, which becomes the current span.
+    Returns the identifiers and the token to give to `end_span`.
+    """
+    parent = _CURRENT_SPAN.get()
+    trace_id = parent[0] if parent else uuid.uuid4().hex
+    span_id = uuid.uuid4().hex[:16]
+    token = _CURRENT_SPAN.set((trace_id, span_id))
+    ids = {"trace_id": trace_id, "span_id": span_id, "parent_id": parent[1] if parent else None}
+    return ids, token
+
+
+def end_span(token) -> None:
+    _CURRENT_SPAN.reset(token)
+
+
+def current_span() -> tuple[str, str] | None:
+    """
+    Context of the current span, to be given to `attach_span` in another thread or process.
+    """
+    return _CURRENT_SPAN.get()
+
+
+def attach_span(span: tuple[str, str] | None) -> None:
+    """
+    Make the spans created in this thread or process children of a span created elsewhere.
+    """
+    _CURRENT_SPAN.set(span)
+
+
+def peak_rss_mb() -> float | None:
+    """
+    Peak resident memory of the process since its start, in MB.
+    None where it is not available (Windows).
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is given in bytes on macOS, in kilobytes on Linux.
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1)
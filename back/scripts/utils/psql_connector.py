@@ -1,14 +1,45 @@
-import hashlib
+import io
 import logging
 import os
+from collections.abc import Iterable
+from pathlib import Path
 
-import numpy as np
 import pandas as pd
+import polars as pl
+import pyarrow.parquet as pq
 from dotenv import load_dotenv
 from sqlalchemy import create_engine, text
 
 load_dotenv()  # Charge les variables d'environnement à partir du fichier .env
 
+POLARS_TO_SQL_TYPES = {
+    pl.Boolean: "BOOLEAN",
+    pl.Int8: "SMALLINT",
+    pl.Int16: "SMALLINT",
+    pl.Int32: "INTEGER",
+    pl.Int64: "BIGINT",
+    pl.UInt8: "SMALLINT",
+    pl.UInt16: "INTEGER",
+    pl.UInt32: "BIGINT",
+    pl.UInt64: "NUMERIC",
+    pl.Float32: "REAL",
+    pl.Float64: "DOUBLE PRECISION",
+    pl.Decimal: "NUMERIC",
+    pl.String: "TEXT",
+    pl.Categorical: "TEXT",
+    pl.Enum: "TEXT",
+    pl.Date: "DATE",
+    pl.Time: "TIME",
+    pl.Duration: "INTERVAL",
+    pl.Struct: "JSONB",
+}
+# Columns added by the Historisateur to the historised tables.
+HISTORY_COLUMNS = {
+    "primary_key_hash": pl.String,
+    "content_hash": pl.String,
+    "deleted_flag": pl.Boolean,
+}
+
 
 class PSQLConnector:
     def __init__(self):
@@ -35,72 +66,194 @@ class PSQLConnector:
             f"postgresql://{self.user}:{self.password}@{self.host}:{self.port}/{self.dbname}"
         )
 
+    def copy_parquet(
+        self,
+        filename: Path,
+        table_name: str,
+        keep_schema: bool = False,
+        batch_size: int = 100_000,
+    ) -> int:
+        """
+        Load a parquet file into a table with COPY FROM STDIN.
+
+        The record batches of the file are streamed into a staging table,
+        which replaces the table at the end of the transaction.
+        The table is never seen empty or partially loaded by the readers.
+
+        Args:
+            filename (Path): Parquet file to load.
+            table_name (str): Table to replace.
+            keep_schema (bool): if True and the table exists, its schema is kept
+                instead of being created from the parquet file.
+            batch_size (int): Number of rows sent per COPY statement.
+
+        Returns:
+            int: The number of rows loaded.
+        """
+        parquet = pq.ParquetFile(filename)
+        schema = pl.from_arrow(parquet.schema_arrow.empty_table()).schema
+        staging_name = f"{table_name}__staging"
+
+        raw_conn = self.engine.raw_connection()
+        try:
+            with raw_conn.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {quote_identifier(staging_name)}")
+                cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table_name,))
+                table_exists = cursor.fetchone()[0]
+                if keep_schema and table_exists:
+                    cursor.execute(
+                        f"CREATE TABLE {quote_identifier(staging_name)} "
+                        f"(LIKE {quote_identifier(table_name)} INCLUDING ALL)"
+                    )
+                else:
+                    cursor.execute(create_table_statement(staging_name, schema))
+
+                n_rows = copy_frames(
+                    cursor,
+                    staging_name,
+                    (pl.from_arrow(b) for b in parquet.iter_batches(batch_size=batch_size)),
+                )
+
+                if table_exists:
+                    cursor.execute(f"DROP TABLE {quote_identifier(table_name)}")
+                cursor.execute(
+                    f"ALTER TABLE {quote_identifier(staging_name)} "
+                    f"RENAME TO {quote_identifier(table_name)}"
+                )
+            raw_conn.commit()
+        except Exception:
+            raw_conn.rollback()
+            raise
+        finally:
+            raw_conn.close()
+
+        self.logger.info(f"{n_rows} rows copied from {filename} into {table_name}.")
+        return n_rows
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def sql_type(dtype: pl.DataType) -> str:
+    """
+    PostgreSQL type of a polars column.
+    Lists are loaded as arrays of the type of their elements.
+    """
+    if isinstance(dtype, pl.List | pl.Array):
+        return sql_type(dtype.inner) + "[]"
+    if isinstance(dtype, pl.Datetime):
+        return "TIMESTAMP WITH TIME ZONE" if dtype.time_zone else "TIMESTAMP"
+    return POLARS_TO_SQL_TYPES.get(dtype.base_type(), "TEXT")
+
+
+def create_table_statement(table_name: str, schema: pl.Schema, temporary: bool = False) -> str:
+    columns = ", ".join(
+        f"{quote_identifier(name)} {sql_type(dtype)}" for name, dtype in schema.items()
+    )
+    if temporary:
+        return (
+            f"CREATE TEMPORARY TABLE {quote_identifier(table_name)} ({columns}) ON COMMIT DROP"
+        )
+    return f"CREATE TABLE {quote_identifier(table_name)} ({columns})"
+
+
+def copy_frames(cursor, table_name: str, frames: Iterable[pl.DataFrame]) -> int:
+    """
+    Send dataframes to a table with COPY FROM STDIN, one COPY statement per dataframe.
+
+    Returns:
+        int: The number of rows copied.
+    """
+    n_rows = 0
+    for frame in frames:
+        columns = ", ".join(quote_identifier(c) for c in frame.columns)
+        buffer = io.BytesIO()
+        to_copy_frame(frame).write_csv(buffer, include_header=False)
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {quote_identifier(table_name)} ({columns}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+        n_rows += frame.height
+    return n_rows
+
+
+def _array_literal(column: pl.Expr, name: str, inner: pl.DataType) -> pl.Expr:
+    """
+    PostgreSQL array literal of a list column : {"a","b",NULL}
+    Structs are written as JSON. Nested lists are not supported : PostgreSQL arrays
+    must be rectangular, which polars lists do not guarantee.
+    """
+    if isinstance(inner, pl.List | pl.Array):
+        raise ValueError(f"Column {name} is a nested list ({inner}), it can not be copied.")
+    if isinstance(inner, pl.Struct):
+        text = pl.element().struct.json_encode()
+    else:
+        text = pl.element().cast(pl.String)
+    element = text.str.replace_all("\\", "\\\\", literal=True).str.replace_all(
+        '"', '\\"', literal=True
+    )
+    quoted = (
+        pl.when(pl.element().is_null())
+        .then(pl.lit("NULL"))
+        .otherwise(pl.concat_str([pl.lit('"'), element, pl.lit('"')]))
+    )
+    return pl.concat_str([pl.lit("{"), column.list.eval(quoted).list.join(","), pl.lit("}")])
+
+
+def to_copy_frame(frame: pl.DataFrame) -> pl.DataFrame:
+    """
+    Convert the columns that can not be written as CSV to their PostgreSQL text representation.
+    """
+    conversions = []
+    for name, dtype in frame.schema.items():
+        if isinstance(dtype, pl.Array):
+            conversions.append(
+                _array_literal(pl.col(name).arr.to_list(), name, dtype.inner).alias(name)
+            )
+        elif isinstance(dtype, pl.List):
+            conversions.append(_array_literal(pl.col(name), name, dtype.inner).alias(name))
+        elif isinstance(dtype, pl.Struct):
+            conversions.append(
+                pl.when(pl.col(name).is_not_null())
+                .then(pl.col(name).struct.json_encode())
+                .alias(name)
+            )
+    return frame.with_columns(conversions)
+
 
 class Historisateur:
     """
     This class is currently dead code but the logic will be used
     for source historisation.
+
+    The rows of a dataframe are upserted in a table identified by a hash of their primary keys.
+    The changes are detected with a hash of the content of the rows and applied in bulk
+    by the database from a staging table, instead of reloading the whole table.
     """
 
+    def __init__(self, engine, replace_tables: bool = False):
+        self.logger = logging.getLogger(__name__)
+        self.engine = engine
+        self.replace_tables = replace_tables
+
     def drop_table_if_exists(self, table_name):
         try:
             with self.engine.connect() as conn:
-                conn.execute(f"DROP TABLE IF EXISTS {table_name}")
+                conn.execute(text(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}"))
+                conn.commit()
                 self.logger.info(f"Table {table_name} dropped successfully.")
         except Exception as e:
             self.logger.error(f"An error occurred while dropping the table: {e}")
 
-    def generate_primary_key_hash(self, row, primary_keys):
-        """Génère un hash à partir des clés primaires"""
-        pk_values = [str(row[pk]) for pk in primary_keys]
-        return hashlib.sha256("".join(pk_values).encode("utf-8")).hexdigest()
-
-    def save_new_table(self, conn, df: pd.DataFrame, table_name: str, primary_keys: list):
-        df["primary_key_hash"] = df.apply(
-            lambda row: self.generate_primary_key_hash(row, primary_keys), axis=1
-        )
-        df["deleted_flag"] = False
-        df.to_sql(table_name, con=conn, if_exists="replace")
-        conn.commit()
-
-    def convert_types_for_sql(
+    def upsert_df_to_sql(
         self,
-        conn,
-        df: pd.DataFrame,
-        existing_df: pd.DataFrame,
+        df: pl.DataFrame | pd.DataFrame,
         table_name: str,
         primary_keys: list,
-    ) -> pd.DataFrame:
-        sql = text(
-            f"SELECT column_name, data_type FROM information_schema.columns WHERE table_name = '{table_name}';"
-        )
-        result = conn.execute(sql)
-        column_mapping = {row[0]: row[1] for row in result.fetchall()}
-        SQL_TO_PYTHON_TYPES = {
-            "integer": "int64",
-            "bigint": "int64",
-            "smallint": "int64",
-            "decimal": "float64",
-            "numeric": "float64",
-            "real": "float32",
-            "double precision": "float64",
-            "boolean": "bool",
-            "char": "string",
-            "varchar": "string",
-            "text": "string",
-            "date": "datetime64[ns]",
-            "timestamp": "datetime64[ns]",
-            "timestamp without time zone": "datetime64[ns]",
-            "timestamp with time zone": "datetime64[ns, UTC]",
-        }
-
-        common_columns = set(existing_df.columns) & set(df.columns) - set(primary_keys)
-        for col in common_columns:
-            df[col] = df[col].astype(SQL_TO_PYTHON_TYPES[column_mapping[col]])
-            existing_df[col] = existing_df[col].astype(SQL_TO_PYTHON_TYPES[column_mapping[col]])
-        return df, existing_df
-
-    def upsert_df_to_sql(self, df, table_name, primary_keys):
+        batch_size: int = 100_000,
+    ):
         """
         Upserts data into the database:
         - Inserts new rows
@@ -110,141 +263,138 @@ class Historisateur:
         :param df: DataFrame to insert/update
         :param table_name: Target table name
         :param primary_keys: List of primary key columns to identify unique rows
-        :param soft_delete: If True, sets a 'deleted_flag' on deleting rows
+        :param batch_size: Number of rows sent per COPY statement to the staging table
         """
-        with self.engine.connect() as conn:
-            if not conn.dialect.has_table(conn, table_name) or self.replace_tables:
-                self.save_new_table(conn, df, table_name, primary_keys)
-
-            else:
-                existing_df = pd.read_sql(f"SELECT * FROM {table_name}", conn)
-                df["primary_key_hash"] = ""
-                self.add_new_columns(conn, table_name, existing_df, df)
-                existing_df = pd.read_sql(f"SELECT * FROM {table_name}", conn)
-
-                df["primary_key_hash"] = df.apply(
-                    lambda row: self.generate_primary_key_hash(row, primary_keys), axis=1
-                )
-
-                primary_keys += ["primary_key_hash"]
-
-                df, existing_df = self.convert_types_for_sql(
-                    conn, df, existing_df, table_name, primary_keys
-                )
-
-                if "deleted_flag" not in df.columns:
-                    df["deleted_flag"] = False
-
-                df = self.clean_df(df)
-                existing_df = self.clean_df(existing_df)
-                merged_df = df.merge(
-                    existing_df,
-                    on=primary_keys,
-                    how="outer",
-                    indicator=True,
-                    suffixes=("", "_existing"),
-                )
-                merged_df = self.clean_df(merged_df)
-
-                self.update_rows(
-                    conn, table_name, merged_df, existing_df.columns, df.columns, primary_keys
+        if isinstance(df, pd.DataFrame):
+            df = pl.from_pandas(df)
+        df = df.drop(HISTORY_COLUMNS, strict=False)
+        if self.replace_tables:
+            self.drop_table_if_exists(table_name)
+
+        staging_name = f"{table_name}__staging"
+        raw_conn = self.engine.raw_connection()
+        try:
+            with raw_conn.cursor() as cursor:
+                cursor.execute(create_table_statement(staging_name, df.schema, temporary=True))
+                copy_frames(cursor, staging_name, df.iter_slices(batch_size))
+                self._hash_staging(cursor, staging_name, df.columns, primary_keys)
+                self._create_or_extend_table(cursor, table_name, df.schema)
+                inserted, updated = self._upsert_from_staging(
+                    cursor, table_name, staging_name, df.columns
                 )
+                deleted = self._soft_delete_missing(cursor, table_name, staging_name)
+            raw_conn.commit()
+        except Exception:
+            raw_conn.rollback()
+            raise
+        finally:
+            raw_conn.close()
+
+        self.logger.info(
+            f"{table_name} : {inserted} new rows, {updated} rows updated, "
+            f"{deleted} rows soft deleted."
+        )
 
-                self.new_rows(conn, table_name, merged_df, df.columns)
-
-                self.soft_delete_rows(conn, table_name, merged_df, df.columns)
-
-    def clean_df(self, df):
-        df.replace({np.nan: None}, inplace=True)
-        return df
-
-    def update_rows(
-        self,
-        conn,
-        table_name: str,
-        merged_df: pd.DataFrame,
-        existing_df_columns: list,
-        df_columns: list,
-        primary_keys: list,
-    ):
-        common_columns = set(existing_df_columns) & set(df_columns) - set(primary_keys)
-
-        # get modified rows
-        df_common_columns = [col for col in common_columns if col in df_columns]
-        df_existing_common_columns = [
-            col + "_existing" for col in common_columns if col in existing_df_columns
-        ]
-        diff_mask = (
-            merged_df[df_common_columns] != merged_df[df_existing_common_columns].values
-        ).any(axis=1)
-
-        # keep rows to update
-        updated_rows = merged_df[diff_mask]
-
-        # keep updated rows columns
-        updated_rows = updated_rows[df_columns]
-
-        # Updated rows: Present in both but with changed values
-        updated_cols = [col for col in df_columns if col not in primary_keys]
-        [f"{col}_existing" for col in updated_cols]
-
-        if not updated_rows.empty:
-            for _, row in updated_rows.iterrows():
-                set_clause = ", ".join(
-                    [f""""{col}" = :{col}""" for col in df_columns if col not in primary_keys]
+    def _create_or_extend_table(self, cursor, table_name: str, schema: pl.Schema):
+        """
+        Create the table with the history columns,
+        or add the columns of the dataframe missing from the existing table.
+        """
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table_name,))
+        if not cursor.fetchone()[0]:
+            cursor.execute(create_table_statement(table_name, schema | HISTORY_COLUMNS))
+        else:
+            cursor.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_name = %s",
+                (table_name,),
+            )
+            existing_columns = {row[0] for row in cursor.fetchall()}
+            new_columns = [
+                f"{quote_identifier(name)} {sql_type(dtype)}"
+                for name, dtype in (schema | HISTORY_COLUMNS).items()
+                if name not in existing_columns
+            ]
+            for column in new_columns:
+                cursor.execute(
+                    f"ALTER TABLE {quote_identifier(table_name)} ADD COLUMN {column}"
                 )
-                where_clause = "primary_key_hash = :primary_key_hash"
+            self.logger.info(f"Added {len(new_columns)} new columns to {table_name}.")
 
-                sql = text(f"""
-                    UPDATE {table_name}
-                    SET {set_clause}
-                    WHERE {where_clause}
-                """)
-
-                conn.execute(sql, row.to_dict())
-            conn.commit()
+        # ON CONFLICT needs a unique index on the primary key hash.
+        cursor.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {quote_identifier(table_name + '__primary_key_hash')}"
+            f" ON {quote_identifier(table_name)} (primary_key_hash)"
+        )
 
-            self.logger.info(f"{len(updated_rows)} rows updated in {table_name}.")
+    def _hash_staging(self, cursor, staging_name: str, columns: list, primary_keys: list):
+        """
+        Replace the staging table by its rows with their primary key and content hashes,
+        computed by the database.
+        """
+        staging = quote_identifier(staging_name)
+        hashed = quote_identifier(staging_name + "__hashed")
+        cursor.execute(f"""
+            CREATE TEMPORARY TABLE {hashed} ON COMMIT DROP AS
+            SELECT *, {_hash_expression(primary_keys)} AS primary_key_hash,
+                {_hash_expression(columns)} AS content_hash, false AS deleted_flag
+            FROM {staging}
+        """)
+        cursor.execute(f"DROP TABLE {staging}")
+        cursor.execute(f"ALTER TABLE {hashed} RENAME TO {staging}")
+
+    def _upsert_from_staging(
+        self, cursor, table_name: str, staging_name: str, columns: list
+    ) -> tuple[int, int]:
+        """
+        Insert the new rows and update the rows whose content changed, in one statement.
 
-    def add_new_columns(
-        self, conn, table_name: str, existing_df: pd.DataFrame, df: pd.DataFrame
-    ):
-        new_columns = set(df.columns) - set(existing_df.columns)
-
-        type_mapping = {
-            "int64": "INTEGER",
-            "float64": "FLOAT",
-            "bool": "BOOLEAN",
-            "datetime64[ns]": "TIMESTAMP",
-            "object": "TEXT",
-        }
-
-        for col in new_columns:
-            col_type = type_mapping.get(str(df[col].dtype), "TEXT")
-            sql = text(f"ALTER TABLE {table_name} ADD COLUMN {col} {col_type};")
-            conn.execute(sql)
-            conn.commit()
-
-        self.logger.info(f"Added {len(new_columns)} new columns to {table_name}.")
-
-    def new_rows(self, conn, table_name: str, merged_df: pd.DataFrame, df_columns: list):
-        new_rows = merged_df[merged_df["_merge"] == "left_only"].drop(columns=["_merge"])
-        new_rows = new_rows[df_columns]
-
-        if not new_rows.empty:
-            new_rows.to_sql(table_name, conn, if_exists="append", index=False)
-            self.logger.info(f"{len(new_rows)} new rows inserted into {table_name}.")
-
-    def soft_delete_rows(
-        self, conn, table_name: str, merged_df: pd.DataFrame, primary_keys: list
-    ):
-        soft_delete_rows = merged_df[merged_df["_merge"] == "right_only"][primary_keys]
-        if not soft_delete_rows.empty:
-            where_clause = "primary_key_hash = :primary_key_hash"
-            sql = text(f"""
-                UPDATE {table_name}
-                SET deleted_flag = true
-                WHERE {where_clause}
-            """)
-            conn.execute(sql, soft_delete_rows.to_dict(orient="records"))
-            self.logger.info(f"{len(soft_delete_rows)} rows soft deleted in {table_name}.")
+        Returns:
+            tuple[int, int]: The number of inserted and updated rows.
+        """
+        table = quote_identifier(table_name)
+        staging = quote_identifier(staging_name)
+        quoted = [quote_identifier(c) for c in [*columns, *HISTORY_COLUMNS]]
+        updates = ", ".join(f"{c} = EXCLUDED.{c}" for c in quoted if c != '"primary_key_hash"')
+        cursor.execute(f"SELECT count(*) - count(DISTINCT primary_key_hash) FROM {staging}")
+        (duplicates,) = cursor.fetchone()
+        if duplicates:
+            self.logger.warning(
+                f"{duplicates} rows of {table_name} share their primary key with another row,"
+                " only the one with the greatest content hash is kept."
+            )
+        # The order makes the row kept among duplicates independent of the staging order.
+        cursor.execute(f"""
+            WITH upserted AS (
+                INSERT INTO {table} ({", ".join(quoted)})
+                SELECT DISTINCT ON (primary_key_hash) {", ".join(quoted)}
+                FROM {staging}
+                ORDER BY primary_key_hash, content_hash DESC
+                ON CONFLICT (primary_key_hash) DO UPDATE SET {updates}
+                WHERE {table}.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+                    OR {table}.deleted_flag
+                RETURNING xmax = 0 AS inserted
+            )
+            SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+            FROM upserted
+        """)
+        return cursor.fetchone()
+
+    def _soft_delete_missing(self, cursor, table_name: str, staging_name: str) -> int:
+        table = quote_identifier(table_name)
+        cursor.execute(f"""
+            UPDATE {table} SET deleted_flag = true
+            WHERE NOT {table}.deleted_flag AND NOT EXISTS (
+                SELECT FROM {quote_identifier(staging_name)} AS staging
+                WHERE staging.primary_key_hash = {table}.primary_key_hash
+            )
+        """)
+        return cursor.rowcount
+
+
+def _hash_expression(columns: list) -> str:
+    """
+    SQL expression hashing the values of columns, encoded as a JSON array so that
+    NULL differs from an empty string and no separator can make two rows collide.
+    """
+    values = ", ".join(quote_identifier(c) for c in columns)
+    return f"encode(sha256(convert_to(jsonb_build_array({values})::text, 'UTF8')), 'hex')"
@@ -50,6 +50,17 @@ class DataWarehouseWorkflow:
         # or keep the same schema.
         if_table_exists = "replace" if self.config["workflow"]["replace_tables"] else "append"
 
+        if self.config["workflow"].get("bulk_load", False):
+            batch_size = self.config["workflow"].get("copy_batch_size", 100_000)
+            for table_name, filename in self.send_to_db.items():
+                connector.copy_parquet(
+                    filename,
+                    table_name,
+                    keep_schema=if_table_exists == "append",
+                    batch_size=batch_size,
+                )
+            return
+
         with connector.engine.connect() as conn:
             for table_name, filename in self.send_to_db.items():
                 df = pl.read_parquet(filename)
@@ -1,5 +1,4 @@
 import logging
-from copy import deepcopy
 from datetime import datetime
 from pathlib import Path
 
@@ -28,6 +27,7 @@ from back.scripts.utils.dataframe_operation import (
     sort_by_format_priorities,
 )
 from back.scripts.utils.datagouv_api import select_implemented_formats
+from back.scripts.workflow.workflow_scheduler import WorkflowScheduler
 
 
 class WorkflowManager:
@@ -37,7 +37,9 @@ class WorkflowManager:
     This final output may be a composite of multiple input files.
 
     A concept workflow may be dependent on another one.
-    This dependency is only visible within the worflow by using the output file name method from the classes the worflow depends on.
+    This dependency is visible within the worflow by using the output file name method from the classes the worflow depends on,
+    and is declared by each workflow in `get_dependencies`.
+    Independent workflows can be run concurrently with the `--max-workers` option.
     """
 
     def __init__(self, args, config):
@@ -66,14 +68,8 @@ class WorkflowManager:
     def run_workflow(self) -> None:
         self.logger.info("Workflow started.")
 
-        for workflow in self.get_workflows():
-            try:
-                workflow(deepcopy(self.config)).run()
-            except Exception as e:
-                self.logger.error(
-                    f"An error occurred while running the workflow {workflow.__name__}: {e}"
-                )
-                continue
+        max_workers = getattr(self.args, "max_workers", 1)
+        WorkflowScheduler(self.get_workflows(), self.config, max_workers=max_workers).run()
 
         self.process_subvention("subventions", self.config["search"]["subventions"])
 
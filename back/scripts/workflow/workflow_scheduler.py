@@ -0,0 +1,122 @@
+import logging
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from copy import deepcopy
+from graphlib import TopologicalSorter
+from typing import Any, Callable
+
+from back.scripts.utils.config import project_config
+from back.scripts.utils.http_client import configure_http_client
+from back.scripts.utils.logger_manager import LoggerManager
+from back.scripts.utils.metrics import configure_metrics
+
+LOGGER = logging.getLogger(__name__)
+
+
+def init_worker(config: dict | None) -> None:
+    """
+    Make the project configuration, the logging, the metrics and the HTTP client options available
+    in a spawned worker process.
+    """
+    if config is None:
+        return
+    if project_config.dump() is None:
+        project_config.load(config)
+    if "logging" in config:
+        LoggerManager.configure_logger(config)
+    configure_metrics(config, worker=True)
+    configure_http_client(config)
+
+
+def _run_workflow(workflow: Callable[[dict], Any], config: dict) -> None:
+    workflow(deepcopy(config)).run()
+
+
+class WorkflowScheduler:
+    """
+    Run a list of dataset workflows according to their dependencies.
+
+    Each workflow is either a dataset class or one of its classmethod constructors
+    (e.g. `OfglLoader.from_config`). Dependencies are declared by each dataset through
+    `get_dependencies` and only the ones present in the list are taken into account.
+
+    Workflows whose dependencies are completed are run concurrently in a pool of spawned
+    processes, as polars can not be used in a forked process once used in its parent.
+    With `max_workers=1`, workflows are run sequentially in the current process.
+    A failing workflow does not stop the others : as in a sequential run, its dependents are
+    still executed and may rely on a previously generated output.
+    """
+
+    def __init__(self, workflows: list, config: dict, max_workers: int = 1):
+        self.config = config
+        self.max_workers = max_workers
+        self.workflows = {self.workflow_class(workflow): workflow for workflow in workflows}
+        self.graph = self._build_graph()
+        self.failed = []
+
+    @staticmethod
+    def workflow_class(workflow: Callable[[dict], Any]) -> type:
+        """
+        Dataset class of a workflow, whether it is given as a class or a classmethod.
+        """
+        return getattr(workflow, "__self__", workflow)
+
+    def _build_graph(self) -> dict[type, set[type]]:
+        return {
+            cls: {dep for dep in cls.get_dependencies() if dep in self.workflows}
+            for cls in self.workflows
+        }
+
+    def _priority(self, cls: type) -> int:
+        """
+        Position in the original list, used to keep a stable order between ready workflows.
+        """
+        return list(self.workflows).index(cls)
+
+    def run(self) -> None:
+        sorter = TopologicalSorter(self.graph)
+        sorter.prepare()
+        if self.max_workers <= 1:
+            self._run_sequential(sorter)
+        else:
+            self._run_parallel(sorter)
+
+    def _run_sequential(self, sorter: TopologicalSorter) -> None:
+        while sorter.is_active():
+            for cls in sorted(sorter.get_ready(), key=self._priority):
+                try:
+                    _run_workflow(self.workflows[cls], self.config)
+                except Exception as e:
+                    self._log_failure(cls, e)
+                sorter.done(cls)
+
+    def _run_parallel(self, sorter: TopologicalSorter) -> None:
+        with ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker,
+            initargs=(self.config,),
+        ) as pool:
+            running: dict[Future, type] = {}
+            while sorter.is_active():
+                for cls in sorted(sorter.get_ready(), key=self._priority):
+                    LOGGER.info(f"Submitting workflow {cls.__name__}")
+                    future = pool.submit(_run_workflow, self.workflows[cls], self.config)
+                    running[future] = cls
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    cls = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        self._log_failure(cls, error)
+                    sorter.done(cls)
+
+    def _log_failure(self, cls: type, error: BaseException) -> None:
+        self.failed.append(cls)
+        LOGGER.error(f"An error occurred while running the workflow {cls.__name__}: {error}")
+        dependents = [c.__name__ for c, deps in self.graph.items() if cls in deps]
+        if dependents:
+            LOGGER.warning(
+                f"Workflows depending on {cls.__name__} may fail : {', '.join(dependents)}"
+            )
@@ -0,0 +1,35 @@
+import tempfile
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from back.scripts.datasets.communities_contacts import CommunitiesContact
+
+ARCHIVE = (
+    Path(__file__).parents[3] / "back" / "tests" / "inputs" / "communities_contact.tar.bz2"
+)
+
+
+@pytest.mark.parametrize("decompressor", [None, "bzip2", "not-installed-bzip2"])
+def test_run(decompressor):
+    folder = Path(tempfile.mkdtemp())
+    config = {
+        "communities_contacts": {
+            "data_folder": str(folder),
+            "combined_filename": str(folder / "communities_contacts.parquet"),
+            "url": ARCHIVE.as_uri(),
+            "decompressor": decompressor,
+        }
+    }
+    CommunitiesContact(config).run()
+    out = pl.read_parquet(folder / "communities_contacts.parquet")
+
+    assert not (folder / "extracted").exists()
+    assert out.columns == ["nom", "siren", "type", "code_insee", "contact", "type_contact"]
+    assert out.height == 7
+    row = out.filter(pl.col("code_insee") == "77188").row(0, named=True)
+    # The siren is taken from the siret when it is missing.
+    assert row["siren"] == "217701887"
+    assert (row["type"], row["type_contact"]) == ("COM", "MAIL")
+    assert set(out["type_contact"]) == {"MAIL", "WEB"}
@@ -0,0 +1,303 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+import polars as pl
+import responses
+
+from back.scripts.datasets.dataset_aggregator import DatasetAggregator
+from back.scripts.utils import metrics
+from back.scripts.utils.decorators import tracker
+
+
+class CsvAggregator(DatasetAggregator):
+    @classmethod
+    def get_config_key(cls) -> str:
+        return "csv_aggregator"
+
+    def _normalize_frame(self, df: pd.DataFrame, file_metadata) -> pd.DataFrame:
+        return df.assign(url=file_metadata.url)
+
+
+class PolarsCsvAggregator(CsvAggregator):
+    def _read_parse_file(self, file_metadata, raw_filename: Path) -> pl.LazyFrame:
+        return pl.scan_csv(raw_filename).with_columns(url=pl.lit(file_metadata.url))
+
+
+class BrokenCsvAggregator(CsvAggregator):
+    broken = True
+
+    def _normalize_frame(self, df: pd.DataFrame, file_metadata) -> pd.DataFrame:
+        if self.broken and "broken" in file_metadata.url:
+            raise ValueError("Broken file")
+        return super()._normalize_frame(df, file_metadata)
+
+
+class TestDatasetAggregator:
+    def setup_method(self):
+        self.path = tempfile.TemporaryDirectory()
+        self.config = {
+            "csv_aggregator": {
+                "data_folder": self.path.name,
+                "combined_filename": os.path.join(self.path.name, "final.parquet"),
+                "download_workers": 4,
+            }
+        }
+
+    def teardown_method(self):
+        self.path.cleanup()
+
+    @responses.activate
+    def test_concurrent_downloads(self):
+        urls = [f"https://example.com/file_{i}.csv" for i in range(10)]
+        for i, url in enumerate(urls):
+            responses.add(responses.GET, url, body=f"montant,nom\n{i},nom_{i}\n", status=200)
+        responses.add(responses.GET, "https://example.com/missing.csv", status=404)
+
+        files = pd.DataFrame(
+            {"url": urls + ["https://example.com/missing.csv"], "format": "csv"}
+        )
+        aggregator = CsvAggregator(files, self.config)
+        aggregator.run()
+
+        out = pd.read_parquet(self.config["csv_aggregator"]["combined_filename"])
+        assert sorted(out["url"]) == sorted(urls)
+        assert sorted(out["montant"].astype(int)) == list(range(10))
+
+        with open(Path(self.path.name) / "errors.json") as f:
+            errors = json.load(f)
+        assert errors == {"HTTP error 404": ["https://example.com/missing.csv"]}
+        # Failed downloads must not leave a raw file behind
+        missing_hash = aggregator.files_in_scope["url_hash"].iloc[-1]
+        assert not (Path(self.path.name) / missing_hash / "raw.csv").exists()
+
+    @responses.activate
+    def test_download_spans(self):
+        urls = [f"https://example.com/file_{i}.csv" for i in range(3)]
+        for i, url in enumerate(urls):
+            responses.add(responses.GET, url, body=f"montant,nom\n{i},nom_{i}\n", status=200)
+        aggregator = CsvAggregator(pd.DataFrame({"url": urls, "format": "csv"}), self.config)
+        aggregator._download_file = tracker(aggregator._download_file)
+
+        spans = []
+        metrics.add_sink(type("ListSink", (), {"emit": staticmethod(spans.append)})())
+        try:
+            aggregator.run()
+        finally:
+            metrics.clear_sinks()
+
+        by_name = {}
+        for span in spans:
+            by_name.setdefault(span["name"].rsplit(".", 1)[-1], []).append(span)
+        (process_files,) = by_name["_process_files"]
+        assert len(by_name["_download_file"]) == 3
+        assert all(
+            span["parent_id"] == process_files["span_id"] for span in by_name["_download_file"]
+        )
+
+    @responses.activate
+    def test_download_thread_failure_is_recorded(self):
+        urls = [f"https://example.com/file_{i}.csv" for i in range(2)]
+        for i, url in enumerate(urls):
+            responses.add(responses.GET, url, body=f"montant,nom\n{i},nom_{i}\n", status=200)
+        files = pd.DataFrame({"url": urls, "format": "csv"})
+        aggregator = CsvAggregator(files, self.config)
+        failing = aggregator.files_in_scope["url_hash"].iloc[0]
+        invalidate = aggregator._invalidate_normalized_file
+
+        def _invalidate(file_metadata):
+            if file_metadata.url_hash == failing:
+                raise OSError("Disk full")
+            invalidate(file_metadata)
+
+        aggregator._invalidate_normalized_file = _invalidate
+        aggregator.run()
+
+        out = pd.read_parquet(self.config["csv_aggregator"]["combined_filename"])
+        assert urls[1] in out["url"].tolist()
+        assert aggregator.errors == {"Disk full": [urls[0]]}
+
+    @responses.activate
+    def test_refresh_with_conditional_requests(self):
+        url = "https://example.com/file.csv"
+        responses.add(
+            responses.GET,
+            url,
+            body="montant,nom\n1,nom_1\n",
+            status=200,
+            headers={"ETag": '"v1"'},
+        )
+        files = pd.DataFrame({"url": [url], "format": "csv"})
+        CsvAggregator(files, self.config).run()
+        assert len(responses.calls) == 1
+
+        self.config["csv_aggregator"]["refresh_downloads"] = True
+        responses.replace(
+            responses.GET,
+            url,
+            status=304,
+            match=[responses.matchers.header_matcher({"If-None-Match": '"v1"'})],
+        )
+        aggregator = CsvAggregator(files, self.config)
+        norm_filename = aggregator._dataset_filename(
+            next(aggregator.files_in_scope.itertuples()), "norm"
+        )
+        norm_mtime = norm_filename.stat().st_mtime_ns
+        aggregator.run()
+        assert len(responses.calls) == 2
+        assert norm_filename.stat().st_mtime_ns == norm_mtime
+
+        responses.replace(
+            responses.GET,
+            url,
+            body="montant,nom\n2,nom_2\n",
+            status=200,
+            headers={"ETag": '"v2"'},
+        )
+        CsvAggregator(files, self.config).run()
+        out = pd.read_parquet(self.config["csv_aggregator"]["combined_filename"])
+        assert out["montant"].astype(int).tolist() == [2]
+
+    @responses.activate
+    def test_refresh_skipped_when_catalog_checksum_unchanged(self):
+        url = "https://example.com/file.csv"
+        responses.add(responses.GET, url, body="montant,nom\n1,nom_1\n", status=200)
+        files = pd.DataFrame(
+            {"url": [url], "format": "csv", "extras_analysis:checksum": ["abc"]}
+        )
+        CsvAggregator(files, self.config).run()
+        self.config["csv_aggregator"]["refresh_downloads"] = True
+        CsvAggregator(files, self.config).run()
+        assert len(responses.calls) == 1
+
+        files["extras_analysis:checksum"] = "def"
+        CsvAggregator(files, self.config).run()
+        assert len(responses.calls) == 2
+
+    @responses.activate
+    def test_download_failures_skipped_until_refresh_or_catalog_change(self, monkeypatch):
+        names = ("file", "missing", "no_checksum", "broken")
+        urls = [f"https://example.com/{name}.csv" for name in names]
+        responses.add(responses.GET, urls[0], body="montant,nom\n1,nom_1\n", status=200)
+        responses.add(responses.GET, urls[1], status=404)
+        responses.add(responses.GET, urls[2], status=404)
+        responses.add(responses.GET, urls[3], body="montant,nom\n2,nom_2\n", status=200)
+        files = pd.DataFrame(
+            {"url": urls, "format": "csv", "extras_analysis:checksum": ["a", "b", None, "d"]}
+        )
+        aggregator = BrokenCsvAggregator(files, self.config)
+        aggregator.run()
+        assert len(responses.calls) == 4
+        with open(Path(self.path.name) / "errors.json") as f:
+            errors = json.load(f)
+        broken_hash = aggregator.files_in_scope["url_hash"].iloc[3]
+        assert errors == {"HTTP error 404": urls[1:3], "Broken file": [broken_hash]}
+
+        # Only the failed download whose checksum is known is skipped,
+        # the failed normalization is made again.
+        monkeypatch.setattr(BrokenCsvAggregator, "broken", False)
+        BrokenCsvAggregator(files, self.config).run()
+        assert [c.request.url for c in responses.calls[4:]] == [urls[2]]
+        with open(Path(self.path.name) / "errors.json") as f:
+            assert json.load(f) == {"HTTP error 404": urls[1:3]}
+        out = pd.read_parquet(self.config["csv_aggregator"]["combined_filename"])
+        assert sorted(out["url"]) == [urls[3], urls[0]]
+
+        files["extras_analysis:checksum"] = ["a", "new", None, "d"]
+        BrokenCsvAggregator(files, self.config).run()
+        assert [c.request.url for c in responses.calls[5:]] == urls[1:3]
+
+        self.config["csv_aggregator"]["refresh_downloads"] = True
+        BrokenCsvAggregator(files, self.config).run()
+        assert [c.request.url for c in responses.calls[7:]] == urls[1:3]
+
+    @responses.activate
+    def test_encoding_cached(self):
+        url = "https://example.com/file.csv"
+        responses.add(
+            responses.GET, url, body="montant,nom\n1,Jérôme\n".encode("latin1"), status=200
+        )
+        files = pd.DataFrame({"url": [url], "format": "csv"})
+        aggregator = CsvAggregator(files, self.config)
+        aggregator.run()
+        url_hash = aggregator.files_in_scope["url_hash"].iloc[0]
+        assert aggregator.download_cache.get(url_hash)["encoding"] == "windows-1252"
+
+        out = pd.read_parquet(self.config["csv_aggregator"]["combined_filename"])
+        assert out["nom"].tolist() == ["Jérôme"]
+
+    @responses.activate
+    def test_concatenation_skipped_when_manifest_unchanged(self):
+        url = "https://example.com/file.csv"
+        responses.add(responses.GET, url, body="montant,nom\n1,nom_1\n", status=200)
+        files = pd.DataFrame({"url": [url], "format": "csv"})
+        CsvAggregator(files, self.config).run()
+        output = Path(self.config["csv_aggregator"]["combined_filename"])
+        output_mtime = output.stat().st_mtime_ns
+        assert (Path(self.path.name) / "manifest.json").exists()
+
+        self.config["csv_aggregator"]["refresh_downloads"] = True
+        responses.replace(responses.GET, url, status=304)
+        CsvAggregator(files, self.config).run()
+        assert output.stat().st_mtime_ns == output_mtime
+
+    @responses.activate
+    def test_sources_added_and_removed_without_refresh(self):
+        urls = [f"https://example.com/file_{i}.csv" for i in range(3)]
+        for i, url in enumerate(urls):
+            responses.add(responses.GET, url, body=f"montant,nom\n{i},nom_{i}\n", status=200)
+        output = self.config["csv_aggregator"]["combined_filename"]
+        CsvAggregator(pd.DataFrame({"url": urls[:2], "format": "csv"}), self.config).run()
+
+        CsvAggregator(pd.DataFrame({"url": urls, "format": "csv"}), self.config).run()
+        assert len(responses.calls) == 3
+        assert sorted(pd.read_parquet(output)["montant"].astype(int)) == [0, 1, 2]
+
+        CsvAggregator(pd.DataFrame({"url": urls[1:], "format": "csv"}), self.config).run()
+        assert len(responses.calls) == 3
+        assert sorted(pd.read_parquet(output)["montant"].astype(int)) == [1, 2]
+
+    @responses.activate
+    def test_partitioned_output_only_rewrites_changed_files(self):
+        self.config["csv_aggregator"]["partitioned_output"] = True
+        urls = [f"https://example.com/file_{i}.csv" for i in range(3)]
+        for i, url in enumerate(urls):
+            responses.add(responses.GET, url, body=f"montant,nom\n{i},nom_{i}\n", status=200)
+        files = pd.DataFrame({"url": urls, "format": "csv"})
+        aggregator = CsvAggregator(files, self.config)
+        aggregator.run()
+
+        output = Path(self.config["csv_aggregator"]["combined_filename"])
+        assert output.is_dir()
+        partitions = {f.stem: f.stat().st_mtime_ns for f in output.glob("*.parquet")}
+        assert sorted(partitions) == sorted(aggregator.files_in_scope["url_hash"])
+
+        self.config["csv_aggregator"]["refresh_downloads"] = True
+        responses.replace(responses.GET, urls[1], body="montant,nom\n10,nom_10\n", status=200)
+        for url in (urls[0], urls[2]):
+            responses.replace(responses.GET, url, status=304)
+        CsvAggregator(files, self.config).run()
+
+        changed = aggregator.files_in_scope["url_hash"].iloc[1]
+        for url_hash, mtime in partitions.items():
+            new_mtime = (output / f"{url_hash}.parquet").stat().st_mtime_ns
+            assert (new_mtime != mtime) == (url_hash == changed)
+        out = pd.read_parquet(output)
+        assert sorted(out["montant"].astype(int)) == [0, 2, 10]
+
+    @responses.activate
+    def test_parallel_normalization_after_polars_in_parent(self):
+        # Polars thread pool is started in the parent before the workers are created
+        pl.DataFrame({"a": range(100_000)}).sort("a").group_by("a").len()
+        self.config["csv_aggregator"]["normalization_workers"] = 2
+        urls = [f"https://example.com/file_{i}.csv" for i in range(4)]
+        for i, url in enumerate(urls):
+            responses.add(responses.GET, url, body=f"montant,nom\n{i},nom_{i}\n", status=200)
+        files = pd.DataFrame({"url": urls, "format": "csv"})
+        PolarsCsvAggregator(files, self.config).run()
+
+        out = pd.read_parquet(self.config["csv_aggregator"]["combined_filename"])
+        assert sorted(out["url"]) == sorted(urls)
+        assert sorted(out["montant"]) == [0, 1, 2, 3]
@@ -3,6 +3,8 @@ import tempfile
 from pathlib import Path
 
 import pandas as pd
+import pyarrow.parquet as pq
+import pytest
 from bs4 import BeautifulSoup
 
 from back.scripts.datasets.declaration_interet import DeclaInteretWorkflow
@@ -78,3 +80,64 @@ class TestParseMandat:
             "description_mandat": "Maire",
         }
         assert out[0] == exp
+
+
+class TestFormatToParquet:
+    def setup_method(self):
+        self.folder = Path(tempfile.mkdtemp())
+        declaration = (FIXTURES_DIRECTORY / "declaration.xml").read_text(encoding="utf-8")
+        (self.folder / "declarations.xml").write_text(
+            f'<?xml version="1.0" encoding="UTF-8"?>\n<declarations>{declaration * 3}</declarations>',
+            encoding="utf-8",
+        )
+
+    def _format(self, xml_parser: str, parsing_workers: int = 1) -> Path:
+        output_filename = self.folder / f"{xml_parser}_{parsing_workers}.parquet"
+        config = {
+            "declarations_interet": {
+                "data_folder": str(self.folder),
+                "combined_filename": str(output_filename),
+                "xml_parser": xml_parser,
+                "batch_size": 2,
+                "parsing_workers": parsing_workers,
+            }
+        }
+        DeclaInteretWorkflow(config)._format_to_parquet()
+        return output_filename
+
+    def test_streaming_parser(self):
+        streaming = self._format("streaming")
+        soup = self._format("soup")
+        out = pd.read_parquet(streaming)
+        pd.testing.assert_frame_equal(out, pd.read_parquet(soup))
+        assert pq.read_schema(streaming).equals(pq.read_schema(soup).remove_metadata())
+
+        exp = pd.read_csv(FIXTURES_DIRECTORY / "complete_decla.csv")
+        assert len(out) == 3 * len(exp)
+        assert list(out.columns) == list(exp.columns)
+        assert out["montant"].tolist() == exp["montant"].tolist() * 3
+
+    def test_declaration_chunks(self):
+        filename = self.folder / "declarations.xml"
+        content = filename.read_bytes()
+        chunks = DeclaInteretWorkflow._declaration_chunks(filename, 10)
+
+        assert len(chunks) == 3
+        assert all(content[start:end].startswith(b"<declaration>") for start, end in chunks)
+        assert all(
+            content[start:end].rstrip().endswith(b"</declaration>") for start, end in chunks
+        )
+        assert [start for start, _ in chunks[1:]] == [end for _, end in chunks[:-1]]
+        assert len(DeclaInteretWorkflow._declaration_chunks(filename, 2)) == 2
+
+    def test_parallel_parser(self):
+        out = pd.read_parquet(self._format("streaming", parsing_workers=2))
+        exp = pd.read_parquet(self._format("soup"))
+        pd.testing.assert_frame_equal(out, exp)
+
+    def test_unknown_columns(self, monkeypatch):
+        monkeypatch.setattr(
+            DeclaInteretWorkflow, "_parse_declaration", staticmethod(lambda d: [{"unknown": 1}])
+        )
+        with pytest.raises(ValueError, match="unknown"):
+            self._format("streaming")
@@ -1,10 +1,16 @@
-import os
+import json
+import shutil
+import tempfile
+from copy import deepcopy
 from pathlib import Path
 
+import ijson
 import pandas as pd
 import pandas.testing as pdtesting
+import polars as pl
+import pytest
 
-from back.scripts.datasets.marches import MarchesPublicsWorkflow
+from back.scripts.datasets.marches import MarchesPublicsWorkflow, ijson_backend
 from back.scripts.utils.config_manager import ConfigManager
 
 FIXTURES_DIRECTORY = Path(__file__).parent / "fixtures"
@@ -31,8 +37,12 @@ def test_marches_public_dataframes():
     mp = MarchesPublicsWorkflow.from_config(config)
 
     # Direct marche test
-    direct_df = mp._read_parse_file(
-        file_metadata=None, raw_filename=FIXTURES_DIRECTORY / "marche_direct.json"
+    direct_df = (
+        mp._read_parse_file(
+            file_metadata=None, raw_filename=FIXTURES_DIRECTORY / "marche_direct.json"
+        )
+        .collect()
+        .to_pandas()
     )
     assert direct_df.shape == (3, 6)
     assert "acheteur_id" in direct_df.columns
@@ -40,17 +50,21 @@ def test_marches_public_dataframes():
     assert "titulaire_id" in direct_df.columns
     assert "id_3" in direct_df["titulaire_id"].tolist()
     pdtesting.assert_series_equal(
-        direct_df["montant"], pd.Series([500, 40, 40], name="montant")
+        direct_df["montant"], pd.Series([500.0, 40.0, 40.0], name="montant")
     )
     pdtesting.assert_series_equal(
         direct_df["countTitulaires"], pd.Series([1, 2, 2], name="countTitulaires")
     )
-    # Remove the interim.json file created by mp workflow
-    os.remove(FIXTURES_DIRECTORY / "interim.json")
+    # Remove the interim files created by mp workflow
+    shutil.rmtree(FIXTURES_DIRECTORY / "interim")
 
     # Nested marche test
-    nested_df = mp._read_parse_file(
-        file_metadata=None, raw_filename=FIXTURES_DIRECTORY / "marche_nested.json"
+    nested_df = (
+        mp._read_parse_file(
+            file_metadata=None, raw_filename=FIXTURES_DIRECTORY / "marche_nested.json"
+        )
+        .collect()
+        .to_pandas()
     )
     assert nested_df.shape == (3, 6)
     assert "acheteur_id" in nested_df.columns
@@ -58,10 +72,115 @@ def test_marches_public_dataframes():
     assert "titulaire_id" in nested_df.columns
     assert "id_3" in nested_df["titulaire_id"].tolist()
     pdtesting.assert_series_equal(
-        nested_df["montant"], pd.Series([200, 20, 20], name="montant")
+        nested_df["montant"], pd.Series([200.0, 20.0, 20.0], name="montant")
     )
     pdtesting.assert_series_equal(
         nested_df["countTitulaires"], pd.Series([1, 2, 2], name="countTitulaires")
     )
-    # Remove the interim.json file created by mp workflow
-    os.remove(FIXTURES_DIRECTORY / "interim.json")
+    # Remove the interim files created by mp workflow
+    shutil.rmtree(FIXTURES_DIRECTORY / "interim")
+
+
+class TestMarchesPublicsInterim:
+    def setup_method(self):
+        self.path = tempfile.TemporaryDirectory()
+        self.folder = Path(self.path.name)
+        self.config = deepcopy(config)
+        self.config["marches_publics"] |= {
+            "data_folder": self.path.name,
+            "combined_filename": str(self.folder / "marches_publics.parquet"),
+            "interim_batch_size": 2,
+        }
+        # Avoid downloading the official schema
+        pd.DataFrame(
+            {
+                "property": [
+                    "id",
+                    "acheteur.id",
+                    "montant",
+                    "dureeMois",
+                    "titulaires.id",
+                    "titulaires.typeIdentifiant",
+                    "lieuExecution.code",
+                ],
+                "type": ["string", "string", "number", "integer", "string", "string", "string"],
+            }
+        ).to_parquet(self.folder / "official_schema.parquet")
+        self.raw_filename = self.folder / "raw.json"
+
+    def teardown_method(self):
+        self.path.cleanup()
+
+    def test_interim_batches(self):
+        shutil.copy(FIXTURES_DIRECTORY / "marche_direct.json", self.raw_filename)
+        mp = MarchesPublicsWorkflow(pd.DataFrame({"url": []}), self.config)
+        out = mp._read_parse_file(file_metadata=None, raw_filename=self.raw_filename).collect()
+
+        assert len(list((self.folder / "interim").glob("*.parquet"))) == 2
+        assert not (self.folder / "interim.tmp").exists()
+        assert out["titulaire_id"].to_list() == ["id_1", "id_2", "id_3"]
+        assert out["acheteur_id"].to_list() == ["a_01", "a_02", "a_02"]
+        assert out.schema["montant"] == pl.Float64
+        assert out.schema["countTitulaires"] == pl.Int64
+
+    def test_array_prefix_cache(self):
+        shutil.copy(FIXTURES_DIRECTORY / "marche_nested.json", self.raw_filename)
+        mp = MarchesPublicsWorkflow(pd.DataFrame({"url": []}), self.config)
+        assert mp._array_prefix(self.raw_filename) == "marches.marche"
+
+        cache_filename = self.folder / "array_prefix.json"
+        with open(cache_filename) as f:
+            cached = json.load(f)
+        with open(cache_filename, "w") as f:
+            json.dump(cached | {"prefix": "cached"}, f)
+        assert mp._array_prefix(self.raw_filename) == "cached"
+
+        shutil.copy(FIXTURES_DIRECTORY / "marche_direct.json", self.raw_filename)
+        assert mp._array_prefix(self.raw_filename) == "marches"
+
+    def test_parallel_normalization(self):
+        self.config["marches_publics"]["normalization_workers"] = 2
+        files = pd.DataFrame(
+            {
+                "url": [
+                    f"file:{FIXTURES_DIRECTORY / 'marche_direct.json'}",
+                    f"file:{FIXTURES_DIRECTORY / 'marche_nested.json'}",
+                ],
+                "format": "json",
+            }
+        )
+        MarchesPublicsWorkflow(files, self.config).run()
+        out = pd.read_parquet(self.config["marches_publics"]["combined_filename"])
+        assert sorted(out["montant"]) == [20.0, 20.0, 40.0, 40.0, 200.0, 500.0]
+
+    def test_ijson_backend(self):
+        pytest.importorskip("ijson.backends.yajl2_c")
+        assert ijson_backend("yajl2_c").backend == "yajl2_c"
+
+    def test_ijson_backend_fallback(self):
+        assert ijson_backend("unknown").backend == ijson.backend
+
+    def test_interim_schema_types(self):
+        marches = [
+            {
+                "id": 1,
+                "acheteur": {"id": "a_01"},
+                "montant": "12 000",
+                "dureeMois": 12.0,
+                "lieuExecution": {"code": "75", "typeCode": "Code département"},
+                "titulaires": [{"id": "id_1"}],
+            },
+            {"id": "02", "montant": 30, "dureeMois": "3", "autre": 5},
+            {"id": "03", "montant": "1 500,50 €", "dureeMois": 1e20},
+            {"id": "04", "montant": "inconnu", "dureeMois": "2,5"},
+        ]
+        with open(self.raw_filename, "w") as f:
+            json.dump({"marches": marches}, f)
+        mp = MarchesPublicsWorkflow(pd.DataFrame({"url": []}), self.config)
+        out = mp._read_parse_file(file_metadata=None, raw_filename=self.raw_filename).collect()
+
+        assert out["id"].to_list() == ["1", "02", "03", "04"]
+        assert out["montant"].to_list() == [12000.0, 30.0, 1500.5, None]
+        assert out["dureeMois"].to_list() == [12, 3, None, None]
+        assert json.loads(out["lieuExecution"][0]) == marches[0]["lieuExecution"]
+        assert out["autre"].to_list() == [None, "5", None, None]
@@ -0,0 +1,103 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from back.scripts.datasets.sirene import SireneLookup, SireneWorkflow
+
+FIXTURES_DIRECTORY = Path(__file__).parent / "fixtures"
+
+
+class TestSireneFormat:
+    def setup_method(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.config = {
+            "sirene": {
+                "data_folder": str(self.folder),
+                "combined_filename": str(self.folder / "sirene.parquet"),
+                "xls_urls_naf": [
+                    f"https://example.com/naf_n{level}.xls" for level in range(1, 6)
+                ],
+                "xls_urls_cat_ju": "https://example.com/cj.xls",
+            }
+        }
+        shutil.copy(
+            FIXTURES_DIRECTORY / "sirene_raw.parquet", self.folder / "sirene_raw.parquet"
+        )
+        # Reference tables already extracted from the XLS files.
+        pl.DataFrame(
+            {
+                "level": pl.Series([1, 2, 3, 4, 5], dtype=pl.Int8),
+                "Code": ["Z", "32", "321", "3212", "3212Z"],
+                "Libellé": ["n1", "n2", "n3", "n4", "n5"],
+            }
+        ).write_parquet(self.folder / "naf_labels.parquet")
+        pl.DataFrame(
+            {
+                "level": pl.Series([1, 2, 3], dtype=pl.Int8),
+                "Code": ["1", "10", "1000"],
+                "Libellé": ["cj1", "cj2", "cj3"],
+            }
+        ).write_parquet(self.folder / "categories_juridiques.parquet")
+        workflow = SireneWorkflow(self.config)
+        workflow._save_cache_sources(
+            self.folder / "naf_labels.parquet", self.config["sirene"]["xls_urls_naf"]
+        )
+        workflow._save_cache_sources(
+            self.folder / "categories_juridiques.parquet",
+            [self.config["sirene"]["xls_urls_cat_ju"]],
+        )
+
+    def test_format_to_parquet(self):
+        SireneWorkflow(self.config)._format_to_parquet()
+        out = pl.read_parquet(self.folder / "sirene.parquet")
+
+        assert out.height == 15
+        row = out.filter(pl.col("siren") == "000325175").row(0, named=True)
+        assert row["is_active"]
+        assert [row[f"Libellé_naf_n{level}"] for level in range(1, 6)] == [
+            "n1",
+            "n2",
+            "n3",
+            "n4",
+            "n5",
+        ]
+        assert [row[f"categorie_juridique_n{level}_name"] for level in range(1, 4)] == [
+            "cj1",
+            "cj2",
+            "cj3",
+        ]
+        # Activity codes of the older nomenclatures have no label.
+        row = out.filter(pl.col("siren") == "005410220").row(0, named=True)
+        assert row["Libellé_naf_n2"] is None
+
+    def test_lookup(self):
+        self.config["sirene"]["row_group_size"] = 4
+        SireneWorkflow(self.config)._format_to_parquet()
+        sirene = pl.read_parquet(self.folder / "sirene.parquet")
+        assert sirene["siren"].is_sorted()
+
+        lookup = SireneLookup(self.folder / "sirene.parquet")
+        assert len(lookup.row_group_ranges) == 4
+        queries = sirene["siren"].gather([0, 1, 14]).to_list()
+        assert lookup.candidate_row_groups(np.array(sorted(queries), dtype=object)) == [0, 3]
+
+        out = SireneWorkflow.lookup(
+            self.config, [*queries, "999999999", None], columns=["raison_sociale"]
+        )
+        assert sorted(out["siren"]) == sorted(queries)
+        assert out.columns == ["siren", "raison_sociale"]
+        assert SireneWorkflow.lookup(self.config, []).is_empty()
+
+    def test_labels_cache_invalidation(self):
+        cache_filename = self.folder / "categories_juridiques.parquet"
+        urls = [self.config["sirene"]["xls_urls_cat_ju"]]
+        workflow = SireneWorkflow(self.config)
+        assert workflow._is_cache_valid(cache_filename, urls)
+        # Another release of the file
+        assert not workflow._is_cache_valid(cache_filename, ["https://example.com/cj_2025.xls"])
+        # The file downloaded again
+        (self.folder / "cj.xls").write_bytes(b"new release")
+        assert not workflow._is_cache_valid(cache_filename, urls)
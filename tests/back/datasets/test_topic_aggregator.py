@@ -175,3 +175,96 @@ class TestYearFromMetadata:
         meta = next(files_in_scope.itertuples(index=False))
         result = TopicAggregator.year_from_metadata(meta)
         assert result == "2023"
+
+
+class TestParallelNormalization:
+    SCHEMA = [
+        "nomAttribuant",
+        "idAttribuant",
+        "dateConvention",
+        "nomBeneficiaire",
+        "idBeneficiaire",
+        "objet",
+        "montant",
+    ]
+
+    def _run(self, folder: Path, files: list[pd.DataFrame], workers: int) -> Path:
+        folder.mkdir()
+        pd.DataFrame({"name": self.SCHEMA}).assign(
+            lower_name=lambda df: df["name"].str.lower()
+        ).to_parquet(folder / "official_schema_subventions.parquet")
+
+        urls = []
+        for i, df in enumerate(files):
+            filename = folder / f"input_{i}.csv"
+            df.to_csv(filename, index=False)
+            urls.append("file:" + str(filename))
+        files_in_scope = pd.DataFrame(
+            {
+                "url": urls,
+                "url_hash": [f"file_{i}" for i in range(len(files))],
+                "format": "csv",
+                "siren": "123456789",
+                "type": "COM",
+                "title": None,
+                "dataset_title": "Subventions 2023",
+            }
+        )
+        config = {
+            "data_folder": str(folder),
+            "combined_filename": str(folder / "final.parquet"),
+            "normalization_workers": workers,
+        }
+        TopicAggregator(files_in_scope, "subventions", config).run()
+        return folder
+
+    def test_same_outputs_as_sequential(self):
+        files = [
+            pd.DataFrame(
+                {
+                    "idAttribuant": "20004697700019",
+                    "idBeneficiaire": [f"4778569590001{i}", f"4778769590001{i}"],
+                    "montant": [4500 + i, None],
+                }
+            )
+            for i in range(4)
+        ]
+        files.append(
+            pd.DataFrame(
+                {
+                    "idAttribuant": "20004697700019",
+                    "idBeneficiaire": ["47785695900010", "47787695900010"],
+                    "montant": [1, 2],
+                    "unknown_b": "x",
+                    "unknown_a": "y",
+                }
+            )
+        )
+        files.append(pd.DataFrame({"nomBeneficiaire": ["A", "B"], "objet": "whatever"}))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            sequential = self._run(Path(tmpdir) / "sequential", files, workers=1)
+            parallel = self._run(Path(tmpdir) / "parallel", files, workers=3)
+
+            for filename in ["errors.json", "extra_columns.csv"]:
+                assert (sequential / filename).read_text() == (
+                    parallel / filename
+                ).read_text().replace(str(parallel), str(sequential))
+
+            pd.testing.assert_frame_equal(
+                pd.read_parquet(sequential / "missing_data.parquet"),
+                pd.read_parquet(parallel / "missing_data.parquet"),
+            )
+            seq_out = pd.read_parquet(sequential / "final.parquet")
+            par_out = pd.read_parquet(parallel / "final.parquet").assign(
+                url=lambda df: df["url"].str.replace(str(parallel), str(sequential))
+            )
+            pd.testing.assert_frame_equal(
+                seq_out.sort_values("id_beneficiaire").reset_index(drop=True),
+                par_out.sort_values("id_beneficiaire").reset_index(drop=True),
+            )
+            assert len(seq_out) == 4
+            assert (sequential / "extra_columns.csv").read_text().split()[1:3] == [
+                "unknown_a,1",
+                "unknown_b,1",
+            ]
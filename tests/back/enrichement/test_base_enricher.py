@@ -0,0 +1,109 @@
+import json
+import tempfile
+from pathlib import Path
+
+import polars as pl
+import polars.testing as pltesting
+
+from back.scripts.enrichment.base_enricher import BaseEnricher
+from back.scripts.enrichment.utils.run_report import RunReport
+
+INPUT = pl.DataFrame({"siren": ["1", "2", "3"], "montant": [1.0, 2.0, 3.0]})
+
+
+class DummyEnricher(BaseEnricher):
+    received = []
+
+    @classmethod
+    def get_dataset_name(cls) -> str:
+        return "dummy"
+
+    @classmethod
+    def get_input_paths(cls, main_config: dict) -> list[Path]:
+        return [Path(main_config["warehouse"]["data_folder"]) / "input.parquet"]
+
+    @classmethod
+    def _clean_and_enrich(cls, inputs):
+        (frame,) = inputs
+        cls.received.append(type(frame))
+        return frame.pipe(cls._filter)
+
+    @classmethod
+    @RunReport.step
+    def _filter(cls, frame):
+        return frame.filter(pl.col("montant") > 1)
+
+
+class LazyDummyEnricher(DummyEnricher):
+    lazy = True
+
+
+class TestBaseEnricher:
+    def setup_method(self):
+        self.folder = Path(tempfile.mkdtemp())
+        INPUT.write_parquet(self.folder / "input.parquet")
+        self.config = {"warehouse": {"data_folder": str(self.folder)}}
+        DummyEnricher.received.clear()
+
+    def test_eager(self):
+        DummyEnricher.enrich(self.config)
+        assert DummyEnricher.received == [pl.DataFrame]
+        out = pl.read_parquet(DummyEnricher.get_output_path(self.config))
+        pltesting.assert_frame_equal(out, INPUT.tail(2))
+
+    def test_lazy(self):
+        LazyDummyEnricher.enrich(self.config)
+        assert LazyDummyEnricher.received == [pl.LazyFrame]
+        out = pl.read_parquet(LazyDummyEnricher.get_output_path(self.config))
+        pltesting.assert_frame_equal(out, INPUT.tail(2))
+
+    def test_lazy_eager_output(self):
+        output_path = self.folder / "output.parquet"
+        LazyDummyEnricher._write_output(INPUT, output_path)
+        pltesting.assert_frame_equal(pl.read_parquet(output_path), INPUT)
+
+    def test_report(self):
+        DummyEnricher.enrich(self.config)
+        with open(self.folder / "dummy.report.json") as f:
+            report = json.load(f)
+        assert report["enricher"] == "dummy"
+        assert report["inputs"] == {str(self.folder / "input.parquet"): 3}
+        assert report["output_rows"] == 2
+        assert [(s["name"], s["rows"]) for s in report["steps"]] == [
+            ("DummyEnricher._filter", 2)
+        ]
+        assert "plan" not in report
+        assert report["peak_rss_delta_mb"] >= 0
+
+    def test_report_plan(self):
+        self.config["warehouse"]["explain_plans"] = True
+        LazyDummyEnricher.enrich(self.config)
+        with open(self.folder / "dummy.report.json") as f:
+            report = json.load(f)
+        assert report["steps"][0]["lazy"]
+        assert "Parquet SCAN" in report["plan"]
+
+    def test_report_profile_steps(self):
+        LazyDummyEnricher.enrich(self.config)
+        with open(self.folder / "dummy.report.json") as f:
+            assert "rows" not in json.load(f)["steps"][0]
+
+        LazyDummyEnricher.get_output_path(self.config).unlink()
+        self.config["warehouse"]["profile_steps"] = True
+        LazyDummyEnricher.enrich(self.config)
+        with open(self.folder / "dummy.report.json") as f:
+            (step,) = json.load(f)["steps"]
+        assert step["lazy"]
+        assert step["rows"] == 2
+        out = pl.read_parquet(LazyDummyEnricher.get_output_path(self.config))
+        pltesting.assert_frame_equal(out, INPUT.tail(2))
+
+    def test_profile_nodes(self):
+        step = {}
+        collected = RunReport._profile(INPUT.lazy().filter(pl.col("montant") > 1), step)
+        pltesting.assert_frame_equal(collected, INPUT.tail(2))
+        if hasattr(pl.LazyFrame, "profile"):
+            assert {"node", "start", "end"} <= set(step["nodes"][0])
+
+    def test_step_outside_of_report(self):
+        pltesting.assert_frame_equal(DummyEnricher._filter(INPUT), INPUT.tail(2))
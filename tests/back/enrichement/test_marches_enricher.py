@@ -0,0 +1,576 @@
+import json
+from pathlib import Path
+
+import pandas as pd
+import polars as pl
+import polars.testing as pltesting
+
+from back.scripts.enrichment.marches_enricher import MarchesPublicsEnricher
+
+FIXTURES_DIRECTORY = Path(__file__).parent / "fixtures"
+
+
+def lieu(code, type_code, nom=None):
+    return json.dumps({"code": code, "typeCode": type_code, "nom": nom})
+
+
+def mods(*items, wrap=False):
+    return json.dumps([{"modification": m} if wrap else m for m in items])
+
+
+rows = [
+    # simple marché, 1 titulaire
+    dict(
+        id="2020-001",
+        uid="A2020-001",
+        uuid=None,
+        titulaire_id="12345678900011",
+        titulaire_typeIdentifiant="SIRET",
+        acheteur_id="21750001600019",
+        objet="Travaux de voirie",
+        codeCPV="45233140-2",
+        dateNotification="2020-03-15",
+        datePublicationDonnees="2020-04-01",
+        montant=120000.0,
+        countTitulaires=1.0,
+        dureeMois=12.0,
+        formePrix="Ferme",
+        lieuExecution=lieu("75056", "Code commune", "Paris"),
+        modifications=None,
+        source="data.gouv.fr_aife",
+        considerationsEnvironnementales='["Pas de consid\\u00e9ration environnementale"]',
+        modaliteExecution=None,
+        technique='{"technique": ["Accord-cadre"]}',
+        typesPrix='["Prix forfaitaire"]',
+        typePrix=None,
+        TypePrix=None,
+        actesSousTraitance=None,
+    ),
+    # 2 titulaires, montant split
+    dict(
+        id="2021-07",
+        uid=None,
+        uuid=None,
+        titulaire_id="987654321",
+        titulaire_typeIdentifiant=None,
+        acheteur_id="217500016",
+        objet="Fournitures",
+        codeCPV="30192000-1",
+        dateNotification="2021-06-01",
+        datePublicationDonnees="2021-06-20",
+        montant=30000.0,
+        countTitulaires=2.0,
+        dureeMois=None,
+        formePrix="Ferme, actualisable",
+        lieuExecution=lieu("69", "Code département", None),
+        modifications="[]",
+        source="data.gouv.fr_aife",
+        considerationsEnvironnementales=None,
+        modaliteExecution='["Tranches", "Bons de commande"]',
+        technique=None,
+        typesPrix=None,
+        typePrix="Prix unitaires",
+        TypePrix=None,
+        actesSousTraitance=None,
+    ),
+    dict(
+        id="2021-07",
+        uid=None,
+        uuid=None,
+        titulaire_id="FR12345678912",
+        titulaire_typeIdentifiant="TVA_INTRACOMMUNAUTAIRE",
+        acheteur_id="217500016",
+        objet="Fournitures",
+        codeCPV="30192000-1",
+        dateNotification="2021-06-01",
+        datePublicationDonnees="2021-06-20",
+        montant=30000.0,
+        countTitulaires=2.0,
+        dureeMois=None,
+        formePrix="Ferme, actualisable",
+        lieuExecution=lieu("69", "Code département", None),
+        modifications="[]",
+        source="data.gouv.fr_aife",
+        considerationsEnvironnementales=None,
+        modaliteExecution='["Tranches", "Bons de commande"]',
+        technique=None,
+        typesPrix=None,
+        typePrix="Prix unitaires",
+        TypePrix=None,
+        actesSousTraitance=None,
+    ),
+    # initial version and modified versions of the same marché
+    dict(
+        id="M-1",
+        uid="X",
+        uuid="u-1",
+        titulaire_id="11122233300044",
+        titulaire_typeIdentifiant="HORS_UE",
+        acheteur_id="200054781",
+        objet="Maintenance",
+        codeCPV="50000000-5",
+        dateNotification="2022-01-10",
+        datePublicationDonnees="2022-01-20",
+        montant=50000.0,
+        countTitulaires=1.0,
+        dureeMois=24.0,
+        formePrix="",
+        lieuExecution=lieu("33000", "Code postal", "Bordeaux"),
+        modifications=None,
+        source="marches-publics.info",
+        considerationsEnvironnementales=None,
+        modaliteExecution=None,
+        technique=None,
+        typesPrix=None,
+        typePrix=None,
+        TypePrix="NC",
+        actesSousTraitance=None,
+    ),
+    dict(
+        id="M-1",
+        uid="X",
+        uuid="u-1",
+        titulaire_id="11122233300044",
+        titulaire_typeIdentifiant="HORS_UE",
+        acheteur_id="200054781",
+        objet="Maintenance",
+        codeCPV="50000000-5",
+        dateNotification="2022-01-10",
+        datePublicationDonnees="2022-01-20",
+        montant=50000.0,
+        countTitulaires=1.0,
+        dureeMois=24.0,
+        formePrix="",
+        lieuExecution=lieu("33000", "Code postal", "Bordeaux"),
+        modifications=mods(
+            {
+                "id": 1,
+                "montantModification": 60000,
+                "datePublicationDonneesModification": "2022-06-01",
+                "dureeMoisModification": 30,
+            },
+            wrap=True,
+        ),
+        source="marches-publics.info",
+        considerationsEnvironnementales=None,
+        modaliteExecution=None,
+        technique=None,
+        typesPrix=None,
+        typePrix=None,
+        TypePrix="NC",
+        actesSousTraitance=None,
+    ),
+    dict(
+        id="M-1",
+        uid="X",
+        uuid="u-1",
+        titulaire_id="11122233300044",
+        titulaire_typeIdentifiant="HORS_UE",
+        acheteur_id="200054781",
+        objet="Maintenance",
+        codeCPV="50000000-5",
+        dateNotification="2022-01-10",
+        datePublicationDonnees="2022-01-20",
+        montant=50000.0,
+        countTitulaires=1.0,
+        dureeMois=24.0,
+        formePrix="",
+        lieuExecution=lieu("33000", "Code postal", "Bordeaux"),
+        modifications=mods(
+            {
+                "id": 2,
+                "montantModification": "75000.5",
+                "datePublicationDonneesModification": "2022-09-01",
+                "objetModification": "Maintenance étendue",
+            },
+            {
+                "id": 1,
+                "montantModification": 60000,
+                "datePublicationDonneesModification": "2022-06-01",
+                "dureeMoisModification": 30,
+            },
+            wrap=True,
+        ),
+        source="marches-publics.info",
+        considerationsEnvironnementales=None,
+        modaliteExecution=None,
+        technique=None,
+        typesPrix=None,
+        typePrix=None,
+        TypePrix="NC",
+        actesSousTraitance=None,
+    ),
+    # same marché published by another source
+    dict(
+        id="M-1",
+        uid="X",
+        uuid="u-1",
+        titulaire_id="11122233300044",
+        titulaire_typeIdentifiant="HORS_UE",
+        acheteur_id="200054781",
+        objet="Maintenance",
+        codeCPV="50000000-5",
+        dateNotification="2022-01-10",
+        datePublicationDonnees="2022-01-20",
+        montant=50000.0,
+        countTitulaires=1.0,
+        dureeMois=24.0,
+        formePrix="",
+        lieuExecution=lieu("33000", "Code postal", "Bordeaux"),
+        modifications=None,
+        source="rare_source",
+        considerationsEnvironnementales=None,
+        modaliteExecution=None,
+        technique=None,
+        typesPrix=None,
+        typePrix=None,
+        TypePrix="NC",
+        actesSousTraitance=None,
+    ),
+    # legacy modification format and malformed values
+    dict(
+        id="L-9",
+        uid=None,
+        uuid=None,
+        titulaire_id="55566677788899",
+        titulaire_typeIdentifiant=None,
+        acheteur_id="213105554",
+        objet=None,
+        codeCPV="71000000-8",
+        dateNotification="2023-02-01",
+        datePublicationDonnees="2023-02-05",
+        montant=15000.0,
+        countTitulaires=1.0,
+        dureeMois=6.0,
+        formePrix="Révisable",
+        lieuExecution=lieu("FR", "Code pays", "France"),
+        modifications=mods({"dureeMois": 9, "dateSignatureModification": "2023-05-01"}),
+        source="data.gouv.fr_pes",
+        considerationsEnvironnementales='{"considerationEnvironnementale": "Clause environnementale"}',
+        modaliteExecution="not json",
+        technique="",
+        typesPrix='{"typePrix": ["Prix révisables", "Prix forfaitaire"]}',
+        typePrix=None,
+        TypePrix=None,
+        actesSousTraitance='[{"id": 1}]',
+    ),
+    dict(
+        id="B-2",
+        uid=None,
+        uuid=None,
+        titulaire_id=None,
+        titulaire_typeIdentifiant=None,
+        acheteur_id="213105554",
+        objet="Etude",
+        codeCPV=None,
+        dateNotification="2023-03-01",
+        datePublicationDonnees=None,
+        montant=8000.0,
+        countTitulaires=1.0,
+        dureeMois=2.0,
+        formePrix=None,
+        lieuExecution="{bad json",
+        modifications="{not a list",
+        source=None,
+        considerationsEnvironnementales=None,
+        modaliteExecution=None,
+        technique=None,
+        typesPrix=None,
+        typePrix="",
+        TypePrix=None,
+        actesSousTraitance=None,
+    ),
+    dict(
+        id="C-3",
+        uid="C",
+        uuid=None,
+        titulaire_id="123456789",
+        titulaire_typeIdentifiant=None,
+        acheteur_id="213105554",
+        objet="Conseil",
+        codeCPV="79411000-8",
+        dateNotification="2019-12-31",
+        datePublicationDonnees="2020-01-02",
+        montant=45000.0,
+        countTitulaires=None,
+        dureeMois=3.0,
+        formePrix="Ferme",
+        lieuExecution=lieu("Bourgogne", "Bourgogne", None),
+        modifications='{"modification": {"montant": 1}}',
+        source="data.gouv.fr_pes",
+        considerationsEnvironnementales=None,
+        modaliteExecution=None,
+        technique='{"technique": "Concours"}',
+        typesPrix=None,
+        typePrix=None,
+        TypePrix="Prix mixtes",
+        actesSousTraitance=None,
+    ),
+    # modification of a column outside of the usual ones
+    dict(
+        id="F-4",
+        uid=None,
+        uuid=None,
+        titulaire_id="44455566600077",
+        titulaire_typeIdentifiant="SIRET",
+        acheteur_id="213105554",
+        objet="Nettoyage",
+        codeCPV="90910000-9",
+        dateNotification="2023-04-01",
+        datePublicationDonnees="2023-04-10",
+        montant=20000.0,
+        countTitulaires=1.0,
+        dureeMois=12.0,
+        formePrix="Ferme",
+        lieuExecution=lieu("31555", "Code commune", "Toulouse"),
+        modifications=mods(
+            {
+                "formePrixModification": "Révisable",
+                "dateNotificationModification": "2023-06-01",
+            },
+            wrap=True,
+        ),
+        source="data.gouv.fr_aife",
+        considerationsEnvironnementales=None,
+        modaliteExecution=None,
+        technique=None,
+        typesPrix=None,
+        typePrix="Prix unitaires",
+        TypePrix=None,
+        actesSousTraitance=None,
+    ),
+    # previous version of the marché, with a type of lieuExecution found nowhere else
+    dict(
+        id="F-4",
+        uid=None,
+        uuid=None,
+        titulaire_id="44455566600077",
+        titulaire_typeIdentifiant="SIRET",
+        acheteur_id="213105554",
+        objet="Nettoyage",
+        codeCPV="90910000-9",
+        dateNotification="2023-04-01",
+        datePublicationDonnees="2023-04-10",
+        montant=20000.0,
+        countTitulaires=1.0,
+        dureeMois=12.0,
+        formePrix="Ferme",
+        lieuExecution=lieu("76", "Code région", "Occitanie"),
+        modifications=None,
+        source="rare_source",
+        considerationsEnvironnementales=None,
+        modaliteExecution=None,
+        technique=None,
+        typesPrix=None,
+        typePrix="Prix unitaires",
+        TypePrix=None,
+        actesSousTraitance=None,
+    ),
+    # explicit null in the last modification
+    dict(
+        id="N-5",
+        uid=None,
+        uuid=None,
+        titulaire_id="77788899900011",
+        titulaire_typeIdentifiant="SIRET",
+        acheteur_id="213105554",
+        objet="Transport",
+        codeCPV="60000000-8",
+        dateNotification="2023-05-01",
+        datePublicationDonnees="2023-05-10",
+        montant=10000.0,
+        countTitulaires=1.0,
+        dureeMois=6.0,
+        formePrix="Ferme",
+        lieuExecution=lieu("31555", "Code commune", "Toulouse"),
+        modifications=mods(
+            {"montant": 999, "dateNotificationModification": "2023-06-01"},
+            {"montant": None, "dateNotificationModification": "2023-07-01"},
+        ),
+        source="data.gouv.fr_aife",
+        considerationsEnvironnementales=None,
+        modaliteExecution=None,
+        technique=None,
+        typesPrix=None,
+        typePrix=None,
+        TypePrix=None,
+        actesSousTraitance=None,
+    ),
+]
+
+MARCHES = pl.DataFrame(rows, infer_schema_length=None)
+CPV_LABELS = pl.DataFrame(
+    {
+        "CODE": [
+            "45000000-7",
+            "45233140-2",
+            "30000000-9",
+            "30192000-1",
+            "50000000-5",
+            "71000000-8",
+        ],
+        "FR": [
+            "Travaux de construction",
+            "Travaux de routes",
+            "Machines de bureau",
+            "Fournitures de bureau",
+            "Services de réparation",
+            "Services d'architecture",
+        ],
+    }
+)
+
+
+def _grouping(ids: pl.Series) -> list[int]:
+    first_positions = {}
+    return [first_positions.setdefault(i, len(first_positions)) for i in ids]
+
+
+class TestMarchesPublicsEnricher:
+    def _check_equivalent(self, out: pl.DataFrame):
+        """
+        Compare to the output of the former pandas implementation.
+        The generated ids are arbitrary, only the grouping of the rows by id is compared.
+        """
+        expected = pl.read_parquet(
+            FIXTURES_DIRECTORY / "marches_publics_enriched.parquet"
+        ).with_columns(
+            # The pandas implementation wrote the literal "None" for missing objects
+            pl.col("objet").replace("None", "")
+        )
+        assert sorted(out.columns) == sorted(expected.columns)
+
+        keys = ["titulaire_id", "acheteur_id"]
+        out = out.select(expected.columns).sort(keys, nulls_last=True)
+        expected = expected.sort(keys, nulls_last=True)
+        pltesting.assert_frame_equal(out.drop("id"), expected.drop("id"))
+        assert _grouping(out["id"]) == _grouping(expected["id"])
+
+    def test_lazy_output_equivalent_to_pandas(self):
+        out = MarchesPublicsEnricher._clean_and_enrich([MARCHES.lazy(), CPV_LABELS.lazy()])
+        assert isinstance(out, pl.LazyFrame)
+        self._check_equivalent(out.collect(engine="streaming"))
+
+    def test_eager_output_equivalent_to_pandas(self):
+        out = MarchesPublicsEnricher._clean_and_enrich([MARCHES, CPV_LABELS])
+        assert isinstance(out, pl.DataFrame)
+        self._check_equivalent(out)
+
+    def test_appliquer_modifications(self):
+        marches = pl.LazyFrame(
+            {
+                "montant": [10.0, 20.0, 30.0, None, 40.0, 50.0],
+                "objet": ["a", "b", "c", "d", "e", "f"],
+                "formePrix": ["Ferme"] * 6,
+                "modifications": [
+                    mods(
+                        {
+                            "montantModification": "15",
+                            "datePublicationDonneesModification": "2022-02",
+                        },
+                        {
+                            "montantModification": 12,
+                            "datePublicationDonneesModification": "2022-01",
+                        },
+                        wrap=True,
+                    ),
+                    mods({"objetModification": "b2"}, {"montant": "abc"}),
+                    "not json",
+                    mods({"montant": 5}),
+                    mods(
+                        {"montant": 45, "dateSignatureModification": "2022-01"},
+                        {"montant": None, "dateSignatureModification": "2022-02"},
+                    ),
+                    mods({"formePrixModification": "Révisable", "objet": {"a": 1}}),
+                ],
+            }
+        )
+        out = MarchesPublicsEnricher.appliquer_modifications(marches).collect()
+        assert out["montant"].to_list() == [15.0, 20.0, 30.0, 5.0, None, 50.0]
+        assert out["objet"].to_list() == ["a", "b2", "c", "d", "e", '{"a": 1}']
+        assert out["formePrix"].to_list() == ["Ferme"] * 5 + ["Révisable"]
+
+    def test_obligation_publication_same_as_pandas(self):
+        montants = [-1.0, 0.0, 39999.9, 40000.0, float("inf"), float("nan"), None]
+        marches = pl.LazyFrame(
+            {"montant": montants, "dateNotification": None, "datePublicationDonnees": None},
+            schema_overrides={
+                "dateNotification": pl.Datetime("ns", "UTC"),
+                "datePublicationDonnees": pl.Datetime("ns", "UTC"),
+            },
+        )
+        out = MarchesPublicsEnricher._add_metadata(marches).collect()
+        expected = pd.cut(
+            pd.Series(montants, dtype=float),
+            bins=[0, 40000, float("inf")],
+            labels=["Optionnel", "Obligatoire"],
+            right=False,
+        )
+        assert (
+            out["obligation_publication"].to_list()
+            == expected.astype(object).where(expected.notna(), None).tolist()
+        )
+
+    def test_generic_json_column_enrich_same_as_python(self):
+        values = [
+            None,
+            "",
+            "  ",
+            "not json",
+            '["b", "a", "b"]',
+            "[]",
+            "[1, 2]",
+            '[{"a": 1}]',
+            '{"typePrix": ["Prix révisables", "Prix forfaitaire"]}',
+            '{"typePrix": "Prix ferme"}',
+            '{"typePrix": "[Prix ferme"}',
+            '{"typePrix": []}',
+            '{"typePrix": null}',
+            '{"typePrix": 12}',
+            '{"typePrix": "12"}',
+            '{"typePrix": {"a": 1}}',
+            '{"autre": "x"}',
+            '"Prix ferme"',
+            "12",
+            '["\\u00e9t\\u00e9", "a\\"b"]',
+        ]
+        marches = pl.LazyFrame({"typesPrix": values}, schema={"typesPrix": pl.String})
+        out = MarchesPublicsEnricher.generic_json_column_enrich(
+            marches, "typesPrix", "typePrix"
+        )
+        expected = [
+            MarchesPublicsEnricher.safe_json_load_of_dict_or_list_or_str(v, "typePrix")
+            for v in values
+        ]
+        assert out.collect()["typesPrix"].to_list() == expected
+
+    def test_lieu_execution_same_as_python(self):
+        values = [
+            None,
+            "",
+            "{bad json",
+            lieu("75056", "Code commune", "Paris"),
+            lieu(75056, "Code Département", None),
+            lieu(7.5e20, "Code région", "Île-de-France"),
+            lieu({"a": 1}, "Œ", ["x"]),
+            lieu(True, "Code postal", "Saint-Étienne"),
+        ]
+        marches = pl.LazyFrame({"lieuExecution": values}, schema={"lieuExecution": pl.String})
+        out = MarchesPublicsEnricher._parse_lieu_execution(marches).collect()
+
+        def field(value, key):
+            value = MarchesPublicsEnricher.safe_json_load(value).get(key)
+            return str(value).lower() if value is not None else None
+
+        assert out["lieu_execution_code"].to_list() == [field(v, "code") for v in values]
+        assert out["lieu_execution_nom"].to_list() == [field(v, "nom") for v in values]
+        assert out["lieu_execution_type_code"].to_list() == [
+            None,
+            None,
+            None,
+            "code commune",
+            "code departement",
+            "code region",
+            "oe",
+            "code postal",
+        ]
@@ -0,0 +1,33 @@
+import polars as pl
+
+from back.scripts.enrichment.utils.json_utils import JsonUtils
+
+
+class TestJsonUtils:
+    def test_is_array_of_strings(self):
+        values = pl.Series(
+            ['["a", "b"]', "[]", '["a\\"b"]', '["a", 1]', '[["a"]]', '"a"', None]
+        )
+        actual = values.to_frame("v").select(JsonUtils.is_array_of_strings(pl.col("v")))
+        assert actual["v"].to_list() == [True, True, True, False, False, False, None]
+
+    def test_decode_skips_masked_rows(self):
+        values = pl.DataFrame({"v": ['["a", "b"]', '{"not": "a list"}', None]})
+        mask = JsonUtils.is_array_of_strings(pl.col("v"))
+        actual = values.select(JsonUtils.decode(pl.col("v"), pl.List(pl.String), mask))
+        assert actual["v"].to_list() == [["a", "b"], None, None]
+
+    def test_with_fallback_only_for_non_native_rows(self):
+        calls = []
+
+        def fallback(x):
+            calls.append(x)
+            return "fallback"
+
+        values = pl.DataFrame({"v": ["native", "other", None]})
+        is_native = pl.col("v") == "native"
+        actual = values.select(
+            JsonUtils.with_fallback(pl.col("v"), pl.lit("ok"), is_native, fallback).alias("v")
+        )
+        assert actual["v"].to_list() == ["ok", "fallback", None]
+        assert calls == ["other"]
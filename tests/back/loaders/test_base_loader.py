@@ -1,9 +1,19 @@
 import re
+import zipfile
 
+import pandas as pd
 import pytest
 import responses
 
 from back.scripts.loaders import BaseLoader as BaseLoaderBase
+from back.scripts.loaders import (
+    CSVLoader,
+    ExcelLoader,
+    JSONLoader,
+    ParquetLoader,
+    XMLLoader,
+    ZipLoader,
+)
 
 
 class BaseLoader(BaseLoaderBase):
@@ -217,3 +227,51 @@ class TestBaseLoaderLoadFile:
 
         loader_file = BaseLoaderLocalFile("./tests/back/loaders/fixtures/test_loader_file.txt")
         assert loader_file._load_from_file() == "testsucceded"
+
+
+class TestSearchLoaderClass:
+    @responses.activate
+    def test_known_format_without_probe(self):
+        url = "https://example.com/resource"
+        assert BaseLoader.search_loader_class(url, file_format="csv") is CSVLoader
+        assert (
+            BaseLoader.search_loader_class(url, file_format="application/vnd.ms-excel")
+            is ExcelLoader
+        )
+        assert BaseLoader.search_loader_class(f"{url}.parquet") is ParquetLoader
+        assert len(responses.calls) == 0
+
+    @pytest.mark.parametrize(
+        "content, loader_class",
+        [
+            (b"PAR1\x15\x04", ParquetLoader),
+            (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1\x00", ExcelLoader),
+            (b'\xef\xbb\xbf \n{"a": 1}', JSONLoader),
+            (b"[1, 2]", JSONLoader),
+            (b"<?xml version='1.0'?><a/>", XMLLoader),
+            (b"a;b\n1;2\n", None),
+        ],
+    )
+    def test_sniffed_format(self, tmp_path, content, loader_class):
+        filename = tmp_path / "raw.nan"
+        filename.write_bytes(content)
+        assert BaseLoader.search_loader_class(str(filename)) is loader_class
+
+    def test_sniffed_archives(self, tmp_path):
+        pd.DataFrame({"a": [1]}).to_excel(tmp_path / "file.xlsx", index=False)
+        (tmp_path / "file.xlsx").rename(tmp_path / "excel_raw")
+        with zipfile.ZipFile(tmp_path / "zip_raw", "w") as archive:
+            archive.writestr("file.csv", "a\n1\n")
+
+        assert BaseLoader.search_loader_class(str(tmp_path / "excel_raw")) is ExcelLoader
+        assert BaseLoader.search_loader_class(str(tmp_path / "zip_raw")) is ZipLoader
+
+    @responses.activate
+    def test_probe_cached(self):
+        url = "https://example.com/cached_resource"
+        responses.add(responses.HEAD, url, status=200, content_type="application/json")
+
+        assert BaseLoader.search_loader_class(url) is JSONLoader
+        assert BaseLoader.search_loader_class(url) is JSONLoader
+        assert JSONLoader.can_load_file(url)
+        assert len(responses.calls) == 1
@@ -260,3 +260,44 @@ class TestCSVLoader:
         df = loader.load()
         assert isinstance(df, pd.DataFrame)
         assert df.shape[1] > 1
+
+    def test_encoding_error_after_sample(self, tmp_path):
+        """The encoding detected on the beginning of the file fails further in the file."""
+        file_path = tmp_path / "latin1.csv"
+        file_path.write_bytes(self.LATIN1_CSV.encode("latin1"))
+
+        loader = CSVLoader(file_path)
+        loader.sample_size = 16
+        df = loader.load()
+
+        assert df.shape == (3, 3)
+        assert df.iloc[0]["name"] == "José"
+        assert df.iloc[2]["city"] == "Montréal"
+
+    def test_character_split_by_sample(self, tmp_path):
+        """A multi-byte character split at the end of the sample does not change the encoding."""
+        file_path = tmp_path / "utf8.csv"
+        file_path.write_bytes(self.UTF8_CSV.encode("utf-8"))
+
+        loader = CSVLoader(file_path)
+        loader.sample_size = self.UTF8_CSV.encode("utf-8").index("é".encode("utf-8")) + 1
+        df = loader.load()
+
+        assert df.iloc[0]["name"] == "José"
+        assert df.iloc[1]["city"] == "Köln"
+
+    def test_process_from_decoded(self):
+        df = CSVLoader("data.csv", dtype={"age": str}).process_from_decoded(
+            self.WINDOWS_NEW_LINES
+        )
+        assert df["age"].tolist() == ["30", "25", "45"]
+
+    def test_known_encoding(self, setup_temp_csv_files):
+        """The encoding known from a previous load is used instead of being detected."""
+        loader = CSVLoader(setup_temp_csv_files["utf8.csv"])
+        assert loader.load().iloc[0]["name"] == "José"
+        assert loader.encoding == "utf-8-sig"
+
+        loader = CSVLoader(setup_temp_csv_files["utf8.csv"])
+        loader.encoding = "latin1"
+        assert loader.load().iloc[0]["name"] == "JosÃ©"
@@ -0,0 +1,46 @@
+import codecs
+from io import BytesIO
+
+import pytest
+
+from back.scripts.loaders.encoding import detect_encoding
+
+ENCODINGS = ["utf-8-sig", "windows-1252", "latin1", "utf-16"]
+
+
+@pytest.mark.parametrize(
+    "content, expected",
+    [
+        (b"", "utf-8-sig"),
+        (b"name,city\nJohn,Paris\n", "utf-8-sig"),
+        (codecs.BOM_UTF8 + "José,Köln\n".encode("utf-8"), "utf-8-sig"),
+        ("José,Köln\n".encode("utf-16"), "utf-16"),
+        ("José,Köln\n".encode("utf-16-le"), "utf-16"),
+        ("José,Köln\n".encode("latin1"), "windows-1252"),
+        # 0x81 is not defined in windows-1252
+        (b"Jos\x81,K\xf6ln\n", "latin1"),
+    ],
+)
+def test_detect_encoding(content, expected):
+    assert detect_encoding(BytesIO(content), ENCODINGS) == expected
+
+
+def test_detect_encoding_in_last_window():
+    content = b"a,b\n" * 100_000 + "José\n".encode("latin1")
+    assert detect_encoding(BytesIO(content), ENCODINGS, window_size=1024) == "windows-1252"
+
+
+def test_character_split_by_window():
+    content = ("é" * 100_000).encode("utf-8")
+    # The windows start in the middle of a character
+    assert detect_encoding(BytesIO(content), ENCODINGS, window_size=1001) == "utf-8-sig"
+
+
+def test_no_encoding():
+    assert detect_encoding(BytesIO(b"\xff\xfe\xfd"), ["utf-8"]) is None
+
+
+def test_stream_rewound():
+    stream = BytesIO(b"name,city\n")
+    detect_encoding(stream, ENCODINGS)
+    assert stream.tell() == 0
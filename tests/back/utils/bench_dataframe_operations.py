@@ -0,0 +1,70 @@
+"""
+Micro-benchmark of the pandas normalizers against their polars equivalents.
+
+Run from the root of the repository :
+    python -m tests.back.utils.bench_dataframe_operations --rows 10000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from back.scripts.utils.dataframe_operation import (
+    IdentifierFormat,
+    normalize_columns,
+    normalize_date,
+    normalize_identifiant,
+    normalize_montant,
+)
+
+
+def build_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    siret = pd.Series(rng.integers(10**12, 10**14, rows)).astype(str)
+    montant = pd.Series(rng.integers(0, 10**7, rows) / 100).map("{:,.2f} €".format)
+    date = pd.Series(
+        pd.to_datetime("2018-01-01") + pd.to_timedelta(rng.integers(0, 2000, rows), unit="D")
+    ).dt.strftime("%d/%m/%Y")
+    return pd.DataFrame({"idBeneficiaire": siret, "montant": montant, "dateConvention": date})
+
+
+def timed(func, *args, **kwargs) -> tuple[float, pd.DataFrame]:
+    start = time.perf_counter()
+    out = func(*args, **kwargs)
+    return time.perf_counter() - start, out
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    rows = parser.parse_args().rows
+    frame = build_frame(rows)
+
+    pandas_timings = {
+        "idBeneficiaire": timed(normalize_identifiant, frame, "idBeneficiaire"),
+        "montant": timed(normalize_montant, frame, "montant"),
+        "dateConvention": timed(normalize_date, frame, "dateConvention"),
+    }
+    polars_timings = {
+        "idBeneficiaire": timed(
+            normalize_columns, frame, identifiants={"idBeneficiaire": IdentifierFormat.SIRET}
+        ),
+        "montant": timed(normalize_columns, frame, montants=["montant"]),
+        "dateConvention": timed(normalize_columns, frame, dates=["dateConvention"]),
+    }
+    print(f"{rows} rows")
+    for column, (pandas_duration, expected) in pandas_timings.items():
+        polars_duration, out = polars_timings[column]
+        pd.testing.assert_series_equal(
+            out[column], expected[column], check_dtype=False, check_exact=False
+        )
+        print(
+            f"{column:<16} pandas {pandas_duration:7.2f}s  polars {polars_duration:7.2f}s"
+            f"  x{pandas_duration / polars_duration:.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
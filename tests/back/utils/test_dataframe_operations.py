@@ -2,16 +2,21 @@ from datetime import datetime, timedelta, timezone
 
 import numpy as np
 import pandas as pd
+import polars as pl
 import pytest
 
 from back.scripts.utils.dataframe_operation import (
     IdentifierFormat,
     clean_file_format,
+    detect_date_format,
     expand_json_columns,
     is_dayfirst,
+    normalize_columns,
     normalize_commune_code,
     normalize_date,
+    normalize_date_expr,
     normalize_identifiant,
+    normalize_identifiant_lazy,
     normalize_montant,
     safe_rename,
 )
@@ -36,53 +41,103 @@ def test_safe_rename(schema_dict, expected_columns):
     assert out.columns.tolist() == expected_columns
 
 
+def polars_normalize_identifiant(frame, id_col, format=IdentifierFormat.SIRET):
+    return normalize_columns(frame, identifiants={id_col: format})
+
+
+def polars_normalize_montant(frame, id_col):
+    return normalize_columns(frame, montants=[id_col])
+
+
+def polars_normalize_date(frame, id_col):
+    return normalize_columns(frame, dates=[id_col])
+
+
 def test_safe_rename_remove_accents():
     inp = pd.DataFrame({"idBénéficiaire": [1, 2, 3]})
     out = safe_rename(inp, {})
     assert out.columns.tolist() == ["idBeneficiaire"]
 
 
+@pytest.mark.parametrize("normalize", [normalize_identifiant, polars_normalize_identifiant])
 class TestNormalizeBeneficiaireIdentifiant:
-    def test_no_id(self):
+    def test_no_id(self, normalize):
         df = pd.DataFrame({"foo": [1]})
-        pd.testing.assert_frame_equal(df, normalize_identifiant(df, "idBeneficiaire"))
+        pd.testing.assert_frame_equal(df, normalize(df, "idBeneficiaire"))
 
-    def test_siren(self):
+    def test_siren(self, normalize):
         df = pd.DataFrame({"idBeneficiaire": ["123456789", "123456789", "12345678"]})
         expected_df = pd.DataFrame(
             {"idBeneficiaire": ["12345678900000", "12345678900000", "01234567800000"]}
         )
-        pd.testing.assert_frame_equal(expected_df, normalize_identifiant(df, "idBeneficiaire"))
+        pd.testing.assert_frame_equal(expected_df, normalize(df, "idBeneficiaire"))
 
-    def test_siren_format(self):
+    def test_siren_format(self, normalize):
         df = pd.DataFrame({"idBeneficiaire": ["123456789", "123456789", "12345678"]})
         expected_df = pd.DataFrame({"idBeneficiaire": ["123456789", "123456789", "012345678"]})
-        result = normalize_identifiant(df, "idBeneficiaire", format=IdentifierFormat.SIREN)
+        result = normalize(df, "idBeneficiaire", format=IdentifierFormat.SIREN)
         pd.testing.assert_frame_equal(expected_df, result)
 
-    def test_siret(self):
+    def test_siret(self, normalize):
         df = pd.DataFrame(
             {"idBeneficiaire": ["01234567890001", "01234567890001", "1234567890001"]}
         )
         expected_df = pd.DataFrame({"idBeneficiaire": ["01234567890001"] * 3})
-        pd.testing.assert_frame_equal(expected_df, normalize_identifiant(df, "idBeneficiaire"))
+        pd.testing.assert_frame_equal(expected_df, normalize(df, "idBeneficiaire"))
 
-    def test_no_siren_no_siret(self):
+    def test_no_siren_no_siret(self, normalize):
         df = pd.DataFrame({"idBeneficiaire": ["123456"]})
         with pytest.raises(RuntimeError, match="is neither siren not siret"):
-            normalize_identifiant(df, "idBeneficiaire")
+            normalize(df, "idBeneficiaire")
 
-    def test_clean_dot0(self):
+    def test_clean_dot0(self, normalize):
         df = pd.DataFrame(
             {"idBeneficiaire": ["01234567890001.0", "01234567890001.0", "1234567890001"]}
         )
         expected_df = pd.DataFrame({"idBeneficiaire": ["01234567890001"] * 3})
-        pd.testing.assert_frame_equal(expected_df, normalize_identifiant(df, "idBeneficiaire"))
+        pd.testing.assert_frame_equal(expected_df, normalize(df, "idBeneficiaire"))
 
-    def test_invalid_format(self):
+    def test_missing_ids(self, normalize):
+        df = pd.DataFrame({"idBeneficiaire": ["123456789", None, ""]})
+        expected_df = pd.DataFrame({"idBeneficiaire": ["12345678900000", np.nan, np.nan]})
+        result = normalize(df, "idBeneficiaire")
+        pd.testing.assert_frame_equal(expected_df, result)
+        assert result["idBeneficiaire"].map(type).tolist() == [str, float, float]
+
+    def test_invalid_format(self, normalize):
         df = pd.DataFrame({"idBeneficiaire": ["123456789", "123456788"]})
         with pytest.raises(RuntimeError, match="Format must be an IdentifierFormat enum value"):
-            normalize_identifiant(df, "idBeneficiaire", format="invalid")
+            normalize(df, "idBeneficiaire", format="invalid")
+
+
+class TestNormalizeIdentifiantLazy:
+    @pytest.mark.parametrize(
+        "values, format",
+        [
+            (["123456789", "123456789", "12345678"], IdentifierFormat.SIRET),
+            (["123456789", "123456789", "12345678"], IdentifierFormat.SIREN),
+            (
+                ["01234567890001.0", "01234567890001", None, "1234567890001"],
+                IdentifierFormat.SIRET,
+            ),
+            (["012 345 678 90001", "", "01234567890001"], IdentifierFormat.SIREN),
+        ],
+    )
+    def test_same_as_pandas(self, values, format):
+        expected = normalize_identifiant(pd.DataFrame({"id": values}), "id", format=format)
+        out = normalize_identifiant_lazy(
+            pl.LazyFrame({"id": values}, schema={"id": pl.String}), "id", format
+        ).collect()
+        assert out["id"].to_list() == expected["id"].replace({np.nan: None}).tolist()
+
+    def test_no_id(self):
+        frame = pl.LazyFrame({"foo": [1]})
+        assert normalize_identifiant_lazy(frame, "id").collect().equals(frame.collect())
+
+    def test_no_siren_no_siret(self):
+        frame = pl.LazyFrame({"id": ["123456"]})
+        with pytest.raises(RuntimeError, match="is neither siren not siret"):
+            normalize_identifiant_lazy(frame, "id")
 
 
 class TestExpandJsonColumns:
@@ -174,18 +229,81 @@ class TestExpandJsonColumns:
         ("06/07/0983", None),
         (None, None),
         ("", None),
+        ("15/03/2021 10:30", datetime(2021, 3, 15, 10, 30, tzinfo=timezone.utc)),
+        ("15/03/2021 10:30:00", datetime(2021, 3, 15, 10, 30, tzinfo=timezone.utc)),
+        ("2021/03/15 10:30:00", datetime(2021, 3, 15, 10, 30, tzinfo=timezone.utc)),
+        ("20210315", datetime(2021, 3, 15, 2, tzinfo=timezone.utc)),
+        ("2021-03", datetime(2021, 3, 1, tzinfo=timezone.utc)),
+        ("Jan 1, 2019", datetime(2019, 1, 1, tzinfo=timezone.utc)),
     ],
 )
-def test_normalize_date(input_value, expected_output):
+@pytest.mark.parametrize("normalize", [normalize_date, polars_normalize_date])
+def test_normalize_date(input_value, expected_output, normalize):
     df = pd.DataFrame({"date": [input_value]})
-    out = normalize_date(df, "date")
+    out = normalize(df, "date")
     if not pd.isna(expected_output):
         assert out["date"].iloc[0] == expected_output
     else:
-        assert pd.isna(normalize_date(df, "date")["date"].iloc[0])
+        assert pd.isna(out["date"].iloc[0])
     assert str(out["date"].dtype) == "datetime64[ns, UTC]"
 
 
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["06/07/2019", "25/12/2020"],
+        ["07/06/2019", "12/25/2020"],
+        ["2020-02-01", "2020-13-01", None, ""],
+        ["2019-05-13 00:00:00+00:00", "2020-01-02 10:00:00+02:00"],
+        ["2021-03-04T10:00:00Z", "2021-03-04T10:00:00.123Z"],
+        ["2021-03-04 10:00", "2021-03-05 11:30"],
+        ["2021-03-04T10:00"],
+        ["15/03/2021 10:30", "16/03/2021 11:00"],
+        ["15/03/2021 10:30:00", "2021/03/15 10:30:00"],
+        ["2021/03/15 10:30", "2021/03/16 11:00:00"],
+        ["03/15/2021 10:30", "03/16/2021 11:00"],
+        ["2021-03", "2021-04", None],
+        ["04.03.2021", "25.12.2020"],
+        ["2020", None, "2021"],
+        ["06/07/0983", "06/07/2019"],
+        [None, None],
+    ],
+)
+def test_normalize_date_expr_same_as_pandas(values):
+    expected = normalize_date(pd.DataFrame({"date": values}, dtype=object), "date")
+    frame = pl.DataFrame({"date": values}, schema={"date": pl.String})
+    out = frame.select(normalize_date_expr("date", pl.String))
+    pd.testing.assert_series_equal(out.to_pandas()["date"], expected["date"])
+
+    date_format = detect_date_format(frame.lazy(), "date")
+    out = frame.select(normalize_date_expr("date", pl.String, date_format))
+    pd.testing.assert_series_equal(out.to_pandas()["date"], expected["date"])
+
+
+def test_normalize_columns_keeps_index():
+    df = pd.DataFrame(
+        {
+            "id": ["123456789", "12345678", "123456789"],
+            "montant": ["1,50", "2", None],
+            "date": ["2020", None, "2021"],
+            "other": ["a", "b", "c"],
+        },
+        index=[3, 1, 2],
+    )
+    out = normalize_columns(
+        df,
+        identifiants={"id": IdentifierFormat.SIREN},
+        montants=["montant"],
+        dates=["date", "x"],
+    )
+    assert out.columns.tolist() == df.columns.tolist()
+    assert out.index.tolist() == [3, 1, 2]
+    assert out["id"].tolist() == ["123456789", "012345678", "123456789"]
+    assert out["montant"].tolist()[:2] == [1.5, 2.0]
+    assert out.loc[3, "date"] == datetime(2020, 1, 1, tzinfo=timezone.utc)
+    assert out["other"].tolist() == ["a", "b", "c"]
+
+
 class TestIsDayFirst:
     def test_is_day_first(self):
         dts = pd.Series(["2022-02-01", "2022-01-02", "12-05-2022"])
@@ -196,39 +314,40 @@ class TestIsDayFirst:
         assert is_dayfirst(dts)
 
 
+@pytest.mark.parametrize("normalize", [normalize_montant, polars_normalize_montant])
 class TestNormalizeMontant:
-    def test_column_not_present(self):
+    def test_column_not_present(self, normalize):
         df = pd.DataFrame({"other_col": [1, 2, 3]})
-        result = normalize_montant(df, "missing_col")
+        result = normalize(df, "missing_col")
         pd.testing.assert_frame_equal(result, df)
 
-    def test_already_float_column(self):
+    def test_already_float_column(self, normalize):
         df = pd.DataFrame({"amount": [1.0, 2.0, 3.0]})
-        result = normalize_montant(df, "amount")
+        result = normalize(df, "amount")
         pd.testing.assert_frame_equal(result, df)
 
-    def test_int_column_is_cast_to_float(self):
+    def test_int_column_is_cast_to_float(self, normalize):
         df = pd.DataFrame({"amount": [1, 2, 3]})
         expected = pd.DataFrame({"amount": [1.0, 2.0, 3.0]})
-        result = normalize_montant(df, "amount")
+        result = normalize(df, "amount")
         pd.testing.assert_frame_equal(result, expected)
 
-    def test_string_with_special_characters(self):
+    def test_string_with_special_characters(self, normalize):
         df = pd.DataFrame({"amount": ["1,500 €", "2 500 euros", "3,500.00", "125.3", "-1000"]})
         expected = pd.DataFrame({"amount": [1500.0, 2500.0, 3500.0, 125.3, 1000]})
-        result = normalize_montant(df, "amount")
+        result = normalize(df, "amount")
         pd.testing.assert_frame_equal(result, expected)
 
-    def test_null_values(self):
+    def test_null_values(self, normalize):
         df = pd.DataFrame({"amount": ["1,500 €", None, ""]})
         expected = pd.DataFrame({"amount": [1500.0, None, None]})
-        result = normalize_montant(df, "amount")
+        result = normalize(df, "amount")
         pd.testing.assert_frame_equal(result, expected)
 
-    def test_negative_numbers(self):
+    def test_negative_numbers(self, normalize):
         df = pd.DataFrame({"amount": [-1000.0, -2000.50, -300]})
         expected = pd.DataFrame({"amount": [1000.0, 2000.50, 300.0]})
-        result = normalize_montant(df, "amount")
+        result = normalize(df, "amount")
         pd.testing.assert_frame_equal(result, expected)
 
 
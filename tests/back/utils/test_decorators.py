@@ -0,0 +1,104 @@
+import json
+import tempfile
+from pathlib import Path
+
+import polars as pl
+import pytest
+
+from back.scripts.utils import metrics
+from back.scripts.utils.decorators import tracker
+
+
+class ListSink:
+    def __init__(self):
+        self.spans = []
+
+    def emit(self, span: dict) -> None:
+        self.spans.append(span)
+
+
+@tracker(rows=True)
+def child(n: int) -> pl.DataFrame:
+    return pl.DataFrame({"a": range(n)})
+
+
+@tracker
+def parent() -> None:
+    child(3)
+    child(2)
+
+
+@tracker
+def failing() -> None:
+    raise ValueError("boom")
+
+
+class TestTracker:
+    def setup_method(self):
+        self.sink = ListSink()
+        metrics.add_sink(self.sink)
+
+    def teardown_method(self):
+        metrics.clear_sinks()
+
+    def test_nested_spans(self):
+        parent()
+        first, second, root = self.sink.spans
+        assert [s["name"] for s in self.sink.spans] == ["child", "child", "parent"]
+        assert root["parent_id"] is None
+        assert first["parent_id"] == second["parent_id"] == root["span_id"]
+        assert first["trace_id"] == second["trace_id"] == root["trace_id"]
+        assert (first["rows"], second["rows"]) == (3, 2)
+        assert "rows" not in root
+        assert all(s["status"] == "ok" and s["cpu_time"] >= 0 for s in self.sink.spans)
+
+    def test_separate_traces(self):
+        child(1)
+        child(1)
+        assert self.sink.spans[0]["trace_id"] != self.sink.spans[1]["trace_id"]
+
+    def test_error_span(self):
+        with pytest.raises(ValueError):
+            failing()
+        assert self.sink.spans[0]["status"] == "error"
+        assert metrics.current_span() is None
+
+    def test_without_rss(self, monkeypatch):
+        monkeypatch.setattr(metrics, "resource", None)
+        assert metrics.peak_rss_mb() is None
+        child(1)
+        assert "peak_rss_delta_mb" not in self.sink.spans[0]
+
+    def test_attached_span(self):
+        metrics.attach_span(("trace", "remote"))
+        try:
+            child(1)
+        finally:
+            metrics.attach_span(None)
+        assert self.sink.spans[0]["trace_id"] == "trace"
+        assert self.sink.spans[0]["parent_id"] == "remote"
+
+
+def test_configured_sinks():
+    folder = Path(tempfile.mkdtemp())
+    metrics.configure_metrics(
+        {
+            "metrics": {
+                "jsonl_filename": folder / "spans.jsonl",
+                "prometheus_filename": folder / "metrics.prom",
+            }
+        }
+    )
+    try:
+        parent()
+    finally:
+        metrics.clear_sinks()
+
+    with open(folder / "spans.jsonl") as f:
+        spans = [json.loads(line) for line in f]
+    assert [s["name"] for s in spans] == ["child", "child", "parent"]
+
+    prometheus = (folder / "metrics.prom").read_text().splitlines()
+    assert 'eclaireur_tracker_calls_total{function="child"} 2.0' in prometheus
+    assert 'eclaireur_tracker_rows_total{function="child"} 5.0' in prometheus
+    assert 'eclaireur_tracker_calls_total{function="parent"} 1.0' in prometheus
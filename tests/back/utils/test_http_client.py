@@ -0,0 +1,199 @@
+import hashlib
+import json
+import time
+
+import pytest
+import requests
+import responses
+
+from back.scripts.utils import http_client
+from back.scripts.utils.http_client import HttpClient, configure_http_client, get_http_client
+
+
+class TestHttpClient:
+    @responses.activate
+    def test_download(self, tmp_path):
+        url = "https://example.com/file.csv"
+        responses.add(responses.GET, url, body="a,b\n1,2\n", headers={"ETag": '"v1"'})
+        responses.add(responses.GET, "https://example.com/missing.csv", status=404)
+
+        client = HttpClient(max_connections_per_host=1)
+        response = client.download(url, tmp_path / "file.csv", chunk_size=2)
+        assert response.headers["ETag"] == '"v1"'
+        assert (tmp_path / "file.csv").read_text() == "a,b\n1,2\n"
+
+        # The connection is released: a second request does not wait for it.
+        client.download(url, tmp_path / "file.csv")
+
+        with pytest.raises(requests.HTTPError):
+            client.download("https://example.com/missing.csv", tmp_path / "missing.csv")
+
+    @responses.activate
+    def test_download_not_modified(self, tmp_path):
+        url = "https://example.com/file.csv"
+        responses.add(responses.GET, url, status=304)
+        response = HttpClient().download(url, tmp_path / "file.csv")
+        assert response.status_code == 304
+        assert not (tmp_path / "file.csv").exists()
+
+    def test_download_local_file(self, tmp_path):
+        (tmp_path / "source.txt").write_text("content")
+        assert (
+            HttpClient().download(f"file:{tmp_path / 'source.txt'}", tmp_path / "copy.txt")
+            is None
+        )
+        assert (tmp_path / "copy.txt").read_text() == "content"
+
+    @responses.activate
+    def test_min_request_interval(self):
+        responses.add(responses.GET, "https://slow.example.com/", body="")
+        responses.add(responses.GET, "https://example.com/", body="")
+        client = HttpClient(min_request_interval={"slow.example.com": 0.1})
+
+        start = time.monotonic()
+        for _ in range(3):
+            client.get("https://example.com/")
+        assert time.monotonic() - start < 0.1
+        for _ in range(3):
+            client.get("https://slow.example.com/")
+        assert time.monotonic() - start >= 0.2
+
+
+CONTENT = b"".join(f"line {i:04d}\n".encode() for i in range(10))
+URL = "https://example.com/big.csv"
+
+
+def range_callback(content: bytes, etag: str = '"v1"', calls: list | None = None):
+    """
+    Serve the content as a server accepting ranges, for the current version `etag`.
+    """
+
+    def callback(request):
+        if calls is not None:
+            calls.append(dict(request.headers))
+        headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+        range_header = request.headers.get("Range")
+        if not range_header or request.headers.get("If-Range", etag) != etag:
+            return 200, headers, content
+        start, _, end = range_header.removeprefix("bytes=").partition("-")
+        start, end = int(start), int(end or len(content) - 1)
+        if start >= len(content):
+            return 416, headers | {"Content-Range": f"bytes */{len(content)}"}, b""
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+        return 206, headers, content[start : end + 1]
+
+    return callback
+
+
+class TestResumableDownload:
+    def _partial(self, tmp_path, size: int, validator: str = '"v1"'):
+        (tmp_path / "big.csv.part").write_bytes(CONTENT[:size])
+        (tmp_path / "big.csv.part.json").write_text(json.dumps({"validator": validator}))
+
+    @responses.activate
+    def test_resume_partial_file(self, tmp_path):
+        calls = []
+        responses.add_callback(
+            responses.GET, URL, callback=range_callback(CONTENT, calls=calls)
+        )
+        self._partial(tmp_path, 25)
+
+        response = HttpClient().download(URL, tmp_path / "big.csv")
+        assert response.status_code == 206
+        assert calls[0]["Range"] == "bytes=25-"
+        assert (tmp_path / "big.csv").read_bytes() == CONTENT
+        assert sorted(p.name for p in tmp_path.iterdir()) == ["big.csv"]
+
+    @responses.activate
+    def test_restart_changed_file(self, tmp_path):
+        responses.add_callback(responses.GET, URL, callback=range_callback(CONTENT, '"v2"'))
+        self._partial(tmp_path, 25)
+
+        HttpClient().download(URL, tmp_path / "big.csv")
+        assert (tmp_path / "big.csv").read_bytes() == CONTENT
+
+    @responses.activate
+    def test_complete_partial_file(self, tmp_path):
+        responses.add_callback(responses.GET, URL, callback=range_callback(CONTENT))
+        self._partial(tmp_path, len(CONTENT))
+
+        HttpClient().download(URL, tmp_path / "big.csv")
+        assert (tmp_path / "big.csv").read_bytes() == CONTENT
+
+    @responses.activate
+    def test_resume_interrupted_download(self, tmp_path):
+        callback = range_callback(CONTENT)
+        attempts = []
+
+        def interrupted(request):
+            attempts.append(request)
+            if len(attempts) == 1:
+                raise requests.ConnectionError("Connection reset by peer")
+            return callback(request)
+
+        responses.add_callback(responses.GET, URL, callback=interrupted)
+        HttpClient(resume_attempts=1).download(URL, tmp_path / "big.csv")
+        assert len(attempts) == 2
+        assert (tmp_path / "big.csv").read_bytes() == CONTENT
+
+        attempts.clear()
+        with pytest.raises(requests.ConnectionError):
+            HttpClient(resume_attempts=0).download(URL, tmp_path / "other.csv")
+        assert not (tmp_path / "other.csv").exists()
+
+    @responses.activate
+    def test_verification(self, tmp_path):
+        responses.add_callback(responses.GET, URL, callback=range_callback(CONTENT))
+        client = HttpClient()
+
+        checksum = hashlib.sha256(CONTENT).hexdigest()
+        client.download(
+            URL, tmp_path / "big.csv", expected_size=len(CONTENT), checksum=checksum
+        )
+        assert (tmp_path / "big.csv").read_bytes() == CONTENT
+
+        for options in [{"expected_size": 3}, {"checksum": hashlib.sha256(b"").hexdigest()}]:
+            with pytest.raises(RuntimeError):
+                client.download(URL, tmp_path / "invalid.csv", **options)
+            assert sorted(p.name for p in tmp_path.iterdir()) == ["big.csv"]
+
+    @responses.activate
+    def test_segmented_download(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(http_client, "MIN_SEGMENT_SIZE", 10)
+        calls = []
+        responses.add(
+            responses.HEAD,
+            URL,
+            headers={
+                "ETag": '"v1"',
+                "Accept-Ranges": "bytes",
+                "Content-Length": str(len(CONTENT)),
+            },
+        )
+        responses.add_callback(
+            responses.GET, URL, callback=range_callback(CONTENT, calls=calls)
+        )
+        # The first segment was downloaded by a previous call.
+        (tmp_path / "big.csv.part").write_bytes(CONTENT[:25] + b"\0" * (len(CONTENT) - 25))
+        (tmp_path / "big.csv.part.json").write_text(
+            json.dumps({"validator": '"v1"', "size": len(CONTENT), "segments": 4, "done": [0]})
+        )
+
+        HttpClient().download(URL, tmp_path / "big.csv", segments=4)
+        assert (tmp_path / "big.csv").read_bytes() == CONTENT
+        assert sorted(c["Range"] for c in calls) == [
+            "bytes=25-49",
+            "bytes=50-74",
+            "bytes=75-99",
+        ]
+
+
+def test_shared_client():
+    try:
+        configure_http_client({"http": {"user_agent": "eclaireur"}})
+        client = get_http_client()
+        assert get_http_client() is client
+        assert client.session.headers["User-Agent"] == "eclaireur"
+    finally:
+        configure_http_client({})
+    assert http_client._CLIENT is None
@@ -0,0 +1,59 @@
+import io
+from datetime import datetime
+
+import polars as pl
+import pytest
+
+from back.scripts.utils.psql_connector import (
+    _hash_expression,
+    create_table_statement,
+    to_copy_frame,
+)
+
+
+def test_create_table_statement():
+    schema = pl.Schema(
+        {
+            "id": pl.Int64,
+            "montant": pl.Float64,
+            "nom": pl.String,
+            "date": pl.Date,
+            "maj": pl.Datetime("us", "UTC"),
+            "codes": pl.List(pl.String),
+            'col "quoted"': pl.Boolean,
+        }
+    )
+    assert create_table_statement("marches_publics", schema) == (
+        'CREATE TABLE "marches_publics" ("id" BIGINT, "montant" DOUBLE PRECISION, '
+        '"nom" TEXT, "date" DATE, "maj" TIMESTAMP WITH TIME ZONE, "codes" TEXT[], '
+        '"col ""quoted""" BOOLEAN)'
+    )
+
+
+def test_to_copy_frame():
+    frame = pl.DataFrame(
+        {
+            "nom": ["a,b", "", None],
+            "codes": [["x", 'y"z'], [None, "a\\b"], None],
+            "titulaire": [{"id": 1}, {"id": None}, None],
+            "maj": [datetime(2024, 1, 2, 3, 4, 5), None, None],
+            "lots": [[{"x": 1}, None], [{"x": None}], None],
+        }
+    )
+    buffer = io.BytesIO()
+    to_copy_frame(frame).write_csv(buffer, include_header=False)
+    assert buffer.getvalue().decode().splitlines() == [
+        '"a,b","{""x"",""y\\""z""}","{""id"":1}",2024-01-02T03:04:05.000000,'
+        '"{""{\\""x\\"":1}"",NULL}"',
+        '"","{NULL,""a\\\\b""}","{""id"":null}",,"{""{\\""x\\"":null}""}"',
+        ",,,,",
+    ]
+
+    with pytest.raises(ValueError, match="nested list"):
+        to_copy_frame(pl.DataFrame({"codes": [[[1, 2], [3]]]}))
+
+
+def test_hash_expression():
+    assert _hash_expression(["siren", "id"]) == (
+        "encode(sha256(convert_to(jsonb_build_array(\"siren\", \"id\")::text, 'UTF8')), 'hex')"
+    )
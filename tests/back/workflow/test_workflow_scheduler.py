@@ -0,0 +1,104 @@
+import tempfile
+from pathlib import Path
+
+from back.scripts.workflow.workflow_scheduler import WorkflowScheduler
+
+
+class DummyWorkflow:
+    dependencies = []
+
+    @classmethod
+    def get_dependencies(cls) -> list:
+        return cls.dependencies
+
+    @classmethod
+    def from_config(cls, config: dict):
+        return cls(config)
+
+    def __init__(self, config: dict):
+        self.folder = Path(config["folder"])
+
+    def run(self) -> None:
+        missing = [d for d in self.dependencies if not (self.folder / d.__name__).exists()]
+        if missing:
+            raise RuntimeError(f"Missing dependencies for {type(self).__name__}")
+        with open(self.folder / "order.txt", "a") as f:
+            f.write(type(self).__name__ + "\n")
+        (self.folder / type(self).__name__).touch()
+
+
+class Root(DummyWorkflow):
+    pass
+
+
+class Independent(DummyWorkflow):
+    pass
+
+
+class Child(DummyWorkflow):
+    dependencies = [Root]
+
+
+class GrandChild(DummyWorkflow):
+    dependencies = [Child, Independent]
+
+
+class Failing(DummyWorkflow):
+    def run(self) -> None:
+        raise RuntimeError("Failure")
+
+
+class AfterFailing(DummyWorkflow):
+    dependencies = [Failing]
+
+    def run(self) -> None:
+        (self.folder / type(self).__name__).touch()
+
+
+class TestWorkflowScheduler:
+    def setup_method(self):
+        self.path = tempfile.TemporaryDirectory()
+        self.folder = Path(self.path.name)
+        self.config = {"folder": self.path.name}
+
+    def teardown_method(self):
+        self.path.cleanup()
+
+    def _order(self) -> list[str]:
+        return (self.folder / "order.txt").read_text().split()
+
+    def test_graph_ignores_unlisted_dependencies(self):
+        scheduler = WorkflowScheduler([Child, Independent], self.config)
+        assert scheduler.graph == {Child: set(), Independent: set()}
+
+    def test_classmethod_workflow(self):
+        scheduler = WorkflowScheduler([Root, Child.from_config], self.config)
+        assert scheduler.graph == {Root: set(), Child: {Root}}
+
+    def test_sequential_respects_dependencies(self):
+        WorkflowScheduler([GrandChild, Child, Independent, Root], self.config).run()
+        assert self._order() == ["Independent", "Root", "Child", "GrandChild"]
+
+    def test_parallel_respects_dependencies(self):
+        scheduler = WorkflowScheduler(
+            [GrandChild, Child.from_config, Independent, Root], self.config, max_workers=3
+        )
+        scheduler.run()
+        order = self._order()
+        assert sorted(order) == ["Child", "GrandChild", "Independent", "Root"]
+        assert order.index("Root") < order.index("Child") < order.index("GrandChild")
+        assert order.index("Independent") < order.index("GrandChild")
+        assert scheduler.failed == []
+
+    def test_failure_does_not_stop_dependents(self):
+        scheduler = WorkflowScheduler([Failing, AfterFailing, Root], self.config)
+        scheduler.run()
+        assert scheduler.failed == [Failing]
+        assert (self.folder / "AfterFailing").exists()
+        assert (self.folder / "Root").exists()
+
+    def test_parallel_failure(self):
+        scheduler = WorkflowScheduler([Failing, AfterFailing, Root], self.config, max_workers=2)
+        scheduler.run()
+        assert scheduler.failed == [Failing]
+        assert (self.folder / "AfterFailing").exists()